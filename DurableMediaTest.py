@@ -21,6 +21,8 @@ Usage examples: (Step 1 and 2 are obligatory, without setup publication is disab
     2) ./DurableMediaTest.py --publishers "{'10.0.20.140': ['31404']}" categories
     3) [public]./DurableMediaTest.py --publishers "{'10.0.20.140': ['31404']}" run
        [private] ./DurableMediaTest.py --publishers "{'10.0.20.140': ['31404']}" run  --private
+       [asyncio] ./DurableMediaTest.py --publishers "{'10.0.20.140': ['31404']}" run --engine asyncio -q 2000
+    4) [capacity] ./DurableMediaTest.py --publishers "{'10.0.20.140': ['31404']}" search -m 4 -q 512 --search_step 120
 
 Examples of publisher lists:
     --publishers "{'10.0.20.140': ['31404']}"
@@ -35,22 +37,47 @@ needed files:
     pdfs folder with pdf files to publish (not necessary for random documents test)
 """
 from requests import RequestException
+import requests
+import requests.adapters
 import base64
 
 try:
+    from DurableMediaTestCluster import AgentLink, Coordinator, RemoteReportSink, agentInfo, parseAddress, pubsMap, splitPublishers
     from DurableMediaTestConfig import Config
+    from DurableMediaTestController import createController
+    from DurableMediaTestHistogram import HistogramSet
+    from DurableMediaTestMetrics import FIELD_INDEX, STATUSES, MetricsBoard
+    from DurableMediaTestPayload import ContentHasher, Corpus, CorpusWriter, PayloadTemplate, PdfCache, serializePdf
+    from DurableMediaTestProfile import Profiler, mergeCollapsed, profileDirectory, profileLabel
+    from DurableMediaTestReport import EXTENSIONS, ReportColumns, ReportSink
+    from DurableMediaTestSearch import LevelResult, ThroughputSearch
+    from DurableMediaTestTransport import EnvelopeTemplates, RawPublisherEndpoint, namespaceFromWsdl
+    from DurableMediaTestWorkers import ShardPlan, packShards, planShards, workersCount
     from soap import SoapAPI
 except ImportError:
+    from colony_scripts.colony.tests.DurableMediaTestCluster import AgentLink, Coordinator, RemoteReportSink, agentInfo, parseAddress, pubsMap, splitPublishers
     from colony_scripts.colony.tests.DurableMediaTestConfig import Config
+    from colony_scripts.colony.tests.DurableMediaTestController import createController
+    from colony_scripts.colony.tests.DurableMediaTestHistogram import HistogramSet
+    from colony_scripts.colony.tests.DurableMediaTestMetrics import FIELD_INDEX, STATUSES, MetricsBoard
+    from colony_scripts.colony.tests.DurableMediaTestPayload import ContentHasher, Corpus, CorpusWriter, PayloadTemplate, PdfCache, serializePdf
+    from colony_scripts.colony.tests.DurableMediaTestProfile import Profiler, mergeCollapsed, profileDirectory, profileLabel
+    from colony_scripts.colony.tests.DurableMediaTestReport import EXTENSIONS, ReportColumns, ReportSink
+    from colony_scripts.colony.tests.DurableMediaTestSearch import LevelResult, ThroughputSearch
+    from colony_scripts.colony.tests.DurableMediaTestTransport import EnvelopeTemplates, RawPublisherEndpoint, namespaceFromWsdl
+    from colony_scripts.colony.tests.DurableMediaTestWorkers import ShardPlan, packShards, planShards, workersCount
     from colony_scripts.colony.tests.soap import SoapAPI
 
 
 import argparse
 import os
 import time
+import asyncio
 import concurrent.futures
 import threading
 import hashlib
+import math
+import heapq
 import logging
 import traceback
 import datetime
@@ -61,30 +88,137 @@ import random
 import signal
 import sys
 import base58
+import copy
 import glob
-from collections import defaultdict
-from pathlib import Path
+from collections import defaultdict, deque
 # from pdfrw import PdfReader, PdfWriter
-from io import BytesIO
 from threading import Lock
 
 logger = logging.getLogger("DurableMediaTest")
 
 global_state = None
+# writer process of the report, inherited by forked publisher processes, see DurableMediaTestReport
+report_sink = None
+# shared memory table of live metrics (--metrics_port), inherited by forked publisher processes, see DurableMediaTestMetrics
+metrics_board = None
+# agent action: link to coordinator in the main process, records and results of publishers are shipped over it,
+# see DurableMediaTestCluster
+cluster_link = None
 
 mutex = Lock()
 
 def signal_handler(sig, frame):
     logger.warning('Exiting, signal {} called'.format(sig))
+    global_state.interrupted.set()
     global_state.exit.set()
 
 
+class EndpointRegistry:
+    """
+    Process wide cache of PublisherEndpoint objects and HTTP sessions keyed by (ip, port).
+    WSDL is parsed once per publisher and process, and all calls to one publisher share a bounded
+    keep-alive connection pool instead of opening fresh TCP connections.
+    Registry is reset in a forked worker, sockets are not shared between processes.
+    With raw=True hot path operations go through RawPublisherEndpoint sharing the same session.
+    """
+    def __init__(self, pool_size=10):
+        self.lock = threading.Lock()
+        self.pool_size = pool_size
+        self.wsdl_dir = 'soap'
+        self.templates = None
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.endpoints = {}
+        self.sessions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, pool_size, wsdl_dir=None):
+        with self.lock:
+            self.pool_size = max(pool_size, 1)
+            if wsdl_dir is not None:
+                self.wsdl_dir = wsdl_dir
+
+    def _checkFork(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def getSession(self, ip, port):
+        key = (str(ip), str(port))
+        with self.lock:
+            self._checkFork()
+            session = self.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[key] = session
+            return session
+
+    def getTemplates(self):
+        with self.lock:
+            if self.templates is None:
+                self.templates = EnvelopeTemplates(namespaceFromWsdl(self.wsdl_dir))
+            return self.templates
+
+    def getEndpoint(self, ip, port, raw=False):
+        key = (str(ip), str(port), raw)
+        with self.lock:
+            self._checkFork()
+            endpoint = self.endpoints.get(key)
+            if endpoint is not None:
+                self.hits += 1
+                return endpoint
+            self.misses += 1
+        if raw:
+            endpoint = RawPublisherEndpoint(ip, port, self.getTemplates(), self.getSession(ip, port))
+        else:
+            endpoint = SoapAPI.PublisherEndpoint(ip, port)
+            self._useSession(endpoint, self.getSession(ip, port))
+        with self.lock:
+            return self.endpoints.setdefault(key, endpoint)
+
+    def getEndpointForUrl(self, url, raw=False):
+        pubPort = url.split(":")[-1]
+        pubIp = url.split(":")[1].strip('/')
+        return self.getEndpoint(pubIp, pubPort, raw)
+
+    @staticmethod
+    def _useSession(endpoint, session):
+        # zeep keeps its requests session in client.transport
+        for holder in (endpoint, getattr(endpoint, 'client', None)):
+            transport = getattr(holder, 'transport', None)
+            if transport is not None and hasattr(transport, 'session'):
+                transport.session = session
+                return True
+        return False
+
+    def stats(self):
+        connections = 0
+        requestsSent = 0
+        with self.lock:
+            for session in self.sessions.values():
+                for adapter in set(session.adapters.values()):
+                    for key in adapter.poolmanager.pools.keys():
+                        pool = adapter.poolmanager.pools[key]
+                        connections += pool.num_connections
+                        requestsSent += pool.num_requests
+            return {'endpoint_hits': self.hits, 'endpoint_misses': self.misses, 'connections': connections, 'requests': requestsSent}
+
+
+endpoint_registry = EndpointRegistry()
+# serialized source pdfs of --pdf_file and --use_predefined_pdfs, see PdfCache
+pdf_cache = PdfCache()
+
+
 
 class ExtendedDocsPublishingManager:
 
     def getEndpoint(self, ip, port):
-        endpoint = SoapAPI.PublisherEndpoint(ip, port)
-        return endpoint
+        return endpoint_registry.getEndpoint(ip, port)
 
     def getPublisherId(self, endpoint):
         ans = endpoint.Hello()
@@ -155,6 +289,8 @@ class ExtendedDocsPublishingManager:
 class GlobalState:
     def __init__(self):
         self.exit = multiprocessing.Event()
+        # set only by signal, exit is also set when a run ends normally
+        self.interrupted = multiprocessing.Event()
         self.lock = multiprocessing.Lock()
 
 
@@ -164,9 +300,131 @@ class LoopStats:
         self.stats_checked_ready = 0
         self.stats_checked_in_progress = 0
         self.stats_checked_not_active = 0
+        self.scheduled = 0
+
+
+class SlotScheduler:
+    """ Priority queue of publication slots keyed by the time each slot is due next. """
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def schedule(self, pub, due):
+        with self.condition:
+            heapq.heappush(self.heap, (due, next(self.counter), pub))
+            self.condition.notify()
+
+    def popDue(self, timeout):
+        """ Returns slot that is due, waiting at most timeout seconds. Returns None if no slot got due in time. """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.heap and self.heap[0][0] <= now:
+                    return heapq.heappop(self.heap)[2]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self.heap:
+                    wait = min(wait, self.heap[0][0] - now)
+                self.condition.wait(wait)
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class StatusPollPolicy:
+    """
+    Decides when publication in progress should be asked for its status again.
+    'fixed' polls every poll_interval. 'adaptive' learns how long publications of this publisher take after
+    publish call returned, measured by the local clock only (middle between the last poll in progress and
+    the PUBLISHING-OK one, as TaskStatusTracker of the asset test), so clock skew of publishers does not shift
+    polls. It skips polls until publication is close to its expected end, polls every poll_interval around it and backs off exponentially,
+    up to max_poll_interval, for stragglers.
+    """
+    WARMUP = 20
+    SPREAD = 2
+
+    def __init__(self, adaptive, poll_interval, max_poll_interval):
+        self.adaptive = adaptive
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(max_poll_interval, poll_interval)
+        self.count = 0
+        self.mean = 0
+        self.m2 = 0
+        # publications finish on threads of the pool, interleaved updates could leave m2 negative
+        self.lock = threading.Lock()
+
+    def observe(self, duration):
+        # Welford
+        with self.lock:
+            self.count += 1
+            delta = duration - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (duration - self.mean)
+
+    def nextPoll(self, pub, now):
+        if not self.adaptive or pub.start is None:
+            return now + self.poll_interval
+        with self.lock:
+            count, mean, m2 = self.count, self.mean, self.m2
+        if count < self.WARMUP:
+            return now + self.poll_interval
+        std = math.sqrt(m2 / (count - 1))
+        expected = pub.timeToInit + mean
+        windowStart = expected - self.SPREAD * std
+        windowEnd = expected + self.SPREAD * std
+        elapsed = now - pub.start
+        if elapsed + self.poll_interval < windowStart:
+            return pub.start + windowStart
+        if elapsed <= windowEnd:
+            return now + self.poll_interval
+        pub.stragglerPolls += 1
+        return now + min(self.poll_interval * 2 ** pub.stragglerPolls, self.max_poll_interval)
+
+
+class ArrivalSchedule:
+    """
+    Timetable of publication starts in open-loop mode (--rate). Arrivals come at constant intervals or as Poisson
+    process, independent of completions. Due arrivals wait in backlog with their intended start until a slot is admitted.
+    """
+    def __init__(self, rate, poisson=False, start=None):
+        self.rate = rate
+        self.poisson = poisson
+        self.rng = random.Random()
+        self.next = time.time() if start is None else start
+        self.backlog = deque()
+        self.finished = False
+
+    def collect(self, now):
+        while not self.finished and self.next <= now:
+            self.backlog.append(self.next)
+            self.next += self.rng.expovariate(self.rate) if self.poisson else 1 / self.rate
+
+    def stop(self):
+        """ No more documents to publish. """
+        self.finished = True
+        self.backlog.clear()
+
+    def pending(self):
+        return not self.finished or bool(self.backlog)
+
+    def wait(self, now, limit):
+        """ Seconds until next arrival, at most limit. """
+        if self.finished:
+            return limit
+        return min(limit, max(self.next - now, 0))
 
 
 class PublicationSlot:
+    __slots__ = (
+        'publisher', 'status', 'start', 'jobId', 'startBrgTime', 'hashContent', 'blockchainAddress', 'taskId',
+        'createdBrgTime', 'publishedBrgTime', 'readStart', 'timeToInit', 'updateCount', 'updateConst', 'cif',
+        'readerEndpoint', 'readerUrl', 'content', 'additional_details', 'documentMainCategory', 'title',
+        'receiver_url', 'retentionDate', 'statusPolls', 'stragglerPolls', 'intendedStart', 'polledAt',
+    )
+
     def __init__(self, publisher, status, blockchainAddress = None, updateCount = 0, readerEndpoint = None, readerUrl = None):
         self.publisher = publisher
         self.status = status
@@ -191,6 +449,12 @@ class PublicationSlot:
         self.title = 'Random title'
         self.receiver_url = publisher
         self.retentionDate = Utils.getRandomRetention()
+        self.statusPolls = 0
+        self.stragglerPolls = 0
+        # arrival time from --rate timetable, None when publication starts as soon as slot is free
+        self.intendedStart = None
+        # local time of the last status poll answered in progress
+        self.polledAt = None
 
     def resetToReadyToPublish(self):
         self.updateCount -= 1
@@ -209,6 +473,10 @@ class PublicationSlot:
         self.publishedBrgTime = None
         self.readStart = None
         self.timeToInit = 0
+        self.statusPolls = 0
+        self.stragglerPolls = 0
+        self.intendedStart = None
+        self.polledAt = None
         self.cif = 'no_cif'
         #self.readerEndpoint = None
 
@@ -231,39 +499,135 @@ class PublicationSlot:
 
 
 class SinglePublisherResult:
-    def __init__(self):
+    def __init__(self, url=None):
+        self.url = url
         self.mean_duration = 0
-        self.publications = []
+        self.mean_time_to_init = 0
+        self.publications = ReportColumns()
         self.publishedOk = 0
         self.publishedFail = 0
+        # failed publications by status
+        self.failures = {}
+        # latency histograms by metric, publisher and status, see DurableMediaTestHistogram
+        self.histograms = HistogramSet()
+        # GetPublishStatus calls for successful publications, done and needed with fixed poll_interval
+        self.statusPolls = 0
+        self.statusPollsFixed = 0
+        # time spent getting payloads of publications and opening their source (corpus) [s]
+        self.payloadTime = 0
+        self.payloads = 0
+        self.payloadStartup = 0
+        # slot activation lock, see TimedLock
+        self.lockAcquisitions = 0
+        self.lockContended = 0
+        self.lockWait = 0
+
+
+class TimedLock:
+    """ Lock that measures how long threads waited for it. Uncontended acquire is not timed. """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.waitTime = 0.0
+
+    def __enter__(self):
+        if not self.lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            self.contended += 1
+            self.waitTime += time.perf_counter() - start
+        self.acquisitions += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+    def stats(self):
+        return {'acquisitions': self.acquisitions, 'contended': self.contended, 'wait': round(self.waitTime, 6)}
+
+
+class PublisherShard:
+    """
+    Counters and results of one thread. Counters only grow and are written by the owning thread without any lock,
+    results are guarded by the shard's own lock which is contended only when they are collected.
+    """
+    __slots__ = ('ok', 'fail', 'lock', 'publications', 'publishedOk', 'publishedFail', 'failures', 'durationSum', 'timeToInitSum',
+                 'histograms', 'statusPolls', 'statusPollsFixed')
+
+    def __init__(self):
+        self.ok = 0
+        self.fail = 0
+        self.lock = threading.Lock()
+        self.publications = ReportColumns()
+        self.publishedOk = 0
+        self.publishedFail = 0
+        self.failures = {}
+        self.durationSum = 0.0
+        self.timeToInitSum = 0.0
+        self.histograms = HistogramSet()
+        self.statusPolls = 0
+        self.statusPollsFixed = 0
 
 
 class MutatingPublisherState:
     def __init__(self, csv_reader = None):
-        self.publisherLock = threading.Lock()
+        # guards slot activation (active, max_active, reservation of documents)
+        self.publisherLock = TimedLock()
         self.fileLock = threading.Lock()
         self.docHashLock = threading.Lock()
 
-        self.index = 0
-        self.localPublishedFail = 0
-        self.localPublishedOk = 0
+        self.indexCounter = itertools.count(1)
+        self.shards = []
+        self.shardsLock = threading.Lock()
+        self.local = threading.local()
+        # totals of shard counters at the last resetLocalCounts
+        self.localBaseline = (0, 0)
         self.active = 0
         self.max_active = 0
         self.csv_reader = csv_reader
         self.doc_hashes = []
 
+    def shard(self):
+        """ PublisherShard of the calling thread. """
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = PublisherShard()
+            with self.shardsLock:
+                self.shards.append(shard)
+        return shard
+
+    def allShards(self):
+        with self.shardsLock:
+            return list(self.shards)
+
     def incGetIndex(self):
-        with self.publisherLock:
-            self.index += 1
-            return self.index
+        # next() of itertools.count is atomic
+        return next(self.indexCounter)
 
     def incLocalPublishedFail(self):
-        with self.publisherLock:
-            self.localPublishedFail += 1
+        self.shard().fail += 1
 
     def incLocalPublishedOk(self):
-        with self.publisherLock:
-            self.localPublishedOk += 1
+        self.shard().ok += 1
+
+    def localCounts(self):
+        """ Successful and failed publications since the last resetLocalCounts. """
+        shards = self.allShards()
+        return (sum(shard.ok for shard in shards) - self.localBaseline[0],
+                sum(shard.fail for shard in shards) - self.localBaseline[1])
+
+    def resetLocalCounts(self):
+        ok, fail = self.localCounts()
+        self.localBaseline = (self.localBaseline[0] + ok, self.localBaseline[1] + fail)
+
+    @property
+    def localPublishedOk(self):
+        return self.localCounts()[0]
+
+    @property
+    def localPublishedFail(self):
+        return self.localCounts()[1]
 
     def getNextAddr(self):
         with self.docHashLock:
@@ -276,12 +640,14 @@ class MutatingPublisherState:
 
 
 class SinglePublisherState:
-    def __init__(self, conf, url, to_publish, private=False, reportCatalog = None, readUrl = None):
+    def __init__(self, conf, url, to_publish, private=False, reportCatalog = None, readUrl = None, shard = None):
         self.conf = conf
-        self.result = SinglePublisherResult()
+        self.result = SinglePublisherResult(url)
         self.to_publish = to_publish
+        # part of the publisher run by this state, see DurableMediaTestWorkers
+        self.shard = shard or ShardPlan(url, 0, 1, to_publish)
         self.binaries = {}
-        self.trailer = None
+        self.payloadTemplates = {}
         self.url = url
         self.readerUrl = readUrl
         self.private = private
@@ -294,27 +660,38 @@ class SinglePublisherState:
         if reportCatalog:
             self.reportCatalog += '/'
         self.gen = None
+        self.executor = None
+        # SOAP calls in flight at once with asyncio engine, see asyncCallLimit
+        self.asyncCalls = 1
+        self.corpus = None
+        # corpus has no more publications for this publisher, also with --test_duration
+        self.exhausted = False
+        self.hasher = None
+        self.controller = None
+        self.arrivals = None
+        # (time, publishedOk) of the last metrics board update
+        self.metricsMark = None
+        self.cycleCifList = None
+        self.loop_stats = None
+        self.pollPolicy = None
         # TODO stworzenie generatora dokumentow do publikacji
 
     def initSharedState(self):
         if self.conf.csv_file is not None:
             file = open(Utils.md5(str.encode(self.url)) + '.csv', 'r')
-            self.mut = MutatingPublisherState(csv_reader=csv.reader(file))
+            self.mut = MutatingPublisherState(csv_reader=self.shard.items(csv.reader(file)))
         else:
             self.mut = MutatingPublisherState()
+        self.pollPolicy = StatusPollPolicy(self.conf.poll_policy == 'adaptive', self.conf.poll_interval, self.conf.max_poll_interval)
 
     def getEndpoint(self):
         if self.endpoint is None:
-            pubPort = self.url.split(":")[-1]
-            pubIp = self.url.split(":")[1].strip('/')
-            self.endpoint = SoapAPI.PublisherEndpoint(pubIp, pubPort)
+            self.endpoint = endpoint_registry.getEndpointForUrl(self.url, raw=self.conf.transport == 'raw')
         return self.endpoint
 
     def getReaderEndpoint(self):
         url = next(self.readerUrl)
-        pubPort = url.split(":")[-1]
-        pubIp = url.split(":")[1].strip('/')
-        self.readerEndpoint = SoapAPI.PublisherEndpoint(pubIp, pubPort)
+        self.readerEndpoint = endpoint_registry.getEndpointForUrl(url, raw=self.conf.transport == 'raw')
         return self.readerEndpoint, url
 
     def printProgress(self, width = 50, percents = None, concurrent=None):
@@ -346,7 +723,8 @@ class SinglePublisherState:
             read_time = None,
             prev_doc = None,
             published_by = None,
-            read_by=None):
+            read_by=None,
+            intended_start=None):
         pubTime = round(self.conf.getTime() - start, self.conf.ACC)
         pubEndTime = self.conf.getTime()
 
@@ -366,6 +744,8 @@ class SinglePublisherState:
             published_by = 'NA'
         if read_by is None:
             read_by = 'NA'
+        if intended_start is None:
+            intended_start = start
         logger.debug('addToReport status:' + status)
         if status == "FINISHED_OK":
             success = True
@@ -378,36 +758,54 @@ class SinglePublisherState:
         if not start_brg_time:
             start_brg_time = .0
 
-        pub = {
-            'doc_hash': blockchainAddress,
-            'md5': contentHash,
-            'pub_task_id': jobId,
-            'pub_address': url,
-            'cif': cif,
-            'dur_time': pubTime,
-            'status': status,
-            'pub_end_time': pubEndTime,
-            'threads': max_active,
-            'start_brg_time': start_brg_time,
-            'create_brg_time': create_brg_time,
-            'published_brg_time': published_brg_time,
-            'time_to_init': time_to_init,
-            'dur_brg_time': duration_brg_time,
-            'dur_read_time': read_time,
-            'prev_doc': prev_doc,
-            'published_by': published_by,
-            'read_by': read_by
-        }
-
         logger.info("{} {} {} {} {} {:3.3f} {:<11} {} {:3.3f} {}".format(blockchainAddress, jobId, contentHash, url, cif, pubTime, status, pubEndTime, duration_brg_time, max_active))
-        with self.mut.publisherLock:
-            self.result.publications.append(pub)
+        shard = self.mut.shard()
+        with shard.lock:
+            shard.publications.append(
+                blockchainAddress, contentHash, jobId, url, cif, pubTime, status, pubEndTime, max_active, start_brg_time,
+                create_brg_time, published_brg_time, duration_brg_time, time_to_init, read_time, prev_doc, published_by, read_by,
+                intended_start, start)
+            shard.histograms.record(url, status, (
+                ('dur_time', pubTime), ('dur_brg_time', duration_brg_time), ('time_to_init', time_to_init),
+                ('dur_read_time', None if read_time == 'NA' else read_time)))
             if success:
-                self.result.publishedOk += 1
-                # https://math.stackexchange.com/a/106720
-                self.result.mean_duration = self.result.mean_duration + ((duration_brg_time - self.result.mean_duration) / self.result.publishedOk)
+                shard.publishedOk += 1
+                shard.durationSum += duration_brg_time
+                shard.timeToInitSum += time_to_init
             else:
-                self.result.publishedFail += 1
+                shard.publishedFail += 1
+                shard.failures[status] = shard.failures.get(status, 0) + 1
+
+    def collectResults(self):
+        """ Moves results recorded by threads into self.result, done at loop boundary. """
+        for shard in self.mut.allShards():
+            with shard.lock:
+                publications, shard.publications = shard.publications, ReportColumns()
+                publishedOk, publishedFail, durationSum, timeToInitSum = shard.publishedOk, shard.publishedFail, shard.durationSum, shard.timeToInitSum
+                statusPolls, statusPollsFixed = shard.statusPolls, shard.statusPollsFixed
+                failures, shard.failures = shard.failures, {}
+                histograms, shard.histograms = shard.histograms, HistogramSet()
+                shard.publishedOk = shard.publishedFail = shard.statusPolls = shard.statusPollsFixed = 0
+                shard.durationSum = shard.timeToInitSum = 0.0
+            self.result.publications.extend(publications)
+            if self.controller is not None:
+                for status, dur_brg_time, time_to_init in zip(publications.column('status'), publications.column('dur_brg_time'), publications.column('time_to_init')):
+                    self.controller.observe(status == 'FINISHED_OK', dur_brg_time, time_to_init)
+            if publishedOk:
+                total = self.result.publishedOk + publishedOk
+                self.result.mean_duration = (self.result.mean_duration * self.result.publishedOk + durationSum) / total
+                self.result.mean_time_to_init = (self.result.mean_time_to_init * self.result.publishedOk + timeToInitSum) / total
+                self.result.publishedOk = total
+            self.result.publishedFail += publishedFail
+            for status, count in failures.items():
+                self.result.failures[status] = self.result.failures.get(status, 0) + count
+            self.result.histograms.merge(histograms)
+            self.result.statusPolls += statusPolls
+            self.result.statusPollsFixed += statusPollsFixed
+        lockStats = self.mut.publisherLock.stats()
+        self.result.lockAcquisitions = lockStats['acquisitions']
+        self.result.lockContended = lockStats['contended']
+        self.result.lockWait = lockStats['wait']
 
     def reserveDocumentsToRead(self, to_reserve):
         successfullyReserved = 0
@@ -421,6 +819,8 @@ class SinglePublisherState:
         return successfullyReserved
 
     def reserveDocumentsToPublish(self, to_reserve):
+        if self.exhausted:
+            return 0
         if self.conf.test_duration > 0:
             return to_reserve
         if self.conf.csv_file:
@@ -434,87 +834,61 @@ class SinglePublisherState:
         return max_to_publish
 
     def getRandomContent(self, sizeKB, suffix):
-        # lock?
+        """
+        Random document of sizeKB. Random block is generated once per size and shared by all publications,
+        returned Payload only holds unique suffix placed after the shared block (in WhoAmI with --pdf_file).
+        """
         if sizeKB not in self.binaries:
-            self.binaries[sizeKB] = os.urandom(1024 * sizeKB)
+            with mutex:
+                if sizeKB not in self.binaries:
+                    binary = os.urandom(1024 * sizeKB)
+                    self.payloadTemplates[sizeKB] = PayloadTemplate(str.encode("%PDF-1.1") + binary)
+                    self.binaries[sizeKB] = binary
         if self.conf.pdf_file is not None:
-            from pdfrw import PdfReader, PdfWriter
-            if self.trailer is None:
-                trailer = PdfReader(self.conf.pdf_file)
-            trailer.Info.WhoAmI = str.encode(suffix) + self.binaries[sizeKB]
-
-            myio = BytesIO()
-            PdfWriter(trailer=trailer).write(myio)
-            myio.seek(0)
-            result = myio.getvalue()
-        else:
-            result = str.encode("%PDF-1.1") + str.encode(suffix) + self.binaries[sizeKB]
-        return result
+            return pdf_cache.whoAmI(self.conf.pdf_file, self.binaries[sizeKB]).render(str.encode(suffix))
+        return self.payloadTemplates[sizeKB].render(str.encode(suffix))
 
     def getNextPdf(self, sufix=""):
+        additional_details = 'Here be PUBLIC additional details'
+        documentMainCategory = 'ROOT'
+        cif = None
+        receiver_url = self.url
+        title = 'RandomText_i' + sufix
+
+        if self.corpus is not None:
+            with mutex:
+                if self.gen is None:
+                    self.gen = self.shard.items(self.corpus.publications(self.url))
+                publication = next(self.gen, None)
+                if publication is None:
+                    self.exhausted = True
+                    self.to_publish = 0
+            if publication is None:
+                return None, additional_details, documentMainCategory, None, cif, receiver_url
+            return (self.corpus.documents(publication), publication['additional_details'], publication['category'],
+                    list(publication['title']), publication['cif'], publication['receiver_url'])
+
+        if not self.conf.use_predefined_pdfs:
+            content = self.getRandomContent(int(self.conf.sizeKB), sufix)
+            return [content], additional_details, documentMainCategory, [title], cif, receiver_url
+
+        # only the pdf getter is shared, parsing goes through pdf_cache without the lock
         with mutex:
-            additional_details = 'Here be PUBLIC additional details'
-            documentMainCategory = 'ROOT'
-            cif = None
-            receiver_url = self.url
-            title = 'RandomText_i' + sufix
-
-            if not self.conf.use_predefined_pdfs:
-                content = self.getRandomContent(int(self.conf.sizeKB), sufix)
-                return [content], additional_details, documentMainCategory, [title], cif, receiver_url
-
             if self.gen is None:
-                self.gen = self.conf.pdf_getter(self.url)
+                self.gen = self.shard.items(self.conf.pdf_getter(self.url))
             try:
-                from pdfrw import PdfReader, PdfWriter
                 pdf_path, additional_details, documentMainCategory, title, cif, receiver_url = next(self.gen)
             except Exception as err:
                 print(err)
                 raise err
-                return None, additional_details,  documentMainCategory, title, cif, receiver_url
-            result_pdfs = []
-            for pdf in pdf_path:
-                trailer = PdfReader(pdf)
-                myio = BytesIO()
-                PdfWriter(trailer=trailer).write(myio)
-                myio.seek(0)
-                result_pdfs.append(myio.getvalue())
+        result_pdfs = [pdf_cache.document(pdf).render() for pdf in pdf_path]
         return result_pdfs, additional_details, documentMainCategory, title, cif, receiver_url
 
-    def calculateQueue(self, minimum, maximum):
-        max_active_now = self.mut.max_active
-        if maximum < 0:
-            if self.mut.localPublishedOk / (self.mut.localPublishedOk + self.mut.localPublishedFail) < 0.95:
-                maximum = max_active_now
-            else:
-                step = maximum *-1
-                max_active_now += step
-        else:
-            if self.mut.localPublishedFail >= self.mut.localPublishedOk:
-                if int(max_active_now / 2) < minimum:
-                    max_active_now = minimum
-                else:
-                    max_active_now = int(max_active_now / 2)
-            elif 8 * self.mut.localPublishedFail >= self.mut.localPublishedOk:
-                if int(max_active_now / 1.5 < minimum):
-                    max_active_now = minimum
-                else:
-                    max_active_now = int(max_active_now / 1.5)
-            elif self.mut.localPublishedFail > 0:
-                if int(max_active_now / 1.1 < minimum):
-                    max_active_now = minimum
-                else:
-                    max_active_now = int(max_active_now / 1.1)
-            else:
-                if max(int(max_active_now * 1.2), max_active_now + 1) > maximum:
-                    max_active_now = maximum
-                else:
-                    max_active_now = max(int(max_active_now * 1.2), max_active_now + 1)
-        return max_active_now, maximum
-
     def handleReadySlot(self, pub: PublicationSlot, loop_stats: LoopStats):
         with self.mut.publisherLock:
-            if self.mut.active <= self.mut.max_active and (pub.updateCount > 0 or self.reserveDocumentsToPublish(1) == 1):
+            # in open-loop mode new publications start only on arrivals, slot continues only with updates of its document
+            reuse = pub.updateCount > 0 or (self.arrivals is None and self.reserveDocumentsToPublish(1) == 1)
+            if self.mut.active <= self.mut.max_active and reuse:
                 loop_stats.added_ready += 1
                 if self.conf.read_only:
                     pub.resetToReadyToRead()
@@ -525,7 +899,61 @@ class SinglePublisherState:
             self.mut.active -= 1
             return False
 
+    def callEndpoint(self, endpoint, operation, params):
+        if endpoint is None:
+            time.sleep(params)
+            return None
+        return getattr(endpoint, operation)(params)
+
+    async def callEndpointAsync(self, endpoint, operation, params):
+        if endpoint is None:
+            await asyncio.sleep(params)
+            return None
+        if hasattr(endpoint, 'callAsync'):
+            return await endpoint.callAsync(operation, params, self.asyncCalls)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, getattr(endpoint, operation), params)
+
     def processPublication(self, pub: PublicationSlot, loop_stats, threadNo):
+        steps = self.publicationSteps(pub, loop_stats, threadNo)
+        answer = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    call = steps.send(answer)
+                else:
+                    call = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                answer, error = self.callEndpoint(*call), None
+            except Exception as e:
+                answer, error = None, e
+
+    async def processPublicationAsync(self, pub: PublicationSlot, loop_stats, threadNo):
+        steps = self.publicationSteps(pub, loop_stats, threadNo)
+        answer = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    call = steps.send(answer)
+                else:
+                    call = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                answer, error = await self.callEndpointAsync(*call), None
+            except Exception as e:
+                answer, error = None, e
+
+    def publicationSteps(self, pub: PublicationSlot, loop_stats, threadNo):
+        """
+        State machine of a single publication slot. Every SOAP call is yielded as (endpoint, operation, params)
+        and its answer is sent back by the engine driving the slot (processPublication or processPublicationAsync).
+        Endpoint None means sleep for params seconds.
+        """
         global global_state
         try:
             repeatPub = True
@@ -538,25 +966,37 @@ class SinglePublisherState:
                     start = self.conf.getTime()
                     index = self.mut.incGetIndex()
                     if not pub.content:
+                        payloadStart = time.perf_counter()
                         pub.content, pub.additional_details, pub.documentMainCategory, pub.title, pub.cif, pub.receiver_url = self.getNextPdf(str(index) + 'A' + str(threadNo) + 'time' + str(start) + '@' + self.url)
+                        self.result.payloadTime += time.perf_counter() - payloadStart
+                        self.result.payloads += 1
+                        if pub.content is None and self.exhausted:
+                            # no more documents, slot is retired
+                            with self.mut.publisherLock:
+                                pub.setNotActive()
+                                self.mut.active -= 1
+                            return True
+                        if pub.content is None or pub.title is None:
+                            raise BaseException(f'Problem with pdf getter {pub.content is None} or {pub.title is None}')
                         if len(pub.content) > 1:
                             pub.updateCount = len(pub.content) - 1
                             pub.content.reverse()
                             pub.title.reverse()
-                    if pub.content is None or pub.title is None:
-                        raise BaseException(f'Problem with pdf getter {pub.content is None} or {pub.title is None}')
                     if len(pub.content) != len(pub.title):
                         raise BaseException('Problem with pdf getter, len(pub.content) != len(pub.title)')
                     creationDate = str(int(start) * 10**6)
-                    hashContent = Utils.md5(pub.content[-1])
+                    hashContent = self.hasher.hexdigest(pub.content[-1])
                     randomText = 'RandomText_i' + str(index) + 't' + str(threadNo) + '@' + self.url
                     title = pub.title.pop() or randomText
                     content = pub.content.pop()
+                    if self.conf.transport != 'raw':
+                        # zeep needs whole document, raw transport streams shared part of Payload
+                        content = bytes(content)
                     try:
                         sendStartTime = self.conf.getTime()
                         if self.conf.private_for_publisher:
                             pub.cif = pub.cif or next(self.cif)
-                            retPublish = self.getEndpoint().PublishPrivateDocument({
+                            retPublish = yield self.getEndpoint(), 'PublishPrivateDocument', {
                                 'publisherCif': 'none',
                                 'publicationMode': 'NEW',
                                 'documentData': {
@@ -573,10 +1013,10 @@ class SinglePublisherState:
                                 },
                                 'authorizedUsersList': pub.cif,
                                 'sendAuthorizationCodes': 'true',
-                            })
+                            }
                         elif self.private:
 
-                            retPublish = self.getEndpoint().PublishPrivateDocument({
+                            retPublish = yield self.getEndpoint(), 'PublishPrivateDocument', {
                                 'publisherCif': pub.cif or self.cif,
                                 'publicationMode': 'NEW',
                                 'documentData': {
@@ -592,12 +1032,12 @@ class SinglePublisherState:
                                     'privateAdditionalDetails': 'Here be PRIVATE additional details',
                                 },
                                 'sendAuthorizationCodes': 'true',
-                            })
+                            }
                         else:
                             if pub.blockchainAddress is None and self.conf.update:
                                 pub.blockchainAddress = self.mut.getNextAddr()
                             if pub.blockchainAddress is not None:
-                                retPublish = self.getEndpoint().PublishPublicDocument({
+                                retPublish = yield self.getEndpoint(), 'PublishPublicDocument', {
                                     'publicationMode': 'UPDATED',
                                     'documentData': {
                                         'title': title,
@@ -610,9 +1050,9 @@ class SinglePublisherState:
                                         'BLOCKCHAINretentionDate': pub.retentionDate,
                                         'extension': 'PDF',
                                     }
-                                })
+                                }
                             else:
-                                retPublish = self.getEndpoint().PublishPublicDocument({
+                                retPublish = yield self.getEndpoint(), 'PublishPublicDocument', {
                                     'publicationMode': 'NEW',
                                     'documentData': {
                                         'title': title,
@@ -625,7 +1065,7 @@ class SinglePublisherState:
                                         'extension': 'PDF',
                                         'additionalDetails': pub.additional_details,
                                     }
-                                })
+                                }
                         if self.conf.debug9000:
                             logger.debug('response: ' + str(retPublish))
                         try:
@@ -650,22 +1090,22 @@ class SinglePublisherState:
                         else:
                             logger.warning("Failed publication %s %s %s %s %s %s", self.url, status, jobId, self.mut.max_active, threadNo, index)
                             self.addToReport(start, jobId, None, hashContent, status, self.url, self.mut.max_active,
-                                             start_brg_time=startBrgTime, create_brg_time=None, published_brg_time=None, time_to_init=0, cif=pub.cif)
+                                             start_brg_time=startBrgTime, create_brg_time=None, published_brg_time=None, time_to_init=0, cif=pub.cif, intended_start=pub.intendedStart)
                             self.mut.incLocalPublishedFail()
                         sendTime = (self.conf.getTime() - sendStartTime)
                         timeToSleep = self.conf.send_delay - sendTime
                         if timeToSleep > 0:
-                            time.sleep(timeToSleep)
+                            yield None, 'sleep', timeToSleep
                     except RequestException as e:
                         logger.error("Sending publishDocumentRequest to {} failed - {} - {}".format(self.url, str(e), type(e)) )
                         self.addToReport(start, None, None, hashContent, 'COMMUNICATION_PROBLEM',
-                                         self.url, self.mut.max_active, 0, 0, 0, 0, cif=pub.cif)
+                                         self.url, self.mut.max_active, 0, 0, 0, 0, cif=pub.cif, intended_start=pub.intendedStart)
                         self.mut.incLocalPublishedFail()
                         return False
                     except ConnectionError as e:
                         logger.error("Sending publishDocumentRequest to {} failed - {} - {}".format(self.url, str(e), type(e)) )
                         self.addToReport(start, None, None, hashContent, 'COMMUNICATION_PROBLEM',
-                                         self.url, self.mut.max_active, 0, 0, 0, 0, cif=pub.cif)
+                                         self.url, self.mut.max_active, 0, 0, 0, 0, cif=pub.cif, intended_start=pub.intendedStart)
                         self.mut.incLocalPublishedFail()
                         return False
                     finally:
@@ -693,7 +1133,8 @@ class SinglePublisherState:
                             create_brg_time=pub.createdBrgTime,
                             published_brg_time=pub.publishedBrgTime,
                             time_to_init=pub.timeToInit,
-                            cif=pub.cif)
+                            cif=pub.cif,
+                            intended_start=pub.intendedStart)
 
                         self.mut.incLocalPublishedFail()
                         self.handleReadySlot(pub, loop_stats)
@@ -707,16 +1148,13 @@ class SinglePublisherState:
                             pub.blockchainAddress = self.mut.getNextAddr()
                         if pub.readerEndpoint is None:
                             pub.readerEndpoint, pub.readerUrl = self.getReaderEndpoint()
-                        retRead = pub.readerEndpoint.GetDocument({
+                        retRead = yield pub.readerEndpoint, 'GetDocument', {
                             'documentType': 'PUBLIC',
                             'documentBlockchainAddress': pub.blockchainAddress
-                        })
+                        }
                         readTime = self.conf.getTime()
                         if retRead.status.status == 'PUBLISHING-OK':
-                            if "previousDocumentBlockchainAddress" in retRead.documentInfo.documentData.__values__.keys():
-                                prev_doc = retRead.documentInfo.documentData.previousDocumentBlockchainAddress
-                            else:
-                                prev_doc = 'NA'
+                            prev_doc = getattr(retRead.documentInfo.documentData, 'previousDocumentBlockchainAddress', None) or 'NA'
                             publishedBy = retRead.documentInfo.documentBlockchainData.publisherId
                             self.mut.incLocalPublishedOk()
                             if self.conf.write_on_disk:
@@ -738,7 +1176,8 @@ class SinglePublisherState:
                                 read_time = readTime - pub.readStart,
                                 prev_doc = prev_doc,
                                 published_by = publishedBy,
-                                read_by = pub.readerUrl)
+                                read_by = pub.readerUrl,
+                                intended_start=pub.intendedStart)
                             self.handleReadySlot(pub, loop_stats)
                             repeatPub = True
                             continue
@@ -759,7 +1198,8 @@ class SinglePublisherState:
                                 create_brg_time=pub.createdBrgTime,
                                 published_brg_time=pub.publishedBrgTime,
                                 time_to_init=pub.timeToInit,
-                                cif=pub.cif)
+                                cif=pub.cif,
+                                intended_start=pub.intendedStart)
 
                         self.handleReadySlot(pub, loop_stats)
                         continue
@@ -767,7 +1207,7 @@ class SinglePublisherState:
                     except RequestException as e:
                         logger.error("Sending getDocument to {} failed - {} - {}".format(self.url, str(e), type(e)) )
                         self.addToReport(start, None, None, hashContent, 'COMMUNICATION_READ_PROBLEM',
-                                         self.url, self.mut.max_active, 0, 0, 0, 0, cif=pub.cif)
+                                         self.url, self.mut.max_active, 0, 0, 0, 0, cif=pub.cif, intended_start=pub.intendedStart)
                         self.mut.incLocalPublishedFail()
 
                 elif pub.status == "IN_PROGRESS":
@@ -787,7 +1227,8 @@ class SinglePublisherState:
                             create_brg_time=None,
                             published_brg_time=None,
                             time_to_init=pub.timeToInit,
-                            cif=pub.cif)
+                            cif=pub.cif,
+                            intended_start=pub.intendedStart)
 
                         self.mut.incLocalPublishedFail()
                         self.handleReadySlot(pub, loop_stats)
@@ -797,9 +1238,10 @@ class SinglePublisherState:
                     jobId = pub.jobId
                     hashContent = pub.hashContent
                     try:
-                        retPublishStatus = self.getEndpoint().GetPublishStatus({
+                        pub.statusPolls += 1
+                        retPublishStatus = yield self.getEndpoint(), 'GetPublishStatus', {
                             'jobId': jobId,
-                        })
+                        }
                         status = retPublishStatus.status.status
                         if self.conf.debug9000:
                             logger.debug('response:' + str(retPublishStatus))
@@ -809,6 +1251,7 @@ class SinglePublisherState:
                             pub.createdBrgTime = Utils.getPythonTimestampFromMicrosecondsString(retPublishStatus.BLOCKCHAINpublicationDate)
                             pub.publishedBrgTime = Utils.getPythonTimestampFromMicrosecondsString(
                                 retPublishStatus.BLOCKCHAINestimMinPropagationTime)
+                            self.recordStatusPolls(pub)
                             if self.read_after:
                                 pub.status = 'READY_TO_READ'
                                 repeatPub = True
@@ -826,7 +1269,8 @@ class SinglePublisherState:
                                 published_brg_time=pub.publishedBrgTime,
                                 time_to_init=pub.timeToInit,
                                 cif=pub.cif,
-                                prev_doc= prev_addr)
+                                prev_doc= prev_addr,
+                                intended_start=pub.intendedStart)
 
                             self.mut.incLocalPublishedOk()
                             self.handleReadySlot(pub, loop_stats)
@@ -835,11 +1279,12 @@ class SinglePublisherState:
 
                         elif status == 'PUBLISHING-INITIATED' or status == 'NOT-ADDED-TO-MAINBOX':
                             logger.debug('status:' + status)
+                            pub.polledAt = self.conf.getTime()
                         else:
                             pubTime = round(self.conf.getTime() - start, self.conf.ACC)
                             logger.warning("Publication failed %s %s %s %s %s %s", self.url, jobId, pubTime, hashContent, status, self.conf.getTime())
                             self.addToReport(start, jobId, None, hashContent, status, self.url, self.mut.max_active,
-                                             start_brg_time=startBrgTime, create_brg_time=None, published_brg_time=None,time_to_init=0, cif=pub.cif)
+                                             start_brg_time=startBrgTime, create_brg_time=None, published_brg_time=None,time_to_init=0, cif=pub.cif, intended_start=pub.intendedStart)
                             self.mut.incLocalPublishedFail()
                             self.handleReadySlot(pub, loop_stats)
                             continue
@@ -847,7 +1292,7 @@ class SinglePublisherState:
                     except RequestException as e:
                         logger.error("Sending getPublishStatus to {} failed - {}".format(self.url, str(e)))
                         self.addToReport(start, jobId, None, hashContent, 'COMMUNICATION_PROBLEM', self.url, self.mut.max_active,
-                                         start_brg_time=startBrgTime, create_brg_time=0, published_brg_time=0, time_to_init=0, cif=pub.cif)
+                                         start_brg_time=startBrgTime, create_brg_time=0, published_brg_time=0, time_to_init=0, cif=pub.cif, intended_start=pub.intendedStart)
                         self.mut.incLocalPublishedFail()
                         self.handleReadySlot(pub, loop_stats)
                     except BaseException:
@@ -862,30 +1307,49 @@ class SinglePublisherState:
             logger.error(traceback.format_exc())
         return True
 
-    def sendPublishDocument(self, sleep_for, move_intermediate_results, printProgress = False):
+    def newSlot(self):
+        if self.conf.read_only:
+            return PublicationSlot(publisher=self.url, status='READY_TO_READ')
+        elif self.conf.update:
+            return PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', blockchainAddress=self.mut.getNextAddr())
+        elif self.conf.update_immediate > 0:
+            return PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', updateCount=self.conf.update_immediate)
+        elif self.conf.read_after:
+            readerEndpoint, readerUrl = self.getReaderEndpoint()
+            return PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', readerUrl=readerUrl, readerEndpoint=readerEndpoint)
+        return PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH')
+
+    def prepareRun(self, sleep_for):
         """
-        Main loop, checks all publications from slots in publicationsInProgress. Each slot handles one publication,
-        after publication end new publication is started in same slot. After number of publications size of publicationsInProgress
-        is adjusted based on success rate of publications.
-        Loop ends when all documents are published.
+        Common start of both engines: sets up shared state, identities and the first batch of slots.
+        Returns None when the run cannot start.
         """
-        logger.info("Start process for publisher {}, sleeping {}s".format(self.url, sleep_for))
+        logger.info("Start process for publisher {}, sleeping {}s".format(self.shard.label, sleep_for))
         time.sleep(sleep_for)
 
-        global global_state
         self.initSharedState()
-        startTime = self.conf.getTime()
+        endpoint_registry.configure(max(self.conf.threads_per_publisher, 1), self.conf.wsdl_dir)
+        pdf_cache.configure(self.conf.pdf_cache_mb * 1024 * 1024)
+        self.hasher = ContentHasher(self.conf.digest)
+        if self.conf.corpus_file is not None:
+            startup = time.perf_counter()
+            self.corpus = Corpus(self.conf.corpus_file)
+            self.result.payloadStartup = time.perf_counter() - startup
+            logger.info("%s corpus %s opened in %.3fs, %d publications", self.url, self.conf.corpus_file,
+                        self.result.payloadStartup, len(self.corpus.publications(self.url)))
         minimum = self.conf.min_queue_size
         maximum = self.conf.max_queue_size
+        self.metricsMark = (time.time(), 0)
         self.cif = None
+        self.cycleCifList = None
         if self.private:
             logger.info('I will publish only private docs!')
             ext_docs_pub_mngr = ExtendedDocsPublishingManager()
             publishersCif = ext_docs_pub_mngr.mapPubList(self.conf)
             if publishersCif is None:
-                return False
-            cycleCifList = itertools.cycle(publishersCif[self.url])
-            self.cif = next(cycleCifList)
+                return None
+            self.cycleCifList = itertools.cycle(publishersCif[self.url])
+            self.cif = next(self.cycleCifList)
         if self.conf.private_for_publisher:
             ext_docs_pub_mngr = ExtendedDocsPublishingManager()
             self.cif = ext_docs_pub_mngr.cyclePubHashForMe(self.conf, self.url)
@@ -895,105 +1359,338 @@ class SinglePublisherState:
         self.mut.max_active = int((minimum + maximum) / 2)
         if(maximum < 0):
             self.mut.max_active = minimum
-        publicationsInProgress = []
+        self.controller = createController(self.conf.controller, minimum, maximum, self.conf.controller_window,
+                                           target=self.conf.latency_target)
+        if self.conf.rate:
+            # open loop: -q only caps publications in progress, slots are started by admitArrivals
+            self.mut.max_active = abs(maximum)
+            self.arrivals = ArrivalSchedule(self.conf.rate, self.conf.arrival == 'poisson')
+            logger.info("%s open loop, %s arrivals at %.3f/s", self.url, self.conf.arrival, self.conf.rate)
+            return [], minimum, maximum
 
         reserved_num = self.reserveDocumentsToPublish(self.mut.max_active)
-        for _ in range(reserved_num):
-            if self.conf.read_only:
-                publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_READ'))
-            elif self.conf.update:
-                publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', blockchainAddress=self.mut.getNextAddr()))
-            elif self.conf.update_immediate > 0:
-                publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', updateCount=self.conf.update_immediate))
-            else:
-                if self.conf.read_after:
-                    readerEndpoint, readerUrl = self.getReaderEndpoint()
-                    publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', readerUrl=readerUrl, readerEndpoint = readerEndpoint))
-                else:
-                    publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH'))
+        publicationsInProgress = [self.newSlot() for _ in range(reserved_num)]
         self.mut.active = reserved_num
+        return publicationsInProgress, minimum, maximum
+
+    def adjustQueue(self, publicationsInProgress, minimum, maximum):
+        """
+        Resizes publicationsInProgress after every controller window of finished publications, returns new maximum.
+        New size is decided by --controller, see DurableMediaTestController.
+        """
+        localOk, localFail = self.mut.localCounts()
+        if self.arrivals is not None or localOk + localFail < self.controller.window:
+            return maximum
+        self.collectResults()
+        logger.debug("Published documents:" + str(self.result.publishedOk) + "." + " Active: " + str(self.mut.active) +
+                     'localPublishedFail: ' + str(localFail) + ' localPublishedOk: ' + str(localOk))
+
+        old_max_active = self.mut.max_active
+        self.mut.max_active = self.controller.update(old_max_active, localOk, localFail)
+        maximum = self.controller.maximum
+        logger.debug("%s controller: %s", self.url, self.controller.state())
+
+        self.mut.resetLocalCounts()
+        if self.mut.max_active > old_max_active:
+            logger.info('Increasing concurrent publications from ' + str(old_max_active) + ' to ' + str(self.mut.max_active))
+            new_to_publish = self.reserveDocumentsToPublish(self.mut.max_active - old_max_active)
+            for _ in range(new_to_publish):
+                publicationsInProgress.append(self.newSlot())
+                self.mut.active += 1
+        elif old_max_active > self.mut.max_active:
+            logger.info('Decreasing concurrent publications from ' + str(old_max_active) + ' to ' + str(self.mut.max_active))
+        return maximum
+
+    def admitArrivals(self, publicationsInProgress):
+        """ Open-loop mode: adds slots for due arrivals while less than max_active publications are in progress. """
+        if self.arrivals is None:
+            return
+        self.arrivals.collect(time.time())
+        with self.mut.publisherLock:
+            while self.arrivals.backlog and self.mut.active < self.mut.max_active:
+                if self.reserveDocumentsToPublish(1) != 1:
+                    self.arrivals.stop()
+                    break
+                pub = self.newSlot()
+                pub.intendedStart = self.arrivals.backlog.popleft()
+                publicationsInProgress.append(pub)
+                self.mut.active += 1
+
+    def updateMetrics(self, force=False):
+        """ Writes current totals of the publisher to the shared metrics board about every metrics_board.interval. """
+        if metrics_board is None:
+            return
+        now = time.time()
+        last, lastOk = self.metricsMark
+        if not force and now - last < metrics_board.interval:
+            return
+        self.collectResults()
+        throughput = (self.result.publishedOk - lastOk) / (now - last) if now > last else 0.0
+        metrics_board.update(self.shard.label, throughput, self.mut.active, self.mut.max_active, self.result.publishedOk,
+                             self.result.failures, self.result.histograms)
+        self.metricsMark = (now, self.result.publishedOk)
+
+    def hasWork(self):
+        return self.mut.active > 0 or (self.arrivals is not None and self.arrivals.pending())
+
+    def loopWait(self):
+        """ How long the main loop may block, shortened to the next arrival in open-loop mode. """
+        if self.arrivals is None:
+            return self.conf.poll_interval
+        return self.arrivals.wait(time.time(), self.conf.poll_interval)
+
+    def nextDue(self, pub: PublicationSlot):
+        """ Time at which slot should be processed again. Slots ready to publish are due immediately. """
+        now = time.time()
+        if pub.status == 'READY_TO_PUBLISH':
+            return now
+        if pub.status == 'READY_TO_READ' and pub.readStart is None:
+            return now
+        if pub.status == 'IN_PROGRESS':
+            return self.pollPolicy.nextPoll(pub, now)
+        return now + self.conf.poll_interval
+
+    def recordStatusPolls(self, pub: PublicationSlot):
+        # local clock only, publishedBrgTime and startBrgTime come from clocks of publisher and client
+        initiated = pub.start + pub.timeToInit
+        inProgress = pub.polledAt if pub.polledAt is not None else initiated
+        self.pollPolicy.observe((inProgress + self.conf.getTime()) / 2 - initiated)
+        shard = self.mut.shard()
+        with shard.lock:
+            shard.statusPolls += pub.statusPolls
+            shard.statusPollsFixed += max(math.ceil((self.conf.getTime() - pub.start - pub.timeToInit) / self.conf.poll_interval), 1)
+
+    def isFinished(self, startTime, minimum):
+        if self.conf.test_duration > 0 and self.conf.getTime() - startTime > self.conf.test_duration:
+            logger.warning("time passed, finishing thread... {}".format(self.url))
+            global_state.exit.set()
+            return True
+        if self.conf.early_finish and self.mut.active < minimum:
+            logger.warning("active publications number is less than min, finishing thread... {}".format(self.url))
+            global_state.exit.set()
+            return True
+        return False
+
+    def flushPublications(self, move_intermediate_results):
+        self.collectResults()
+        batch = SinglePublisherResult()
+        batch.publications, self.result.publications = self.result.publications, ReportColumns()
+        move_intermediate_results(batch)
+
+    def reportStats(self, startTime, statsStart, loop_stats, move_intermediate_results, printProgress):
+        """ Periodic bookkeeping done every SLEEP_AFTER_CHECK seconds by both engines. """
+        self.collectResults()
+        if len(self.result.publications) > 1000:
+            logger.debug("%s merging results", self.url)
+            self.flushPublications(move_intermediate_results)
+        if printProgress:
+            if self.conf.test_duration > 0:
+                self.printProgress(percents=(self.conf.getTime() - startTime) / self.conf.test_duration *100, concurrent=self.mut.max_active)
+        statsEnd = self.conf.getTime()
+        logger.info("Url: {} statsStart: {:.3f} statsEnd: {:.3f} active: {} max_active: {} scheduled: {} processed[ready:{} in_progress:{} not_active:{}] added_ready:{} status_polls: {}/{}".format(
+            self.url, statsStart, statsEnd, self.mut.active, self.mut.max_active, loop_stats.scheduled, loop_stats.stats_checked_ready, loop_stats.stats_checked_in_progress, loop_stats.stats_checked_not_active, loop_stats.added_ready,
+            self.result.statusPolls, self.result.statusPollsFixed))
+        logger.info("Url: {} endpoint registry: {} publisher lock: {}".format(self.url, endpoint_registry.stats(), self.mut.publisherLock.stats()))
+        logger.info("Url: {} dur_brg_time {}".format(self.url, self.result.histograms.summary('dur_brg_time', 'FINISHED_OK')))
+        if self.private and loop_stats.added_ready >= self.mut.active:
+            self.cif = next(self.cycleCifList)
+
+    def runPublisher(self, sleep_for, move_intermediate_results, printProgress = False):
+        """ Entry of publisher worker process, sendPublishDocument under --profile. """
+        if self.conf.profile is None:
+            return self.sendPublishDocument(sleep_for, move_intermediate_results, printProgress)
+        with Profiler(self.conf.profile, profileDirectory(self.reportCatalog.rstrip('/')), profileLabel(self.shard.label), self.conf.profile_interval):
+            return self.sendPublishDocument(sleep_for, move_intermediate_results, printProgress)
+
+    def sendPublishDocument(self, sleep_for, move_intermediate_results, printProgress = False):
+        """
+        Main loop. Each slot from publicationsInProgress handles one publication, after publication end new publication
+        is started in same slot. Slots wait in SlotScheduler until they are due: ready slots are dispatched to the
+        thread pool immediately, slots in progress are polled every poll_interval seconds. After number of publications
+        number of slots is adjusted based on success rate of publications.
+        Loop ends when all documents are published.
+        With --engine asyncio the same loop runs as coroutines on one event loop, see sendPublishDocumentAsync.
+        """
+        if self.conf.engine == 'asyncio':
+            return asyncio.run(self.sendPublishDocumentAsync(sleep_for, move_intermediate_results, printProgress))
+
+        prepared = self.prepareRun(sleep_for)
+        if prepared is None:
+            return False
+        publicationsInProgress, minimum, maximum = prepared
+        startTime = self.conf.getTime()
 
         threads_per_publisher = min(self.conf.threads_per_publisher, maximum)
         if threads_per_publisher < 0:
             threads_per_publisher = self.conf.threads_per_publisher
-        executor = concurrent.futures.ThreadPoolExecutor(threads_per_publisher)
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads_per_publisher)
+        freeWorkers = threading.Semaphore(threads_per_publisher)
+        scheduler = SlotScheduler()
+        errors = []
         threadNo = 0
 
-        while self.mut.active > 0 and not global_state.exit.is_set():
-            publicationsInProgress = list(filter(lambda x: x.status != 'NOT_ACTIVE', publicationsInProgress))
-
-            cycleStart = self.conf.getTime()
-            if self.mut.localPublishedOk + self.mut.localPublishedFail >= 100:
-                logger.debug("Published documents:" + str(self.result.publishedOk) + "." + " Active: " + str(self.mut.active) +
-                             'localPublishedFail: ' + str(self.mut.localPublishedFail) + ' localPublishedOk: ' + str(self.mut.localPublishedOk))
-
-                old_max_active = self.mut.max_active
-                self.mut.max_active, maximum = self.calculateQueue(minimum=minimum, maximum=maximum)
-
-                self.mut.localPublishedOk = 0
-                self.mut.localPublishedFail = 0
-                if self.mut.max_active > old_max_active:
-                    logger.info('Increasing concurrent publications from ' + str(old_max_active) + ' to ' + str(self.mut.max_active))
-                    new_to_publish = self.reserveDocumentsToPublish(self.mut.max_active - old_max_active)
-                    for _ in range(new_to_publish):
-                        if self.conf.read_only:
-                            publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_READ'))
-                        elif self.conf.update:
-                            publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', blockchainAddress=self.mut.getNextAddr()))
-                        elif self.conf.update_immediate > 0:
-                            publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH', updateCount=self.conf.update_immediate))
-                        else:
-                            publicationsInProgress.append(PublicationSlot(publisher=self.url, status='READY_TO_PUBLISH'))
-                        self.mut.active += 1
-                elif old_max_active > self.mut.max_active:
-                    logger.info('Decreasing concurrent publications from ' + str(old_max_active) + ' to ' + str(self.mut.max_active))
-
-            loop_stats = LoopStats()
-            futures = []
-            for pub in publicationsInProgress:
-                # content, additional_details, documentMainCategory, title = self.getNextPdf()
-                futures.append(executor.submit(self.processPublication, pub, loop_stats, threadNo))
-                threadNo += 1
-            concurrent.futures.wait(futures, timeout=None)
-
-            for future in futures:
-                if future.exception():
-                    logger.error("Thread pool: encountered exception: %s", future.exception())
-                    return False, self.result
-                if not future.result():
-                    logger.error("Thread pool: encountered exception: %s", future.exception())
-                    return False, self.result
-
-            if self.conf.test_duration > 0 and self.conf.getTime() - startTime > self.conf.test_duration:
-                logger.warning("time passed, finishing thread... {}".format(self.url))
-                global_state.exit.set()
-                break
-            if self.conf.early_finish and self.mut.active < minimum:
-                logger.warning("active publications number is less than min, finishing thread... {}".format(self.url))
-                global_state.exit.set()
+        def runSlot(pub, threadNo):
+            try:
+                if not self.processPublication(pub, loop_stats, threadNo):
+                    errors.append('publication slot failed')
+                elif pub.isActive():
+                    scheduler.schedule(pub, self.nextDue(pub))
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                freeWorkers.release()
+
+        for pub in publicationsInProgress:
+            scheduler.schedule(pub, time.time())
+        loop_stats = LoopStats()
+        statsStart = self.conf.getTime()
+
+        while self.hasWork() and not global_state.exit.is_set():
+            if errors:
+                logger.error("Thread pool: encountered exception: %s", errors[0])
+                self.executor.shutdown()
+                return False, self.result
+
+            newSlots = []
+            maximum = self.adjustQueue(newSlots, minimum, maximum)
+            self.admitArrivals(newSlots)
+            for pub in newSlots:
+                scheduler.schedule(pub, time.time())
+            self.updateMetrics()
+
+            if freeWorkers.acquire(timeout=self.loopWait()):
+                pub = scheduler.popDue(timeout=self.loopWait())
+                if pub is None:
+                    freeWorkers.release()
+                else:
+                    loop_stats.scheduled += 1
+                    self.executor.submit(runSlot, pub, threadNo)
+                    threadNo += 1
+
+            if self.isFinished(startTime, minimum):
                 break
-            if len(self.result.publications) > 1000:
-                logger.debug("%s merging results", self.url)
-                move_intermediate_results(self.result)
-            if printProgress:
-                if self.conf.test_duration > 0:
-                    self.printProgress(percents=(self.conf.getTime() - startTime) / self.conf.test_duration *100, concurrent=self.mut.max_active)
-            loopEndTime = self.conf.getTime()
-            loopTime = loopEndTime - cycleStart
-            timeToSleep = self.conf.SLEEP_AFTER_CHECK - loopTime
-            logger.info("Url: {} loopStart: {:.3f} loopEnd: {:.3f} sleep: {:.3f}s active: {} max_active: {} loopTime: {:.3f} processed[ready:{} in_progress:{} not_active:{}] added_ready:{}".format(
-                self.url, cycleStart, loopEndTime, timeToSleep, self.mut.active, self.mut.max_active, loopTime, loop_stats.stats_checked_ready, loop_stats.stats_checked_in_progress, loop_stats.stats_checked_not_active, loop_stats.added_ready))
-            if self.private and loop_stats.added_ready == self.mut.active:
-                self.cif = next(cycleCifList)
-            if timeToSleep > 0 and self.mut.active > 0 and loop_stats.added_ready == 0:
-                time.sleep(timeToSleep)
+            if self.conf.getTime() - statsStart >= self.conf.SLEEP_AFTER_CHECK:
+                self.reportStats(startTime, statsStart, loop_stats, move_intermediate_results, printProgress)
+                loop_stats = LoopStats()
+                statsStart = self.conf.getTime()
+
+        self.executor.shutdown()
+        self.flushPublications(move_intermediate_results)
+        self.updateMetrics(force=True)
+        logger.info("%s end of thread, endpoint registry: %s", self.url, endpoint_registry.stats())
+        if self.conf.use_predefined_pdfs or self.conf.pdf_file is not None:
+            logger.info("%s pdf cache: %s", self.url, pdf_cache.stats())
+        return True, self.result
+
+    async def runSlotAsync(self, pub: PublicationSlot, threadNo):
+        """ Drives one slot on its own timer until it becomes NOT_ACTIVE. """
+        while pub.isActive() and not global_state.exit.is_set():
+            self.loop_stats.scheduled += 1
+            if not await self.processPublicationAsync(pub, self.loop_stats, threadNo):
+                return False
+            if pub.isActive():
+                await asyncio.sleep(max(self.nextDue(pub) - time.time(), 0))
+        return True
+
+    def asyncCallLimit(self):
+        """ --async_calls, by default as many as slots the controller may open (-q, abs(-q) in open loop). """
+        if self.conf.async_calls > 0:
+            return self.conf.async_calls
+        if self.conf.rate:
+            return max(abs(self.conf.max_queue_size), 1)
+        # ladder controller without -q has no upper bound, threads of the pool are started only when needed
+        return max(self.controller.upper, self.conf.min_queue_size, 1)
+
+    async def sendPublishDocumentAsync(self, sleep_for, move_intermediate_results, printProgress = False):
+        """
+        Same loop as sendPublishDocument, but every slot is a task with its own timer on one event loop. SOAP calls
+        in flight are bound by asyncCallLimit, not by --threads: blocking zeep calls are handed to a thread pool of that
+        size, with --transport raw calls are native coroutines on a connection pool of that size.
+        """
+        prepared = self.prepareRun(sleep_for)
+        if prepared is None:
+            return False
+        publicationsInProgress, minimum, maximum = prepared
+        startTime = self.conf.getTime()
+
+        self.asyncCalls = self.asyncCallLimit()
+        logger.info("%s asyncio engine, %d SOAP calls in flight at most", self.url, self.asyncCalls)
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.asyncCalls)
+        self.loop_stats = LoopStats()
+        tasks = set()
+        for threadNo, pub in enumerate(publicationsInProgress):
+            tasks.add(asyncio.create_task(self.runSlotAsync(pub, threadNo)))
+        threadNo = len(tasks)
+        statsStart = self.conf.getTime()
+        ok = True
+
+        while self.hasWork() and not global_state.exit.is_set():
+            if not tasks:
+                # open loop between arrivals
+                await asyncio.sleep(self.loopWait())
+                done = set()
             else:
-                time.sleep(0)
+                done, tasks = await asyncio.wait(tasks, timeout=self.loopWait(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None or not task.result():
+                    logger.error("Event loop: encountered exception: %s", task.exception())
+                    ok = False
+            if not ok:
+                break
 
-        move_intermediate_results(self.result)
-        logger.info("%s end of thread", self.url)
-        executor.shutdown()
-        return True, self.result
+            newSlots = []
+            maximum = self.adjustQueue(newSlots, minimum, maximum)
+            self.admitArrivals(newSlots)
+            for pub in newSlots:
+                tasks.add(asyncio.create_task(self.runSlotAsync(pub, threadNo)))
+                threadNo += 1
+            self.updateMetrics()
+
+            if self.isFinished(startTime, minimum):
+                break
+            if self.conf.getTime() - statsStart >= self.conf.SLEEP_AFTER_CHECK:
+                self.reportStats(startTime, statsStart, self.loop_stats, move_intermediate_results, printProgress)
+                self.loop_stats = LoopStats()
+                statsStart = self.conf.getTime()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.executor.shutdown()
+        self.flushPublications(move_intermediate_results)
+        self.updateMetrics(force=True)
+        logger.info("%s end of event loop, endpoint registry: %s", self.url, endpoint_registry.stats())
+        if self.conf.use_predefined_pdfs or self.conf.pdf_file is not None:
+            logger.info("%s pdf cache: %s", self.url, pdf_cache.stats())
+        return ok, self.result
+
+
+class PublisherWorker:
+    """
+    Publisher shards run by one worker process, see DurableMediaTestWorkers. A single shard runs in the main thread
+    of the process, more shards run in threads of their own.
+    """
+    def __init__(self, states, label):
+        self.states = states
+        self.label = label
+
+    def run(self, sleeps, move_intermediate_results, printProgress = False):
+        """ Entry of worker process, returns results of its shards. """
+        if len(self.states) == 1:
+            return [self.states[0].runPublisher(sleeps[0], move_intermediate_results, printProgress)]
+        conf = self.states[0].conf
+        if conf.profile is None:
+            return self.runShards(sleeps, move_intermediate_results, printProgress)
+        # profilers cover the whole process (setprofile, tracemalloc, frames of all threads), so shards of the process
+        # share one profile named after all of them, e.g. 10.0.0.1_31404+10.0.0.2_31404#2
+        with Profiler(conf.profile, profileDirectory(self.states[0].reportCatalog.rstrip('/')), self.label, conf.profile_interval):
+            return self.runShards(sleeps, move_intermediate_results, printProgress)
+
+    def runShards(self, sleeps, move_intermediate_results, printProgress):
+        with concurrent.futures.ThreadPoolExecutor(len(self.states), thread_name_prefix=self.label) as executor:
+            futures = [executor.submit(state.sendPublishDocument, sleep_for, move_intermediate_results, printProgress and i == 0)
+                       for i, (state, sleep_for) in enumerate(zip(self.states, sleeps))]
+        return [future.result() for future in futures]
 
 
 class Utils:
@@ -1039,18 +1736,56 @@ class DocsPublishingManager:
             for port in ports:
                 soap_address = 'http://' + ip + ':' + str(port)
                 self.publishers[soap_address] = self.conf.documents_to_publish_for_pub.get(ip + ':' + str(port), self.conf.documents_to_publish)
+        if self.conf.corpus_file is not None and self.conf.action == 'run':
+            corpus = Corpus(self.conf.corpus_file)
+            for url in self.publishers:
+                prepared = len(corpus.publications(url))
+                if prepared < self.publishers[url]:
+                    logger.warning('Corpus %s has only %d publications for %s', self.conf.corpus_file, prepared, url)
+                    self.publishers[url] = prepared
+        # shards of publishers run by every worker process, see DurableMediaTestWorkers
+        self.workerGroups = self.planWorkers()
+        # publishers, as in MAX_WORKERS header and Internal Score of the report, processes of the pool differ with --workers
         self.MAX_WORKERS = len(self.publishers)
+        self.workerProcesses = len(self.workerGroups)
 
         self.testDateStart = 0
         self.testDateEnd = 0
         self.testTime = 0
         self.timeoutTriggered = False
-        self.reportName = "report_" + str(time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime())) + '.csv'
+        self.reportBase = "report_" + str(time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime()))
+        self.reportName = self.reportBase + EXTENSIONS[self.conf.report_format]
         self.publishedOk = 0
         self.publishedFail = 0
-        self.publications = list()
+        self.publications = ReportColumns()
         self.mean_duration = 0
-        self.writtenHeader = False
+        self.mean_time_to_init = 0
+        self.failures = {}
+        self.histograms = HistogramSet()
+        # url -> successful publications of the publisher
+        self.publisherResults = {}
+        self.statusPolls = 0
+        self.statusPollsFixed = 0
+        self.payloadTime = 0
+        self.payloads = 0
+        self.payloadStartup = 0
+        self.lockAcquisitions = 0
+        self.lockContended = 0
+        self.lockWait = 0
+        self.reportWriterStats = None
+        # coordinator action: description of every agent for the report
+        self.agentSummaries = []
+
+    def planWorkers(self):
+        """ One process per publisher, or publishers sharded and packed on --workers processes. """
+        if self.conf.workers is None:
+            return [[ShardPlan(url, 0, 1, documents)] for url, documents in self.publishers.items()]
+        workers = workersCount(self.conf.workers)
+        plans = planShards(self.publishers, workers, self.conf.publisher_shards, max(abs(self.conf.max_queue_size), 1))
+        return packShards(plans, workers)
+
+    def shardLabels(self):
+        return [plan.label for group in self.workerGroups for plan in group]
 
     def prepare_reading_csv(self):
         writerForublishers = {}
@@ -1086,40 +1821,63 @@ class DocsPublishingManager:
         pass
 
     def move_intermediate_results(self, pub_state):
-        with global_state.lock:
-            self.writeReport(self.reportName, publications=pub_state.publications)
-            pub_state.publications.clear()
+        self.writeReport(pub_state.publications)
 
 
     def merge_final_results(self, result):
         logger.info("finished one publisher, merging results")
         status, pub_state = result
+        if cluster_link is not None:
+            cluster_link.send('result', result)
 
         # multiprocess so has to be process lock
         with global_state.lock:
 
             if pub_state.publishedOk > 0:
                 self.mean_duration = self.mean_duration + ((pub_state.publishedOk * (pub_state.mean_duration - self.mean_duration)) / (pub_state.publishedOk + self.publishedOk))
+                self.mean_time_to_init = self.mean_time_to_init + ((pub_state.publishedOk * (pub_state.mean_time_to_init - self.mean_time_to_init)) / (pub_state.publishedOk + self.publishedOk))
 
+            self.publisherResults[pub_state.url] = self.publisherResults.get(pub_state.url, 0) + pub_state.publishedOk
+            for status, count in pub_state.failures.items():
+                self.failures[status] = self.failures.get(status, 0) + count
+            self.histograms.merge(pub_state.histograms)
             self.publishedOk += pub_state.publishedOk
             pub_state.publishedOk = 0
             self.publishedFail += pub_state.publishedFail
             pub_state.publishedFail = 0
+            self.statusPolls += pub_state.statusPolls
+            self.statusPollsFixed += pub_state.statusPollsFixed
+            self.payloadTime += pub_state.payloadTime
+            self.payloads += pub_state.payloads
+            self.payloadStartup = max(self.payloadStartup, pub_state.payloadStartup)
+            self.lockAcquisitions += pub_state.lockAcquisitions
+            self.lockContended += pub_state.lockContended
+            self.lockWait += pub_state.lockWait
 
 
     def getDocumentsToPublish(self, url):
         return self.publishers[url]
 
-    def writeReportStart(self, name):
-        with open(name, 'a') as report:
-            if not self.writtenHeader:
-                header = "doc_hash,md5,pub_task_id,pub_address,cif,dur_time,status,pub_end_time,threads,start_brg_time,create_brg_time,published_brg_time,dur_brg_time,time_to_init,read_time,prev_doc_hash,published_by,read_by\n"
-                report.write(header)
-            if self.conf.write_on_disk:
-                os.makedirs(Path(name).stem, exist_ok=True)
-
-    def writeReportEnd(self, name, time=0):
-        with open(name, 'a') as report:
+    def writeReportStart(self):
+        """ Starts report writer process, it writes the header. """
+        global report_sink
+        if cluster_link is not None:
+            report_sink = RemoteReportSink(cluster_link, self.reportName)
+        else:
+            report_sink = ReportSink(self.reportName, self.conf.report_format)
+        report_sink.start()
+        if self.conf.write_on_disk:
+            os.makedirs(self.reportBase, exist_ok=True)
+
+    def closeReport(self):
+        """ Waits for report writer to write all records shipped so far. """
+        if report_sink is not None and self.reportWriterStats is None:
+            self.reportWriterStats = report_sink.close()
+            logger.info("report writer: %s", self.reportWriterStats)
+
+    def writeReportEnd(self, time=0):
+        self.closeReport()
+        with report_sink.openSummary() as report:
             report.write("# MAX_WORKERS:" +
                          str(self.MAX_WORKERS) +
                          " max queue size::" +
@@ -1136,20 +1894,53 @@ class DocsPublishingManager:
                          " threadsPerPublisher:" +
                          str(self.conf.threads_per_publisher) +
                          "\n")
+            if self.conf.rate:
+                report.write("# Open loop: {} arrivals at {}/s per publisher, latency corrected for coordinated omission is pub_end_time - intended_start\n".format(
+                    self.conf.arrival, self.conf.rate))
+            if self.conf.workers is not None and not self.agentSummaries:
+                report.write("# Workers: {} processes running {} publisher shards: {}\n".format(
+                    self.workerProcesses, len(self.shardLabels()), " | ".join(", ".join(plan.label for plan in group) for group in self.workerGroups)))
+            if self.agentSummaries:
+                report.write("# Agents: " + ", ".join(self.agentSummaries) + "\n")
             report.write("# Successfully published documents: " + str(self.publishedOk) +
                          '/' + str(self.publishedOk + self.publishedFail) + "\n")
             report.write("# Time: " + str(time) + " seconds\n")
             report.write("# Estimated publications per 24h: " + str(int(self.publishedOk * 60 * 1440 / time)) + "\n")
             report.write("# Mean: " + str(self.mean_duration) + "\n")
+            if len(self.histograms):
+                for metric in ('dur_time', 'dur_brg_time', 'time_to_init', 'dur_read_time'):
+                    summary = self.histograms.summary(metric, 'FINISHED_OK')
+                    if not summary.endswith('(n=0)'):
+                        report.write("# {} of FINISHED_OK [s]: {}\n".format(metric, summary))
+                histogramsName = self.reportBase + '_histograms.csv'
+                self.histograms.dump(histogramsName)
+                report.write("# Histograms written to file: " + histogramsName + "\n")
+            if self.failures:
+                report.write("# Failures: " + ", ".join("{}: {}".format(status, count) for status, count in sorted(self.failures.items())) + "\n")
+            if self.publishedOk > 0:
+                report.write("# Status calls per publication: {:.2f} (fixed poll_interval: {:.2f}, saved: {:.2f})\n".format(
+                    self.statusPolls / self.publishedOk, self.statusPollsFixed / self.publishedOk, (self.statusPollsFixed - self.statusPolls) / self.publishedOk))
+            report.write("# Content digest: " + self.conf.digest + "\n")
+            if self.payloads > 0:
+                report.write("# Payload per publication: {:.3f} ms, startup: {:.3f} s\n".format(
+                    self.payloadTime / self.payloads * 1000, self.payloadStartup))
+            if self.lockAcquisitions > 0:
+                report.write("# Publisher lock wait: {:.6f} s, contended {}/{} acquisitions\n".format(
+                    self.lockWait, self.lockContended, self.lockAcquisitions))
+            stats = self.reportWriterStats
+            if stats['batches'] > 0:
+                report.write("# Report writer: {} records in {} batches, backlog mean: {:.2f} max: {} batches, write time: {:.3f} s\n".format(
+                    stats['records'], stats['batches'], stats['backlog_sum'] / stats['batches'], stats['max_backlog'], stats['write_time']))
             if self.publishedOk > 0:
                 report.write("# Internal Score : " + str(time / self.publishedOk * self.MAX_WORKERS) + "\n")
 
-    def writeReport(self, name, publications):
-        with open(name, 'a') as report:
-            for record in publications:
-                rec = "{doc_hash},{md5},{pub_task_id},{pub_address},{cif},{dur_time:.3f},{status:<11},{pub_end_time},{threads},{start_brg_time:.3f},{create_brg_time:.3f},{published_brg_time:.3f},{dur_brg_time:.3f},{time_to_init:.3f},{dur_read_time},{prev_doc},{published_by},{read_by}\n".format_map(
-                    record)
-                report.write(rec)
+    def writeReport(self, publications):
+        """ Ships records to report writer process. """
+        if report_sink is None:
+            # publisher processes get the sink only by inheriting it, with spawn or forkserver records would be lost
+            raise RuntimeError('report writer is not started in process {} (start method {}), publisher workers must inherit it by fork'.format(
+                os.getpid(), multiprocessing.get_start_method()))
+        report_sink.put(publications)
 
     def doTimeout(self):
         logger.warning("TIMEOUT")
@@ -1172,9 +1963,7 @@ class DocsPublishingManager:
         return ret
 
     def doSetup(self, url):
-        pubPort = url.split(":")[-1]
-        pubIp = url.split(":")[1].strip('/')
-        pubEndpoint = SoapAPI.PublisherEndpoint(pubIp, pubPort)
+        pubEndpoint = endpoint_registry.getEndpointForUrl(url)
         try:
             retSetup = pubEndpoint.Setup()
             if retSetup.status.status != 'PUBLISHING-OK':
@@ -1188,9 +1977,7 @@ class DocsPublishingManager:
     def doCategories(self, url):
         if url not in self.conf.pubs_categories.keys():
             self.conf.pubs_categories[url] = set()
-        pubPort = url.split(":")[-1]
-        pubIp = url.split(":")[1].strip('/')
-        pubEndpoint = SoapAPI.PublisherEndpoint(pubIp, pubPort)
+        pubEndpoint = endpoint_registry.getEndpointForUrl(url)
         try:
             initCategoriesAnswer = pubEndpoint.wait_GetThisPublisherCategories()
         except ConnectionError:
@@ -1214,15 +2001,223 @@ class DocsPublishingManager:
             return False
         return True
 
+    def doPreparePayloads(self):
+        """
+        Writes every payload the run would publish into corpus file, documents are serialized once
+        and stored with their md5. Run with --corpus then only slices the file mapping.
+        """
+        if self.conf.pdf_getter is None:
+            logger.error('prepare-payloads needs --input_file or --use_predefined_pdfs')
+            return False
+        path = self.conf.corpus_file or 'payloads.corpus'
+        start = time.perf_counter()
+        writer = CorpusWriter(path)
+        try:
+            for url, to_publish in self.publishers.items():
+                gen = self.conf.pdf_getter(url)
+                for _ in range(to_publish):
+                    pdf_path, additional_details, documentMainCategory, title, cif, receiver_url = next(gen)
+                    if not pdf_path:
+                        logger.warning('Only %d publications prepared for %s', len(writer.publishers.get(url, [])), url)
+                        break
+                    docs = [writer.addDocument(pdf, lambda pdf=pdf: serializePdf(pdf)) for pdf in pdf_path]
+                    writer.addPublication(url, docs, additional_details, documentMainCategory, title, cif, receiver_url)
+        finally:
+            writer.close()
+        logger.critical('Corpus written to file: %s, %d publications, %d documents, %.1f MB in %.3fs', path,
+                        sum(len(publications) for publications in writer.publishers.values()), len(writer.stored),
+                        writer.bytes / 1024 / 1024, time.perf_counter() - start)
+        return True
+
+    def doSearch(self, private=False):
+        """
+        Searches for the highest number of publications in progress per publisher that publishers sustain,
+        see DurableMediaTestSearch. Every round is a run of --search_step seconds with its own report.
+        """
+        if self.conf.max_queue_size < 1:
+            logger.error('search needs positive -q as the highest level to try')
+            return False
+
+        def runLevel(level, roundNo):
+            if self.timeoutTriggered or global_state.interrupted.is_set():
+                return None
+            conf = copy.copy(self.conf)
+            conf.min_queue_size = conf.max_queue_size = level
+            conf.test_duration = self.conf.search_step
+            conf.early_finish = False
+            mngr = DocsPublishingManager(conf)
+            mngr.reportBase = '{}_q{}_r{}'.format(self.reportBase, level, roundNo)
+            mngr.reportName = mngr.reportBase + EXTENSIONS[conf.report_format]
+            global_state.exit.clear()
+            mngr.testDateStart = conf.getTime()
+            mngr.doRun(private)
+            if self.timeoutTriggered or global_state.interrupted.is_set():
+                return None
+            return LevelResult(level, mngr.testTime, mngr.publishedOk, mngr.failures, mngr.mean_duration,
+                               mngr.mean_time_to_init, mngr.publisherResults)
+
+        search = ThroughputSearch(runLevel, self.conf.min_queue_size, self.conf.max_queue_size, rounds=self.conf.search_rounds,
+                                  settle=self.conf.search_settle, max_fail=self.conf.search_max_fail,
+                                  max_latency=self.conf.search_max_latency, precision=self.conf.search_precision)
+        best = search.run()
+        self.writeSearchCurve(search.curve)
+        if best is None:
+            logger.critical('No sustainable level found')
+            return False
+        logger.critical('Sustainable level: %d publications in progress per publisher, %.3f publications/s (%d per 24h) in total, latency %.3fs',
+                        best.level, best.throughput, int(best.throughput * 60 * 1440), best.latency)
+        for url, throughput in sorted(best.publisherThroughput().items()):
+            logger.critical('    %s: %.3f publications/s', url, throughput)
+        return not search.interrupted
+
+    def writeSearchCurve(self, curve):
+        """ Latency curve measured by search, one line per level in order of measuring. """
+        path = self.reportBase + '_search.csv'
+        with open(path, 'w') as file:
+            file.write('level,rounds,time,publications_per_s,per_publisher_per_s,failed_pct,rejected,timeouts,communication,dur_brg_time,time_to_init,latency,verdict\n')
+            for result in curve:
+                file.write('{},{},{:.3f},{:.3f},{:.3f},{:.2f},{},{},{},{:.3f},{:.3f},{:.3f},{}\n'.format(
+                    result.level, result.rounds, result.elapsed, result.throughput, result.throughput / max(len(self.publishers), 1),
+                    result.failRate * 100, result.countFailures('rejected'), result.countFailures('timeouts'),
+                    result.countFailures('communication'), result.mean_duration, result.mean_time_to_init, result.latency,
+                    result.verdict or 'sustainable'))
+        logger.critical('level  publications/s  failed%  latency[s]')
+        for result in sorted(curve, key=lambda result: result.level):
+            logger.critical('{:>5}  {:>14.3f}  {:>7.2f}  {:>10.3f}  {}'.format(
+                result.level, result.throughput, result.failRate * 100, result.latency, result.verdict or ''))
+        logger.critical('Search curve written to file: ' + path)
+
+    def doCoordinator(self, private=False):
+        """
+        Runs the test on agents (agent action) on other load generator hosts, see DurableMediaTestCluster.
+        Publishers are split between agents, records of agents go to the report of the coordinator and results
+        of their publishers are merged as in doRun.
+        """
+        host, port = parseAddress(self.conf.cluster)
+        coordinator = Coordinator(host, port, self.conf.cluster_key, self.conf.agents)
+        logger.critical('Coordinator listening on port %d, waiting for %d agents', port, self.conf.agents)
+        progress = {}
+        done = {}
+
+        def handle(agent, kind, payload):
+            if kind == 'report':
+                self.writeReport(payload)
+            elif kind == 'progress':
+                progress.update(payload)
+                if metrics_board is not None:
+                    for url, row in payload.items():
+                        metrics_board.setRow(url, row)
+            elif kind == 'result':
+                self.merge_final_results(payload)
+            elif kind == 'done':
+                done[agent.name] = payload
+            elif kind == 'lost':
+                logger.error('%s lost, its publishers are missing in results', agent.name)
+                done[agent.name] = {'ok': False}
+
+        try:
+            agents = coordinator.register(global_state.exit)
+            if agents is None:
+                logger.error('Only %d of %d agents registered', len(coordinator.agents), self.conf.agents)
+                return False
+            shares = splitPublishers(self.publishers, [agent.info.get('cpus', 1) for agent in agents])
+            self.writeReportStart()
+            coordinator.listen(handle)
+            startAt = time.time() + self.conf.start_delay
+            for agent, share in zip(agents, shares):
+                agent.send('start', {'publishers': share, 'start_at': startAt, 'report': '{}_{}'.format(self.reportBase, agent.name), 'private': private})
+                self.agentSummaries.append('{} ({} CPUs, {} publishers)'.format(agent.name, agent.info.get('cpus'), len(share)))
+                logger.info('%s publishes to %s', agent.name, sorted(share))
+            self.testDateStart = startAt
+            stopSent = False
+            statsStart = time.time()
+            while not coordinator.wait(1.0):
+                if global_state.exit.is_set() and not stopSent:
+                    coordinator.broadcast('stop')
+                    stopSent = True
+                if time.time() - statsStart >= self.conf.SLEEP_AFTER_CHECK and progress:
+                    rows = list(progress.values())
+                    logger.critical('cluster: published %d, failed %d, %.3f publications/s, %d in progress, agents done %d/%d',
+                                    sum(row[FIELD_INDEX['status:FINISHED_OK']] for row in rows),
+                                    sum(row[FIELD_INDEX['status:' + status]] for row in rows for status in STATUSES if status != 'FINISHED_OK'),
+                                    sum(row[FIELD_INDEX['throughput']] for row in rows), sum(row[FIELD_INDEX['active']] for row in rows),
+                                    len(done), len(agents))
+                    statsStart = time.time()
+        finally:
+            coordinator.close()
+
+        self.testDateEnd = self.conf.getTime()
+        self.testTime = round(self.testDateEnd - self.testDateStart, self.conf.ACC)
+        logger.critical('Test time:' + str(self.testTime))
+        logger.critical('Published ' + str(self.publishedOk) + '/' + str(self.publishedOk + self.publishedFail) + ' documents.')
+        logger.critical('Results written to file: ' + self.reportName)
+        self.writeReportEnd(self.testTime)
+        agentsOk = len(done) == len(agents) and all(result.get('ok') for result in done.values())
+        if self.timeoutTriggered or self.publishedFail > 0 or not agentsOk:
+            return False
+        return True
+
+    def doAgent(self):
+        """
+        Registers at coordinator (coordinator action) and runs the publishers it assigns at the instant it sets,
+        see DurableMediaTestCluster. Options of the run are the options of this agent.
+        """
+        global metrics_board, cluster_link
+        link = AgentLink.connect(parseAddress(self.conf.cluster), self.conf.cluster_key, agentInfo())
+        logger.critical('Registered at coordinator %s, clock offset %.3fs', self.conf.cluster, link.offset)
+        ok = False
+        try:
+            order = link.waitOrder()
+            if order is None:
+                logger.error('Coordinator sent no work')
+                return False
+            publishers = order['publishers']
+            if not publishers:
+                logger.critical('No publishers assigned')
+                ok = True
+                return True
+            conf = copy.copy(self.conf)
+            conf.action = 'run'
+            conf.pubs = pubsMap(publishers)
+            conf.documents_to_publish_for_pub = {url.split('://')[-1]: documents for url, documents in publishers.items()}
+            mngr = DocsPublishingManager(conf)
+            mngr.reportBase = order['report']
+            # records go to the coordinator, summary of this agent stays here
+            mngr.reportName = mngr.reportBase + '_summary.txt'
+            cluster_link = link
+            # created before publisher processes are forked, they update their rows
+            if metrics_board is not None:
+                metrics_board.close()
+            metrics_board = MetricsBoard(mngr.shardLabels())
+            if conf.metrics_port:
+                metrics_board.serve(conf.metrics_port, report_backlog=lambda: report_sink.backlog() if report_sink is not None else 0,
+                                    host=conf.metrics_host)
+            link.stream('progress', lambda: {url: metrics_board.row(url) for url in mngr.publishers}, metrics_board.interval)
+            link.listen(global_state.exit.set)
+            link.waitUntil(order['start_at'])
+            if global_state.exit.is_set():
+                return False
+            mngr.testDateStart = conf.getTime()
+            ok = mngr.doRun(order['private'])
+            return ok
+        finally:
+            link.send('done', {'ok': ok})
+            link.close()
+            cluster_link = None
+
     def doRun(self, private=False):
         if self.conf.csv_file:
             self.prepare_reading_csv()
         logger.info("TestDateStart = " + str(self.testDateStart) + " no of Docs to publish #" + str(self.conf.documents_to_publish))
-        self.writeReportStart(self.reportName)
+        self.writeReportStart()
         futures = []
         logger.debug("Start executor")
-        with multiprocessing.Pool(self.MAX_WORKERS) as pool:
-            logger.debug("Start {} processes".format(len(self.publishers)))
+        profiler = None
+        with multiprocessing.Pool(self.workerProcesses) as pool:
+            if self.conf.profile is not None:
+                # started after workers are forked, they run their own profilers
+                profiler = Profiler(self.conf.profile, profileDirectory(self.reportBase), 'main', self.conf.profile_interval).start()
+            logger.debug("Start {} processes".format(self.workerProcesses))
             printProgress = True
             pubReader = {}
             pubs = list(self.publishers.keys())
@@ -1242,17 +2237,25 @@ class DocsPublishingManager:
                 else:
                     pubReader[pub] = pubs[i]
                 i += 0
-            for pub, sleep_for in zip(self.publishers.keys(), range(self.MAX_WORKERS, 0, -1)):
-                logger.debug("Starting {}, sleep {}".format(pub, sleep_for))
-                to_publish = self.getDocumentsToPublish(pub)
-                single_publisher = SinglePublisherState(self.conf, pub, to_publish, private=private, reportCatalog=Path(self.reportName).stem, readUrl=pubReader[pub])
-                futures.append(pool.apply_async(single_publisher.sendPublishDocument, args=(sleep_for*0.05, self.move_intermediate_results, printProgress)))
+            sleep_for = len(self.shardLabels())
+            for group in self.workerGroups:
+                states = []
+                sleeps = []
+                for plan in group:
+                    logger.debug("Starting {}, sleep {}".format(plan.label, sleep_for))
+                    states.append(SinglePublisherState(plan.conf(self.conf), plan.url, plan.documents, private=private, reportCatalog=self.reportBase,
+                                                       readUrl=pubReader[plan.url], shard=plan))
+                    sleeps.append(sleep_for*0.05)
+                    sleep_for -= 1
+                worker = PublisherWorker(states, '+'.join(profileLabel(plan.label) for plan in group))
+                futures.append(pool.apply_async(worker.run, args=(sleeps, self.move_intermediate_results, printProgress)))
                 printProgress = False
-            logger.debug("Started {} processes".format(len(self.publishers)))
+            logger.debug("Started {} processes".format(self.workerProcesses))
             got_exception = False
             try:
                 for future in futures:
-                    self.merge_final_results(future.get())
+                    for result in future.get():
+                        self.merge_final_results(result)
             except Exception as ex:
                 got_exception = True
                 logging.exception("exception from publishing process")
@@ -1268,8 +2271,12 @@ class DocsPublishingManager:
         else:
             logger.critical('Published ' + str(self.publishedOk) + '/' + str(self.publishedOk + self.publishedFail) + ' documents.')
         logger.critical('Results written to file: ' + self.reportName)
-        self.writeReport(self.reportName, publications=self.publications)
-        self.writeReportEnd(self.reportName, self.testTime)
+        self.writeReport(self.publications)
+        self.writeReportEnd(self.testTime)
+        if profiler is not None:
+            profiler.stop()
+            logger.critical('Profiles ({}) written to directory: {}, merged stacks: {}'.format(
+                self.conf.profile, profileDirectory(self.reportBase), mergeCollapsed(profileDirectory(self.reportBase))))
         if self.conf.csv_file:
             self.delete_reading_csv()
         if self.timeoutTriggered or self.publishedFail > 0 or got_exception:
@@ -1364,6 +2371,12 @@ def main(params):
 
     docs_pub_mngr = DocsPublishingManager(conf)
     docs_pub_mngr.testDateStart = docs_pub_mngr.conf.getTime()
+    if conf.metrics_port:
+        global metrics_board
+        metrics_board = MetricsBoard(docs_pub_mngr.shardLabels())
+        metrics_board.serve(conf.metrics_port, report_backlog=lambda: report_sink.backlog() if report_sink is not None else 0,
+                            host=conf.metrics_host)
+        logger.info("metrics served on %s:%d", conf.metrics_host, conf.metrics_port)
     timeoutTimer = None
     try:
         logger.debug("action: %s", conf.action)
@@ -1378,6 +2391,17 @@ def main(params):
         elif conf.action == 'run':
             signal.signal(signal.SIGINT, signal_handler)
             return docs_pub_mngr.doRun(conf.private)
+        elif conf.action == 'search':
+            signal.signal(signal.SIGINT, signal_handler)
+            return docs_pub_mngr.doSearch(conf.private)
+        elif conf.action == 'coordinator':
+            signal.signal(signal.SIGINT, signal_handler)
+            return docs_pub_mngr.doCoordinator(conf.private)
+        elif conf.action == 'agent':
+            signal.signal(signal.SIGINT, signal_handler)
+            return docs_pub_mngr.doAgent()
+        elif conf.action == 'prepare-payloads':
+            return docs_pub_mngr.doPreparePayloads()
         elif conf.action == 'run_reading':
             signal.signal(signal.SIGINT, signal_handler)
             return docs_pub_mngr.doRun(conf.private)
@@ -1389,7 +2413,7 @@ def main(params):
         docs_pub_mngr.testDateEnd = docs_pub_mngr.conf.getTime()
         docs_pub_mngr.testTime = round(docs_pub_mngr.testDateEnd - docs_pub_mngr.testDateStart, docs_pub_mngr.conf.ACC)
         global_state.exit.set()
-        docs_pub_mngr.writeReport(docs_pub_mngr.reportName, docs_pub_mngr.publications)
+        docs_pub_mngr.writeReport(docs_pub_mngr.publications)
         sys.exit(3)
     except Exception:
         logger.exception("outer scope excepion")
@@ -1397,6 +2421,9 @@ def main(params):
     finally:
         if timeoutTimer:
             timeoutTimer.cancel()
+        docs_pub_mngr.closeReport()
+        if metrics_board is not None:
+            metrics_board.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,328 @@
+# 2023-10-12
+"""
+Client side benchmarks of DurableMediaTest, no publisher is needed.
+
+memory   - bytes per in-flight PublicationSlot and per recorded publication (in memory and pickled),
+           compared with dict backed slots and dict records used before.
+counters - publication bookkeeping (index, success counter, report record) from many threads,
+           sharded MutatingPublisherState compared with one lock for everything used before.
+hotpath  - client side cost of one publication for each --size: CPU microseconds and bytes allocated
+           by payload generation (getNextPdf), digest, request rendering, answer parsing, report record
+           (addToReport), report writing and the whole processPublication cycle (publish, status poll,
+           report) against an in-process endpoint. 1e6 / publication_cpu_us is the number of publications
+           per second one core of a load generator can drive.
+
+--output saves results as JSON, such a file given as --baseline of a later run with the same -n and --size fails it
+(exit code 1) when publication_cpu_us or any alloc_B result grew by more than --tolerance over the baseline.
+
+Usage:
+    python3 DurableMediaTestBenchmark.py memory -n 10000
+    python3 DurableMediaTestBenchmark.py counters -n 2000 --threads 64
+    python3 DurableMediaTestBenchmark.py hotpath -n 5000 --size 20 500 5000 --digest md5
+    python3 DurableMediaTestBenchmark.py hotpath -n 5000 --output hotpath.json
+    python3 DurableMediaTestBenchmark.py hotpath -n 5000 --baseline hotpath.json --tolerance 0.1
+"""
+import argparse
+import gc
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import DurableMediaTest
+    from DurableMediaTest import GlobalState, LoopStats, MutatingPublisherState, PublicationSlot, SinglePublisherState, TimedLock
+    from DurableMediaTestConfig import Config
+    from DurableMediaTestMockPublisher import envelope, microseconds
+    from DurableMediaTestPayload import ContentHasher
+    from DurableMediaTestReport import EXTENSIONS, REPORT_COLUMNS, ReportColumns, openReportFile
+    from DurableMediaTestTransport import DEFAULT_NAMESPACE, AnswerParser, EnvelopeTemplates, RawPublisherEndpoint
+except ImportError:
+    from colony_scripts.colony.tests import DurableMediaTest
+    from colony_scripts.colony.tests.DurableMediaTest import GlobalState, LoopStats, MutatingPublisherState, PublicationSlot, SinglePublisherState, TimedLock
+    from colony_scripts.colony.tests.DurableMediaTestConfig import Config
+    from colony_scripts.colony.tests.DurableMediaTestMockPublisher import envelope, microseconds
+    from colony_scripts.colony.tests.DurableMediaTestPayload import ContentHasher
+    from colony_scripts.colony.tests.DurableMediaTestReport import EXTENSIONS, REPORT_COLUMNS, ReportColumns, openReportFile
+    from colony_scripts.colony.tests.DurableMediaTestTransport import DEFAULT_NAMESPACE, AnswerParser, EnvelopeTemplates, RawPublisherEndpoint
+
+BENCH_URL = 'http://10.0.0.1:31404'
+# calls of every stage measured under tracemalloc, tracing slows calls down too much to trace all of them
+ALLOC_SAMPLES = 1000
+# results compared with --baseline, lower is better for all of them
+GUARDED_SUFFIXES = ('_publication_cpu_us', '_alloc_B')
+
+
+class DictPublicationSlot:
+    """ PublicationSlot with instance dict, as it was before __slots__. """
+    __init__ = PublicationSlot.__init__
+
+
+def sampleRecord(i):
+    start = time.time()
+    return ('{:048x}'.format(i), '{:032x}'.format(i * 7919), 'job{:020d}'.format(i), 'http://10.0.0.1:31404', 'no_cif',
+            1.234, 'FINISHED_OK', start + 1.234, 20, start, start + 1.1, start + 1.2, 1.2, 0.004, 'NA', 'NA', 'NA', 'NA',
+            start, start)
+
+
+def allocated(build, n):
+    """ Bytes allocated per item by build(n), measured with tracemalloc. """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build(n)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / n, items
+
+
+def perCall(op, calls, items=1):
+    """
+    CPU microseconds and bytes allocated per item of op(i) doing items items.
+    Bytes allocated are the peak of traced memory over its level before the call (temporaries and what
+    the call keeps), taken in a separate pass under tracemalloc.
+    """
+    gc.collect()
+    start = time.process_time()
+    for i in range(calls):
+        op(i)
+    cpu = (time.process_time() - start) / (calls * items) * 1e6
+    samples = min(calls, ALLOC_SAMPLES)
+    gc.collect()
+    tracemalloc.start()
+    allocatedBytes = 0
+    for i in range(calls, calls + samples):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        op(i)
+        allocatedBytes += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return cpu, allocatedBytes / (samples * items)
+
+
+def benchMemory(n):
+    results = {}
+    for name, cls in (('slot_dict', DictPublicationSlot), ('slot_slots', PublicationSlot)):
+        results[name], _ = allocated(lambda n: [cls(publisher='http://10.0.0.1:31404', status='READY_TO_PUBLISH') for _ in range(n)], n)
+
+    def dictRecords(n):
+        return [dict(zip(REPORT_COLUMNS, sampleRecord(i))) for i in range(n)]
+
+    def columnRecords(n):
+        columns = ReportColumns()
+        for i in range(n):
+            columns.append(*sampleRecord(i))
+        return columns
+
+    results['record_dict'], records = allocated(dictRecords, n)
+    results['record_dict_pickled'] = len(pickle.dumps(records)) / n
+    results['record_columns'], records = allocated(columnRecords, n)
+    results['record_columns_pickled'] = len(pickle.dumps(records)) / n
+    return results
+
+
+class LockedPublisherState:
+    """ Bookkeeping of MutatingPublisherState as it was before sharding, everything under publisherLock. """
+    def __init__(self):
+        self.publisherLock = TimedLock()
+        self.index = 0
+        self.localPublishedOk = 0
+        self.publications = ReportColumns()
+
+    def publish(self):
+        with self.publisherLock:
+            self.index += 1
+            index = self.index
+        with self.publisherLock:
+            self.localPublishedOk += 1
+        with self.publisherLock:
+            self.publications.append(*sampleRecord(index))
+
+
+class ShardedPublisherState(MutatingPublisherState):
+    def publish(self):
+        index = self.incGetIndex()
+        self.incLocalPublishedOk()
+        shard = self.shard()
+        with shard.lock:
+            shard.publications.append(*sampleRecord(index))
+
+
+def benchCounters(n, threads):
+    results = {}
+    for name, cls in (('locked', LockedPublisherState), ('sharded', ShardedPublisherState)):
+        state = cls()
+        barrier = threading.Barrier(threads + 1)
+
+        def work():
+            barrier.wait()
+            for _ in range(n):
+                state.publish()
+        workers = [threading.Thread(target=work) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        results[name + '_publications_per_s'] = n * threads / elapsed
+        results[name + '_lock_wait_s'] = state.publisherLock.waitTime
+        results[name + '_lock_contended'] = state.publisherLock.contended
+    return results
+
+
+class InProcessEndpoint(RawPublisherEndpoint):
+    """
+    RawPublisherEndpoint which renders requests and parses answers like the raw transport, without sending anything.
+    Every publication is initiated and finished at the first status poll.
+    """
+    def __init__(self, templates):
+        super().__init__('10.0.0.1', 31404, templates, session=None)
+        now = time.time()
+        self.answers = {
+            'PublishPublicDocument': envelope(DEFAULT_NAMESPACE, 'PublishPublicDocument', 'PUBLISHING-INITIATED', '<jobId>{:024d}</jobId>'.format(1)),
+            'GetPublishStatus': envelope(DEFAULT_NAMESPACE, 'GetPublishStatus', 'PUBLISHING-OK', (
+                '<jobId>{:024d}</jobId><documentBlockchainAddress>{:048x}</documentBlockchainAddress><BLOCKCHAINpublicationDate>{}'
+                '</BLOCKCHAINpublicationDate><BLOCKCHAINestimMinPropagationTime>{}</BLOCKCHAINestimMinPropagationTime>').format(
+                1, 1, microseconds(now), microseconds(now))),
+        }
+        self.requestBytes = 0
+
+    def call(self, operation, params):
+        self.requestBytes += sum(len(chunk) for chunk in self.render(operation, params))
+        return AnswerParser.parse(self.answers[operation])
+
+
+def benchPublisherState(sizeKB, digest):
+    """ SinglePublisherState as prepareRun leaves it in closed loop with one slot, publishing to InProcessEndpoint. """
+    conf = Config()
+    conf.sizeKB = sizeKB
+    conf.digest = digest
+    conf.transport = 'raw'
+    conf.send_delay = 0
+    # duration mode, so finished slot is always reused
+    conf.test_duration = 3600
+    state = SinglePublisherState(conf, BENCH_URL, 0)
+    state.initSharedState()
+    state.hasher = ContentHasher(digest)
+    state.endpoint = InProcessEndpoint(EnvelopeTemplates())
+    state.mut.active = state.mut.max_active = 1
+    return state
+
+
+def benchHotPath(n, sizes, digest, report_format):
+    if DurableMediaTest.global_state is None:
+        DurableMediaTest.global_state = GlobalState()
+    results = {}
+    for sizeKB in sizes:
+        state = benchPublisherState(sizeKB, digest)
+        endpoint = state.endpoint
+        stages = {}
+
+        def suffix(i):
+            return '{}A0time{}@{}'.format(i, time.time(), BENCH_URL)
+        stages['payload'] = perCall(lambda i: state.getNextPdf(suffix(i)), n)
+        contents = [state.getNextPdf(suffix(i))[0][0] for i in range(n + ALLOC_SAMPLES)]
+        stages['digest'] = perCall(lambda i: state.hasher.hexdigest(contents[i]), n)
+
+        def render(i):
+            return sum(len(chunk) for chunk in endpoint.render('PublishPublicDocument', {
+                'publicationMode': 'NEW',
+                'documentData': {
+                    'title': 'RandomText_i' + str(i), 'sourceDocument': contents[i], 'documentMainCategory': 'ROOT',
+                    'documentSystemCategory': 'ROOT', 'BLOCKCHAINlegalValidityStartDate': '1700000000000000',
+                    'BLOCKCHAINexpirationDate': '2100-01-01', 'BLOCKCHAINretentionDate': '2100-01-01',
+                    'extension': 'PDF', 'additionalDetails': 'Here be PUBLIC additional details',
+                }
+            }))
+        stages['request'] = perCall(render, n)
+        stages['answer'] = perCall(lambda i: AnswerParser.parse(endpoint.answers['GetPublishStatus']), n)
+
+        def record(i):
+            start = time.time()
+            state.addToReport(start - 1.2, '{:024d}'.format(i), '{:048x}'.format(i), '{:032x}'.format(i), 'FINISHED_OK', BENCH_URL, 1,
+                              start_brg_time=start - 1.1, create_brg_time=start - 0.1, published_brg_time=start, time_to_init=0.004)
+        stages['report_record'] = perCall(record, n)
+        state.collectResults()
+        batch = state.result.publications
+        state.result.publications = ReportColumns()
+        report = openReportFile(os.devnull, report_format)
+        stages['report_write'] = perCall(lambda i: report.write(batch), 3, len(batch))
+        report.close()
+
+        state = benchPublisherState(sizeKB, digest)
+        slot = state.newSlot()
+        loopStats = LoopStats()
+        # first call only publishes, every next one polls status, reports and publishes the next document
+        state.processPublication(slot, loopStats, 0)
+        stages['publication'] = perCall(lambda i: state.processPublication(slot, loopStats, 0), n)
+        state.collectResults()
+        if state.result.publishedOk < n:
+            raise RuntimeError('only {} of {} publications finished, see log'.format(state.result.publishedOk, n))
+        requestBytes = state.endpoint.requestBytes / (state.result.publishedOk + state.result.publishedFail)
+
+        for stage, (cpu, allocatedBytes) in stages.items():
+            results['{}kB_{}_cpu_us'.format(sizeKB, stage)] = cpu
+            results['{}kB_{}_alloc_B'.format(sizeKB, stage)] = allocatedBytes
+        results['{}kB_request_B'.format(sizeKB)] = requestBytes
+        results['{}kB_publications_per_cpu_s'.format(sizeKB)] = 1e6 / stages['publication'][0]
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """ (name, baseline, value) of guarded results worse than baseline by more than tolerance (share of baseline). """
+    worse = []
+    for name, value in results.items():
+        if name.endswith(GUARDED_SUFFIXES) and name in baseline and value > baseline[name] * (1 + tolerance):
+            worse.append((name, baseline[name], value))
+    return worse
+
+
+def main(params):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('benchmark', help='Benchmark to run', choices=['memory', 'counters', 'hotpath'])
+    parser.add_argument('-n', '--count', help='Number of slots and records (per thread for counters, per stage for hotpath)', type=int, default=10000)
+    parser.add_argument('--threads', help='Threads of counters benchmark', type=int, default=64)
+    parser.add_argument('-s', '--size', help='Sizes of documents of hotpath benchmark [kB]', type=int, nargs='+', default=[20, 500, 5000])
+    parser.add_argument('--digest', help='Digest of hotpath benchmark', choices=['md5', 'blake2b', 'xxhash', 'none'], default='md5')
+    parser.add_argument('--report_format', help='Report format of hotpath benchmark', choices=list(EXTENSIONS), default='csv')
+    parser.add_argument('--output', help='Save results as JSON, usable as --baseline')
+    parser.add_argument('--baseline', help='JSON results of an earlier run, run fails when guarded results regressed')
+    parser.add_argument('--tolerance', help='Allowed regression against --baseline, share of baseline value', type=float, default=0.1)
+    args = parser.parse_args(params)
+    if args.tolerance < 0:
+        parser.error('--tolerance must not be negative')
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    if args.benchmark == 'memory':
+        results = benchMemory(args.count)
+    elif args.benchmark == 'hotpath':
+        results = benchHotPath(args.count, args.size, args.digest, args.report_format)
+    else:
+        results = benchCounters(args.count, args.threads)
+    for name, value in results.items():
+        print('{:<32} {:12.3f}'.format(name, value))
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if baseline is None:
+        return True
+    worse = regressions(results, baseline, args.tolerance)
+    for name, before, value in worse:
+        print('REGRESSION {:<32} {:12.3f} -> {:12.3f} ({:+.1f}%)'.format(name, before, value, (value / before - 1) * 100 if before else float('inf')))
+    if not any(name.endswith(GUARDED_SUFFIXES) and name in baseline for name in results):
+        print('no guarded results in common with baseline {}'.format(args.baseline))
+        return False
+    return not worse
+
+
+if __name__ == "__main__":
+    ok = main(sys.argv[1:])
+    sys.exit(0 if ok else 1)
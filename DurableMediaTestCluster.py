@@ -0,0 +1,304 @@
+# 2023-10-12
+"""
+Distributed load generation of DurableMediaTest (coordinator and agent actions) and of
+atomicFinancialTtransactionsTest_Asset.py.
+
+Agents on load generator hosts connect to the coordinator (multiprocessing.connection authenticated by --cluster_key)
+and register with their host name and number of CPUs, clock offset of every agent to the coordinator is measured
+at registration (best of CLOCK_PINGS round trips). When --agents agents registered, coordinator splits the work between
+them (publishers of Config.pubs weighted by CPUs of agents, chunks of cnode list) and sends every agent its share
+with start instant in coordinator clock, so all agents start at the same instant whatever their clocks say.
+During the run agents stream messages back over the same connection: report batches, progress counters and results
+(with histograms) of finished publishers. Coordinator merges them into a single report and sends stop to all agents
+on timeout or interrupt. Messages are pairs (kind, payload) pickled by Connection, so anyone knowing the key
+can run code on the coordinator: --cluster_key has no default and the coordinator listens only on the host of --cluster.
+"""
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger("DurableMediaTest")
+
+CLOCK_PINGS = 5
+
+
+def parseAddress(address, default_host='127.0.0.1'):
+    """ host:port -> (host, port), host may be omitted. """
+    host, _, port = str(address).rpartition(':')
+    return host or default_host, int(port)
+
+
+def agentInfo(**extra):
+    info = {'host': socket.gethostname(), 'cpus': os.cpu_count() or 1, 'pid': os.getpid()}
+    info.update(extra)
+    return info
+
+
+def splitPublishers(publishers, weights):
+    """
+    Splits publishers (url -> documents to publish) into len(weights) shares, documents of every share
+    are proportional to its weight. Biggest publishers are placed first, each on the least loaded share.
+    """
+    shares = [{} for _ in weights]
+    loads = [0.0] * len(weights)
+    for url, documents in sorted(publishers.items(), key=lambda item: (-item[1], item[0])):
+        share = min(range(len(weights)), key=lambda k: ((loads[k] + max(documents, 1)) / weights[k], k))
+        shares[share][url] = documents
+        loads[share] += max(documents, 1)
+    return shares
+
+
+def pubsMap(urls):
+    """ Publisher urls -> {ip: [ports]} as in Config.pubs. """
+    pubs = {}
+    for url in urls:
+        ip, port = parseAddress(url.split('://')[-1])
+        pubs.setdefault(ip, []).append(str(port))
+    return pubs
+
+
+class Channel:
+    """ Connection shared by threads of one process, sends are serialized by a lock. """
+    def __init__(self, connection, name, info=None):
+        self.connection = connection
+        self.name = name
+        self.info = info or {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, kind, payload=None):
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.connection.send((kind, payload))
+                return True
+            except (OSError, EOFError):
+                logger.error('%s: connection lost while sending %s', self.name, kind)
+                self.closed = True
+                return False
+
+    def recv(self):
+        return self.connection.recv()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.connection.close()
+
+
+class Coordinator:
+    """ Listening end of the cluster, see module docstring. """
+    def __init__(self, host, port, key, agents):
+        self.listener = multiprocessing.connection.Listener((host, port), authkey=key.encode())
+        self.expected = agents
+        self.agents = []
+        self.threads = []
+
+    def accept(self):
+        while len(self.agents) < self.expected:
+            try:
+                connection = self.listener.accept()
+            except multiprocessing.AuthenticationError:
+                logger.error('agent rejected, wrong cluster key')
+                continue
+            except OSError:
+                return
+            try:
+                kind, info = connection.recv()
+                if kind != 'register':
+                    connection.close()
+                    continue
+                # agent measures clock offset, then says it is ready
+                kind, payload = connection.recv()
+                while kind == 'clock':
+                    connection.send(('clock', time.time()))
+                    kind, payload = connection.recv()
+                info.update(payload or {})
+            except (OSError, EOFError):
+                continue
+            channel = Channel(connection, 'agent{}_{}'.format(len(self.agents) + 1, info.get('host')), info)
+            self.agents.append(channel)
+            logger.critical('%s registered (%d/%d): %d CPUs, clock offset %.3fs',
+                            channel.name, len(self.agents), self.expected, info.get('cpus', 1), info.get('offset', 0.0))
+
+    def register(self, exit):
+        """ Waits until expected number of agents registered or exit is set, returns their Channels or None. """
+        thread = threading.Thread(target=self.accept, name='ClusterAccept', daemon=True)
+        thread.start()
+        while thread.is_alive() and not exit.is_set():
+            thread.join(0.2)
+        if len(self.agents) < self.expected:
+            return None
+        return list(self.agents)
+
+    def listen(self, handler):
+        """ Calls handler(channel, kind, payload) from one thread per agent until agent is done ('done' or 'lost'). """
+        def receive(channel):
+            while True:
+                try:
+                    kind, payload = channel.recv()
+                except (OSError, EOFError):
+                    handler(channel, 'lost', None)
+                    return
+                handler(channel, kind, payload)
+                if kind == 'done':
+                    return
+        for channel in self.agents:
+            thread = threading.Thread(target=receive, args=(channel,), name='Cluster-' + channel.name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self, timeout=None):
+        """ True when every agent is done. """
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(deadline - time.time(), 0))
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def broadcast(self, kind, payload=None):
+        for channel in self.agents:
+            channel.send(kind, payload)
+
+    def close(self):
+        for channel in self.agents:
+            channel.close()
+        self.listener.close()
+
+
+class AgentLink(Channel):
+    """ Agent end of the cluster, see module docstring. """
+    def __init__(self, connection, info):
+        super().__init__(connection, 'coordinator', info)
+        # coordinator clock - local clock [s]
+        self.offset = 0.0
+        self.stopped = threading.Event()
+
+    @classmethod
+    def connect(cls, address, key, info, retry=60):
+        """ Connects and registers, retries for retry seconds while coordinator is not listening yet. """
+        deadline = time.time() + retry
+        while True:
+            try:
+                connection = multiprocessing.connection.Client(address, authkey=key.encode())
+                break
+            except ConnectionRefusedError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(1)
+        link = cls(connection, info)
+        link.syncClock()
+        return link
+
+    def syncClock(self):
+        """ Cristian's algorithm, offset of the round trip with the lowest delay is kept. """
+        best = None
+        self.connection.send(('register', self.info))
+        for _ in range(CLOCK_PINGS):
+            sent = time.time()
+            self.connection.send(('clock', sent))
+            _, coordinatorTime = self.connection.recv()
+            received = time.time()
+            if best is None or received - sent < best[0]:
+                best = (received - sent, coordinatorTime - (sent + received) / 2)
+        self.offset = best[1]
+        self.connection.send(('ready', {'offset': self.offset}))
+
+    def waitOrder(self):
+        """ Payload of start message, None when coordinator stopped or went away. """
+        try:
+            kind, payload = self.recv()
+        except (OSError, EOFError):
+            return None
+        return payload if kind == 'start' else None
+
+    def waitUntil(self, coordinatorTime):
+        """ Sleeps until the instant given in coordinator clock. """
+        delay = coordinatorTime - self.offset - time.time()
+        if delay < 0:
+            logger.warning('start instant passed %.3fs ago, starting now', -delay)
+            return
+        logger.info('starting in %.3fs', delay)
+        self.stopped.wait(delay)
+
+    def listen(self, onStop):
+        """ Calls onStop when coordinator sends stop or goes away. """
+        def receive():
+            while True:
+                try:
+                    kind, _ = self.recv()
+                except (OSError, EOFError):
+                    if not self.closed:
+                        logger.error('coordinator went away, stopping')
+                        onStop()
+                    return
+                if kind == 'stop':
+                    logger.warning('stopped by coordinator')
+                    self.stopped.set()
+                    onStop()
+        threading.Thread(target=receive, name='ClusterStop', daemon=True).start()
+
+    def stream(self, kind, collect, interval):
+        """ Sends collect() every interval seconds until the link is closed. """
+        def send():
+            while not self.closed:
+                time.sleep(interval)
+                payload = collect()
+                if payload:
+                    self.send(kind, payload)
+        threading.Thread(target=send, name='ClusterStream', daemon=True).start()
+
+
+class RemoteReportSink:
+    """
+    Report sink of an agent with interface of ReportSink: batches put by publisher processes are forwarded
+    to the coordinator by a thread of the agent process, summary lines are written to a local file.
+    """
+    def __init__(self, channel, summaryPath):
+        self.channel = channel
+        self.summaryPath = summaryPath
+        self.queue = multiprocessing.Queue()
+        self.thread = threading.Thread(target=self.forward, name='ReportForwarder', daemon=True)
+        self.counts = {'batches': 0, 'records': 0, 'max_backlog': 0, 'backlog_sum': 0, 'write_time': 0}
+        self.stats = None
+
+    def start(self):
+        self.thread.start()
+
+    def forward(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            backlog = self.backlog()
+            start = time.perf_counter()
+            self.channel.send('report', batch)
+            self.counts['write_time'] += time.perf_counter() - start
+            self.counts['batches'] += 1
+            self.counts['records'] += len(batch)
+            self.counts['backlog_sum'] += backlog
+            self.counts['max_backlog'] = max(self.counts['max_backlog'], backlog)
+
+    def put(self, batch):
+        if len(batch):
+            self.queue.put(batch)
+
+    def backlog(self):
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return 0
+
+    def close(self):
+        if self.stats is None:
+            self.queue.put(None)
+            self.thread.join()
+            self.stats = self.counts
+        return self.stats
+
+    def openSummary(self):
+        return open(self.summaryPath, 'a')
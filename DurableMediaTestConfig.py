@@ -18,6 +18,23 @@ class Config:
         self.sizeKB = 500
         # Max publications in progress per publisher
         self.max_queue_size = 20
+        # open loop: publication starts per second per publisher, None - closed loop (new publication when slot is free)
+        self.rate = None
+        # arrivals of open loop: constant or poisson
+        self.arrival = 'constant'
+        # how the number of publications in progress is adjusted, see DurableMediaTestController
+        self.controller = 'ladder'
+        # finished publications per decision of controller, None - default of controller
+        self.controller_window = None
+        # latency controller keeps p95 of time_to_init + dur_brg_time under this [s]
+        self.latency_target = 60.0
+        # search action, see DurableMediaTestSearch
+        self.search_step = 60
+        self.search_rounds = 5
+        self.search_settle = 0.1
+        self.search_max_fail = 0.01
+        self.search_max_latency = None
+        self.search_precision = 0.1
         # Min publications in progress per publisher
         self.min_queue_size = 1
         self.send_delay = 0
@@ -38,9 +55,22 @@ class Config:
         self.update_immediate = 0
 
         self.PUBLISH_TIMEOUT_S = 900
+        # interval of periodic stats, results are flushed and progress printed at this pace
         self.SLEEP_AFTER_CHECK = 6
+        # how often publications in progress are asked for their status [s]
+        self.poll_interval = 1.0
+        # 'fixed' - poll every poll_interval, 'adaptive' - poll around expected end of publication, see StatusPollPolicy
+        self.poll_policy = 'adaptive'
+        self.max_poll_interval = 30
 
         self.threads_per_publisher = 1
+        # 'thread' - ThreadPoolExecutor per publisher, 'asyncio' - one event loop per publisher process
+        self.engine = 'thread'
+        # SOAP calls in flight at once per publisher with asyncio engine, 0 - as many as slots (-q), independent of --threads
+        self.async_calls = 0
+        # 'zeep' - SoapAPI for every call, 'raw' - precompiled envelopes for publish/status/read, see DurableMediaTestTransport
+        self.transport = 'zeep'
+        self.wsdl_dir = 'soap'
         self.early_finish = False
 
         self.private = False
@@ -50,6 +80,34 @@ class Config:
         self.rcv_publishers = None
         self.test_duration = 0
         self.pdf_file = None
+        # bound of serialized source pdfs kept in memory per process [MB]
+        self.pdf_cache_mb = 256
+        # file with payloads written by prepare-payloads action, run publishes from it when set
+        self.corpus_file = None
+        # digest of content in report md5 column: md5, blake2b, xxhash or none
+        self.digest = 'md5'
+        # 'csv', 'csv.gz' or 'parquet' (needs pyarrow), written by report writer process
+        self.report_format = 'csv'
+        # port of live metrics endpoint in Prometheus text format, None - disabled
+        self.metrics_port = None
+        # address metrics endpoint listens on, '' or 0.0.0.0 exposes it to all interfaces
+        self.metrics_host = '127.0.0.1'
+        # profile of publisher processes and main process: cpu, wall, alloc or None, see DurableMediaTestProfile
+        self.profile = None
+        # seconds between stack samples of wall profile
+        self.profile_interval = 0.01
+        # coordinator and agent actions, see DurableMediaTestCluster: host:port of coordinator (it listens on port)
+        self.cluster = None
+        # agents coordinator waits for
+        self.agents = 1
+        # shared secret of coordinator and agents, required by both actions
+        self.cluster_key = None
+        # seconds between sending work to agents and synchronized start of the run
+        self.start_delay = 5.0
+        # worker processes of the run, None - one per publisher, see DurableMediaTestWorkers
+        self.workers = None
+        # processes sharing one publisher: ip:port -> shards, '' -> every publisher
+        self.publisher_shards = {}
         self.pdf_getter = None
         self.pubs_instruction = {}
         self.pubs_categories = {}
@@ -163,7 +221,7 @@ class Config:
     def readConfFromArgparse(self, params):
 
         parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-        parser.add_argument('action', help='Action to execute', choices=['setup', 'categories', 'run', 'noop'], nargs='?', default=self.action)
+        parser.add_argument('action', help='Action to execute', choices=['setup', 'categories', 'run', 'search', 'prepare-payloads', 'coordinator', 'agent', 'noop'], nargs='?', default=self.action)
         parser.add_argument('-c', '--configFile', help='Path to config.py of colony')
         parser.add_argument('--publishers', help='Override publishers config')
         parser.add_argument('--publishers_limit', help='Only select a few first publishers from config', type=int)
@@ -172,12 +230,30 @@ class Config:
         parser.add_argument('-n', '--num_publications', help='How many documents per publisher will be published', type=int, default=self.documents_to_publish)
         parser.add_argument('-s', '--size', help='Size of documents to publish [kB]', type=int, default=self.sizeKB)
         parser.add_argument('-q', '--queue_size', help='Max number of concurrent publications', type=int, default=self.max_queue_size)
+        parser.add_argument('--rate', help='Open loop: publication starts per second per publisher, independent of completions, -q caps publications in progress', type=float, default=self.rate)
+        parser.add_argument('--arrival', help='Arrivals of open loop --rate', choices=['constant', 'poisson'], default=self.arrival)
+        parser.add_argument('--controller', help='Concurrency controller adjusting number of publications in progress', choices=['ladder', 'aimd', 'gradient', 'latency'], default=self.controller)
+        parser.add_argument('--controller_window', help='Finished publications per controller decision, default depends on controller', type=int, default=self.controller_window)
+        parser.add_argument('--latency_target', help='p95 latency [s] kept by latency controller', type=float, default=self.latency_target)
+        parser.add_argument('--search_step', help='Seconds of one round of search at a level', type=int, default=self.search_step)
+        parser.add_argument('--search_rounds', help='Max rounds of search at a level before it is taken as settled', type=int, default=self.search_rounds)
+        parser.add_argument('--search_settle', help='Relative difference of throughput of two rounds at which level is settled', type=float, default=self.search_settle)
+        parser.add_argument('--search_max_fail', help='Fraction of failed publications (rejections, timeouts) past the knee', type=float, default=self.search_max_fail)
+        parser.add_argument('--search_max_latency', help='Mean time_to_init + dur_brg_time [s] past the knee, 3x latency of -m level by default', type=float, default=self.search_max_latency)
+        parser.add_argument('--search_precision', help='Bisection stops when step is under this fraction of level', type=float, default=self.search_precision)
         parser.add_argument('-m', '--min_queue_size', help='Min number of concurrent publications', type=int, default=self.min_queue_size)
         parser.add_argument('-t', '--timeout', help='Number of seconds before finishing with failure', type=int, default=self.timeout)
         parser.add_argument('-d', '--send_delay', help='Delay between two sends in seconds', type=float, default=self.send_delay)
         parser.add_argument('--private', help='Execute private docs publishing', action='store_true', default=self.private)
         parser.add_argument('--private_for_publisher', help='Execute private docs publishing, available to read by other publisher', action='store_true', default=self.private)
         parser.add_argument('--threads', help='Number of threads per publisher.', action='store', type=int, default=self.threads_per_publisher)
+        parser.add_argument('--poll_interval', help='Seconds between status checks of one publication in progress', type=float, default=self.poll_interval)
+        parser.add_argument('--poll_policy', help='Status polling of publications in progress', choices=['fixed', 'adaptive'], default=self.poll_policy)
+        parser.add_argument('--max_poll_interval', help='Longest backoff between status checks of late publications', type=float, default=self.max_poll_interval)
+        parser.add_argument('--engine', help='Publication engine: thread pool or asyncio event loop per publisher', choices=['thread', 'asyncio'], default=self.engine)
+        parser.add_argument('--async_calls', help='SOAP calls in flight per publisher with --engine asyncio, 0 - as many as publication slots (-q)', type=int, default=self.async_calls)
+        parser.add_argument('--transport', help='SOAP transport of publish, status and read calls', choices=['zeep', 'raw'], default=self.transport)
+        parser.add_argument('--wsdl_dir', help='Directory with publisher wsdls, used to compile raw transport templates', default=self.wsdl_dir)
         parser.add_argument('--early_finish', help='finish when first publisher finished publishing all of his documents', action='store_true', default=self.early_finish)
         parser.add_argument('--loglevel', help='log level INFO by default', type=str, default=self.loglevel)
         parser.add_argument('-v', '--verbose', help='verbose output on console', action='store_true', default=self.verbose)
@@ -189,6 +265,20 @@ class Config:
         parser.add_argument('--test_duration', help='Test duration in seconds', type=int, default = 0)
         parser.add_argument('--rcv_publishers', help='Publishers receiving private docs')
         parser.add_argument('--pdf_file', help='Path to pdf to publish', default=None)
+        parser.add_argument('--pdf_cache_mb', help='Memory for parsed and serialized source pdfs per process [MB]', type=int, default=self.pdf_cache_mb)
+        parser.add_argument('--corpus', help='Corpus file written by prepare-payloads, run publishes payloads from it', default=self.corpus_file)
+        parser.add_argument('--digest', help='Digest of published content written to report, none skips hashing', choices=['md5', 'blake2b', 'xxhash', 'none'], default=self.digest)
+        parser.add_argument('--report_format', help='Format of report file', choices=['csv', 'csv.gz', 'parquet'], default=self.report_format)
+        parser.add_argument('--metrics_port', help='Serve live metrics of the run in Prometheus text format on this port', type=int, default=self.metrics_port)
+        parser.add_argument('--metrics_host', help='Address of live metrics endpoint, 0.0.0.0 for all interfaces', default=self.metrics_host)
+        parser.add_argument('--profile', help='Profile publisher processes and main process, profiles are written next to the report', choices=['cpu', 'wall', 'alloc'], default=self.profile)
+        parser.add_argument('--cluster', help='host:port of coordinator, coordinator action listens on it, agent action connects to it', default=self.cluster)
+        parser.add_argument('--agents', help='Number of agents coordinator waits for before the run', type=int, default=self.agents)
+        parser.add_argument('--cluster_key', help='Shared secret key authenticating agents and coordinator, required by coordinator and agent actions', default=self.cluster_key)
+        parser.add_argument('--start_delay', help='Seconds between sending work to agents and their synchronized start', type=float, default=self.start_delay)
+        parser.add_argument('--workers', help='Worker processes publishers are packed on, number or auto (CPUs available), default one per publisher', default=self.workers)
+        parser.add_argument('--publisher_shards', help='Worker processes sharing slots of one publisher: N for every publisher or ip:port=N', nargs='+', default=[])
+        parser.add_argument('--profile_interval', help='Seconds between stack samples of wall profile', type=float, default=self.profile_interval)
         parser.add_argument('--use_predefined_pdfs', action='store_true', default=False, help='Use predefined pdf from ./pdfs directory')
 
 
@@ -199,11 +289,33 @@ class Config:
         self.sizeKB = args.size
         self.max_queue_size = args.queue_size
         self.min_queue_size = args.min_queue_size
+        self.rate = args.rate
+        if self.rate is not None and self.rate <= 0:
+            parser.error('--rate must be positive')
+        self.arrival = args.arrival
+        self.controller = args.controller
+        self.controller_window = args.controller_window
+        self.latency_target = args.latency_target
+        self.search_step = args.search_step
+        self.search_rounds = args.search_rounds
+        self.search_settle = args.search_settle
+        self.search_max_fail = args.search_max_fail
+        self.search_max_latency = args.search_max_latency
+        self.search_precision = args.search_precision
         self.timeout = args.timeout
         self.send_delay = args.send_delay
         self.private = args.private
         self.private_for_publisher = args.private_for_publisher
         self.threads_per_publisher = args.threads
+        self.engine = args.engine
+        self.async_calls = args.async_calls
+        if self.async_calls < 0:
+            parser.error('--async_calls must not be negative')
+        self.transport = args.transport
+        self.wsdl_dir = args.wsdl_dir
+        self.poll_interval = args.poll_interval
+        self.poll_policy = args.poll_policy
+        self.max_poll_interval = args.max_poll_interval
         self.early_finish = args.early_finish
         self.loglevel = args.loglevel
         self.verbose = args.verbose
@@ -212,6 +324,40 @@ class Config:
         self.update_immediate = args.update_immediate
         self.test_duration = args.test_duration
         self.pdf_file = args.pdf_file
+        self.pdf_cache_mb = args.pdf_cache_mb
+        self.corpus_file = args.corpus
+        self.digest = args.digest
+        if self.digest == 'xxhash' and importlib.util.find_spec('xxhash') is None:
+            parser.error('--digest xxhash needs xxhash package')
+        self.report_format = args.report_format
+        self.metrics_port = args.metrics_port
+        self.metrics_host = args.metrics_host
+        if self.report_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            parser.error('--report_format parquet needs pyarrow package')
+        self.profile = args.profile
+        self.profile_interval = args.profile_interval
+        if self.profile_interval <= 0:
+            parser.error('--profile_interval must be greater than 0')
+        self.cluster = args.cluster
+        self.agents = args.agents
+        self.cluster_key = args.cluster_key
+        self.start_delay = args.start_delay
+        if args.action in ('coordinator', 'agent') and self.cluster is None:
+            parser.error('{} action needs --cluster host:port'.format(args.action))
+        if args.action in ('coordinator', 'agent') and not self.cluster_key:
+            parser.error('{} action needs --cluster_key'.format(args.action))
+        if self.agents < 1:
+            parser.error('--agents must be at least 1')
+        self.workers = args.workers
+        if self.workers is not None and self.workers != 'auto' and (not self.workers.isdigit() or int(self.workers) < 1):
+            parser.error('--workers must be a positive number or auto')
+        for shards in args.publisher_shards:
+            address, _, count = shards.rpartition('=')
+            if not count.isdigit() or int(count) < 1:
+                parser.error('--publisher_shards needs N or ip:port=N with positive N')
+            self.publisher_shards[address] = int(count)
+        if self.publisher_shards and self.workers is None:
+            parser.error('--publisher_shards needs --workers')
         if args.read_only:
             self.read_only = True
             self.csv_file = args.read_only
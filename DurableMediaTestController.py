@@ -0,0 +1,215 @@
+# 2023-10-12
+"""
+Concurrency controllers of DurableMediaTest (--controller).
+
+Controller decides how many publications a publisher keeps in progress. Finished publications are fed
+to it with observe(ok, dur_brg_time, time_to_init), every `window` finished publications update() returns
+the new limit.
+
+ladder   - original calculateQueue: halve on >=50% failures, /1.5 or /1.1 on fewer failures, x1.2 on success,
+           negative maximum grows by |maximum| until success rate drops under 95%
+aimd     - additive increase, multiplicative decrease on failures
+gradient - Vegas/gradient style, shrinks when latency (time_to_init + dur_brg_time) grows over its long term baseline
+latency  - keeps percentile of latency under a target (SLO), grows while there is headroom
+
+Controllers can be replayed offline against a recorded report, publications are fed in order of pub_end_time:
+    python3 DurableMediaTestController.py report.csv --controller gradient --window 50
+Replay does not model the publisher reacting to the limit, it shows decisions the controller would take.
+"""
+import argparse
+import csv
+import math
+import sys
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(max(int(math.ceil(q / 100 * len(ordered))) - 1, 0), len(ordered) - 1)]
+
+
+class ConcurrencyController:
+    """ Base of controllers, keeps latency samples of the current window and bounds of the limit. """
+    name = None
+    WINDOW = 20
+
+    def __init__(self, minimum, maximum, window=None, **params):
+        self.minimum = max(minimum, 1)
+        # negative maximum is a step of the ladder controller, other controllers have no upper bound then
+        self.maximum = maximum
+        self.window = window or self.WINDOW
+        self.samples = []
+
+    @property
+    def upper(self):
+        return self.maximum if self.maximum > 0 else sys.maxsize
+
+    def clamp(self, limit):
+        return int(min(max(limit, self.minimum), self.upper))
+
+    def observe(self, ok, dur_brg_time, time_to_init):
+        if ok:
+            self.samples.append(time_to_init + dur_brg_time)
+
+    def update(self, limit, ok, fail):
+        """ New limit after ok successful and fail failed publications since the previous update. """
+        new_limit = self.decide(limit, ok, fail)
+        self.samples = []
+        return new_limit
+
+    def decide(self, limit, ok, fail):
+        raise NotImplementedError
+
+    def state(self):
+        return {'controller': self.name, 'maximum': self.maximum}
+
+
+class LadderController(ConcurrencyController):
+    name = 'ladder'
+    WINDOW = 100
+
+    def decide(self, limit, ok, fail):
+        if self.maximum < 0:
+            if ok / (ok + fail) < 0.95:
+                self.maximum = limit
+                return limit
+            return limit - self.maximum
+        if fail >= ok:
+            return max(int(limit / 2), self.minimum)
+        if 8 * fail >= ok:
+            return max(int(limit / 1.5), self.minimum)
+        if fail > 0:
+            return max(int(limit / 1.1), self.minimum)
+        return min(max(int(limit * 1.2), limit + 1), self.maximum)
+
+
+class AimdController(ConcurrencyController):
+    """ Grows by `increase` per window without failures, multiplies by `decrease` when failures exceed tolerance. """
+    name = 'aimd'
+
+    def __init__(self, minimum, maximum, window=None, increase=1, decrease=0.5, tolerance=0.0, **params):
+        super().__init__(minimum, maximum, window)
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+
+    def decide(self, limit, ok, fail):
+        if fail > self.tolerance * (ok + fail):
+            return self.clamp(limit * self.decrease)
+        return self.clamp(limit + self.increase)
+
+
+class GradientController(ConcurrencyController):
+    """
+    Compares latency of the window with its long term average. Gradient long/short (at most 1, at least 0.5)
+    scales the limit, sqrt(limit) is added as allowed queue so that the limit probes upwards when latency is flat.
+    """
+    name = 'gradient'
+
+    def __init__(self, minimum, maximum, window=None, tolerance=1.5, smoothing=0.2, long_window=600, **params):
+        super().__init__(minimum, maximum, window)
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.long_window = long_window
+        self.longLatency = None
+        self.shortLatency = None
+        self.gradient = 1.0
+
+    def decide(self, limit, ok, fail):
+        if fail >= ok or not self.samples:
+            self.gradient = 0.5
+            return self.clamp(limit * self.gradient)
+        self.shortLatency = sum(self.samples) / len(self.samples)
+        if self.longLatency is None:
+            self.longLatency = self.shortLatency
+        else:
+            self.longLatency += (self.shortLatency - self.longLatency) * len(self.samples) / self.long_window
+            if self.longLatency > 2 * self.shortLatency:
+                # latency dropped a lot (e.g. publisher recovered), do not wait for the average to catch up
+                self.longLatency = 2 * self.shortLatency
+        self.gradient = max(0.5, min(1.0, self.tolerance * self.longLatency / self.shortLatency))
+        new_limit = limit * self.gradient + math.sqrt(limit)
+        return self.clamp(limit * (1 - self.smoothing) + new_limit * self.smoothing + 0.5)
+
+    def state(self):
+        return dict(super().state(), gradient=round(self.gradient, 3), short=self.shortLatency, long=self.longLatency)
+
+
+class LatencyTargetController(ConcurrencyController):
+    """
+    Keeps `percentile` of latency under `target` seconds. Over the target limit shrinks proportionally,
+    under `headroom` * target it grows by 10% (at least 1), in between it is kept.
+    """
+    name = 'latency'
+
+    def __init__(self, minimum, maximum, window=None, target=60.0, percentile=95, headroom=0.8, tolerance=0.05, **params):
+        super().__init__(minimum, maximum, window)
+        self.target = target
+        self.percentile = percentile
+        self.headroom = headroom
+        self.tolerance = tolerance
+        self.latency = None
+
+    def decide(self, limit, ok, fail):
+        if fail > self.tolerance * (ok + fail) or not self.samples:
+            return self.clamp(limit * 0.5)
+        self.latency = percentile(self.samples, self.percentile)
+        if self.latency > self.target:
+            return self.clamp(limit * max(0.5, self.target / self.latency))
+        if self.latency < self.headroom * self.target:
+            return self.clamp(max(limit * 1.1, limit + 1))
+        return limit
+
+    def state(self):
+        return dict(super().state(), latency=self.latency, target=self.target)
+
+
+CONTROLLERS = {controller.name: controller for controller in (LadderController, AimdController, GradientController, LatencyTargetController)}
+
+
+def createController(name, minimum, maximum, window=None, **params):
+    return CONTROLLERS[name](minimum, maximum, window, **params)
+
+
+def replay(rows, controller, limit):
+    """ Feeds recorded publications to controller, yields (pub_end_time, limit, state) after every update. """
+    ok = fail = 0
+    for row in sorted(rows, key=lambda row: float(row['pub_end_time'])):
+        success = row['status'].strip() == 'FINISHED_OK'
+        controller.observe(success, float(row['dur_brg_time']), float(row['time_to_init']))
+        ok += success
+        fail += not success
+        if ok + fail >= controller.window:
+            limit = controller.update(limit, ok, fail)
+            ok = fail = 0
+            yield float(row['pub_end_time']), limit, controller.state()
+
+
+def readReport(path):
+    with open(path, newline='') as report:
+        return [row for row in csv.DictReader(line for line in report if not line.startswith('#'))]
+
+
+def main(params):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('report', help='Report csv of DurableMediaTest run')
+    parser.add_argument('--controller', help='Controller to replay', choices=sorted(CONTROLLERS), default='gradient')
+    parser.add_argument('--window', help='Finished publications per decision', type=int, default=None)
+    parser.add_argument('-m', '--min_queue_size', help='Min number of concurrent publications', type=int, default=1)
+    parser.add_argument('-q', '--queue_size', help='Max number of concurrent publications', type=int, default=20)
+    parser.add_argument('--latency_target', help='Target latency of latency controller [s]', type=float, default=60.0)
+    args = parser.parse_args(params)
+
+    controller = createController(args.controller, args.min_queue_size, args.queue_size, args.window, target=args.latency_target)
+    limit = int((args.min_queue_size + args.queue_size) / 2) if args.queue_size > 0 else args.min_queue_size
+    rows = readReport(args.report)
+    print('pub_end_time,limit,state')
+    for end, limit, state in replay(rows, controller, limit):
+        print('{:.3f},{},{}'.format(end, limit, state))
+    return True
+
+
+if __name__ == "__main__":
+    ok = main(sys.argv[1:])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,132 @@
+# 2023-10-12
+"""
+Latency histograms of DurableMediaTest.
+
+Values are counted in logarithmic buckets (HDR style): bucket boundaries grow by GROWTH, so every
+percentile is known within PRECISION relative error whatever the range, from microseconds to
+PUBLISH_TIMEOUT_S. Buckets are sparse dicts, histograms of threads and publisher processes are merged
+by adding counts, no records are needed for percentiles.
+HistogramSet keeps one histogram per (metric, publisher, status).
+"""
+import math
+
+PRECISION = 0.01
+GROWTH = 1 + 2 * PRECISION
+LOG_GROWTH = math.log(GROWTH)
+# values up to LOWEST [s] fall into bucket 0
+LOWEST = 1e-6
+METRICS = ('dur_time', 'dur_brg_time', 'time_to_init', 'dur_read_time')
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucketIndex(value):
+    if value <= LOWEST:
+        return 0
+    return int(math.log(value / LOWEST) / LOG_GROWTH) + 1
+
+
+def bucketBounds(index):
+    if index == 0:
+        return 0.0, LOWEST
+    return LOWEST * GROWTH ** (index - 1), LOWEST * GROWTH ** index
+
+
+class LatencyHistogram:
+    """ Counts of values in log buckets with exact count, sum, min and max. """
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value):
+        index = bucketIndex(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """ Value under which q percent of recorded values are, geometric middle of its bucket. """
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                low, high = bucketBounds(index)
+                return min(max(math.sqrt(low * high) if low else high / 2, self.min), self.max)
+        return self.max
+
+
+class HistogramSet:
+    """ LatencyHistograms keyed by (metric, publisher, status). """
+    __slots__ = ('histograms',)
+
+    def __init__(self):
+        self.histograms = {}
+
+    def __len__(self):
+        return len(self.histograms)
+
+    def record(self, publisher, status, values):
+        """ values: pairs (metric, value), None values are skipped. """
+        for metric, value in values:
+            if value is None:
+                continue
+            key = (metric, publisher, status)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.record(value)
+
+    def merge(self, other):
+        for key, histogram in other.histograms.items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                mine = self.histograms[key] = LatencyHistogram()
+            mine.merge(histogram)
+
+    def combined(self, metric, status=None, publisher=None):
+        """ One histogram of metric merged over all publishers and statuses, or only the given ones. """
+        result = LatencyHistogram()
+        for (name, url, state), histogram in self.histograms.items():
+            if name == metric and status in (None, state) and publisher in (None, url):
+                result.merge(histogram)
+        return result
+
+    def summary(self, metric, status=None, publisher=None):
+        histogram = self.combined(metric, status, publisher)
+        return ' '.join('p{:g}: {:.3f}'.format(q, histogram.percentile(q)) for q in PERCENTILES) + \
+            ' max: {:.3f} mean: {:.3f} (n={})'.format(histogram.max, histogram.mean(), histogram.count)
+
+    def dump(self, path):
+        """ Writes percentiles and non-empty buckets of every histogram as csv. """
+        with open(path, 'w') as file:
+            file.write('metric,publisher,status,count,min,' + ','.join('p{:g}'.format(q) for q in PERCENTILES) +
+                       ',max,mean,bucket_low,bucket_high,bucket_count\n')
+            for (metric, publisher, status), histogram in sorted(self.histograms.items()):
+                head = '{},{},{},{},{:.6f},{},{:.6f},{:.6f}'.format(
+                    metric, publisher, status.strip(), histogram.count, histogram.min,
+                    ','.join('{:.6f}'.format(histogram.percentile(q)) for q in PERCENTILES), histogram.max, histogram.mean())
+                for index in sorted(histogram.counts):
+                    low, high = bucketBounds(index)
+                    file.write('{},{:.6f},{:.6f},{}\n'.format(head, low, high, histogram.counts[index]))
@@ -0,0 +1,140 @@
+# 2023-10-12
+"""
+Live metrics of DurableMediaTest (--metrics_port, on --metrics_host, 127.0.0.1 by default).
+
+MetricsBoard is a table in shared memory (multiprocessing.Array of doubles) with one row per publisher
+(per shard of publisher with --workers).
+It is created in the main process before publisher processes are forked, each publisher process writes only
+its own rows, so no lock is needed. Main process serves the table in Prometheus text format over HTTP
+on /metrics, together with backlog of the report writer.
+"""
+import http.server
+import multiprocessing
+import threading
+import time
+
+# statuses with own counter, everything else is counted as OTHER
+STATUSES = ('FINISHED_OK', 'TIMEOUT', 'READ_TIMEOUT', 'COMMUNICATION_PROBLEM', 'COMMUNICATION_READ_PROBLEM', 'OTHER')
+LATENCY_METRICS = ('dur_time', 'dur_brg_time', 'time_to_init')
+QUANTILES = (0.5, 0.9, 0.99)
+FIELDS = ('updated', 'throughput', 'active', 'max_active') + tuple('status:' + status for status in STATUSES) + \
+    tuple('latency:{}:{}'.format(metric, q) for metric in LATENCY_METRICS for q in QUANTILES)
+FIELD_INDEX = {field: i for i, field in enumerate(FIELDS)}
+
+
+class MetricsBoard:
+    """ Shared table of publisher metrics, see module docstring. """
+    def __init__(self, publishers):
+        self.publishers = list(publishers)
+        self.rows = {url: i for i, url in enumerate(self.publishers)}
+        # publisher url -> rows of its shards (url, url#2, ...), see DurableMediaTestWorkers
+        self.shards = {}
+        for i, label in enumerate(self.publishers):
+            self.shards.setdefault(label.split('#')[0], []).append(i)
+        self.values = multiprocessing.Array('d', len(self.publishers) * len(FIELDS), lock=False)
+        # seconds between updates from one publisher
+        self.interval = 1.0
+        self.server = None
+
+    def update(self, url, throughput, active, max_active, publishedOk, failures, histograms):
+        """ Called by publisher process with its current totals. """
+        row = self.rows.get(url)
+        if row is None:
+            return
+        base = row * len(FIELDS)
+        values = self.values
+        statuses = dict.fromkeys(STATUSES, 0)
+        statuses['FINISHED_OK'] = publishedOk
+        for status, count in failures.items():
+            status = status.strip()
+            statuses[status if status in statuses else 'OTHER'] += count
+        for status, count in statuses.items():
+            values[base + FIELD_INDEX['status:' + status]] = count
+        for metric in LATENCY_METRICS:
+            histogram = histograms.combined(metric, 'FINISHED_OK')
+            for q in QUANTILES:
+                values[base + FIELD_INDEX['latency:{}:{}'.format(metric, q)]] = histogram.percentile(q * 100)
+        values[base + FIELD_INDEX['throughput']] = throughput
+        values[base + FIELD_INDEX['active']] = active
+        values[base + FIELD_INDEX['max_active']] = max_active
+        values[base + FIELD_INDEX['updated']] = time.time()
+
+    def value(self, url, field):
+        return self.values[self.rows[url] * len(FIELDS) + FIELD_INDEX[field]]
+
+    def row(self, url):
+        """
+        Values of publisher in FIELDS order, shipped by cluster agents to coordinator. Counters of shards
+        are summed, for latency quantiles and update time the highest value of shards is taken.
+        """
+        values = [0.0] * len(FIELDS)
+        for row in self.shards.get(url, ()):
+            base = row * len(FIELDS)
+            for field, i in FIELD_INDEX.items():
+                value = self.values[base + i]
+                values[i] = max(values[i], value) if field == 'updated' or field.startswith('latency:') else values[i] + value
+        return values
+
+    def setRow(self, url, values):
+        row = self.rows.get(url)
+        if row is not None:
+            base = row * len(FIELDS)
+            self.values[base:base + len(FIELDS)] = values
+
+    def render(self, report_backlog=None):
+        """ Current table in Prometheus text exposition format. """
+        lines = []
+
+        def family(name, kind, help, samples):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                labels = ','.join('{}="{}"'.format(key, val) for key, val in labels)
+                lines.append('{}{} {}'.format(name, '{' + labels + '}' if labels else '', repr(float(value))))
+
+        family('dmt_throughput', 'gauge', 'Successful publications per second since previous update',
+               [((('publisher', url),), self.value(url, 'throughput')) for url in self.publishers])
+        family('dmt_in_flight', 'gauge', 'Publication slots in progress',
+               [((('publisher', url),), self.value(url, 'active')) for url in self.publishers])
+        family('dmt_max_active', 'gauge', 'Limit of publications in progress set by controller',
+               [((('publisher', url),), self.value(url, 'max_active')) for url in self.publishers])
+        family('dmt_publications_total', 'counter', 'Finished publications by status',
+               [((('publisher', url), ('status', status)), self.value(url, 'status:' + status))
+                for url in self.publishers for status in STATUSES])
+        family('dmt_latency_seconds', 'gauge', 'Latency quantiles of FINISHED_OK publications since start',
+               [((('publisher', url), ('metric', metric), ('quantile', q)), self.value(url, 'latency:{}:{}'.format(metric, q)))
+                for url in self.publishers for metric in LATENCY_METRICS for q in QUANTILES])
+        family('dmt_last_update_timestamp_seconds', 'gauge', 'Time of last update from publisher process',
+               [((('publisher', url),), self.value(url, 'updated')) for url in self.publishers])
+        if report_backlog is not None:
+            family('dmt_report_backlog_batches', 'gauge', 'Batches waiting for report writer', [((), report_backlog())])
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, report_backlog=None, host='127.0.0.1'):
+        """ Starts HTTP server on host:port in a daemon thread of the calling (main) process. """
+        board = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = board.render(report_backlog).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
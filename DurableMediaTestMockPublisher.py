@@ -0,0 +1,355 @@
+# 2023-10-12
+"""
+Stand-in Durable Media publisher for offline runs and benchmarks of DurableMediaTest.
+
+Answers Hello, Setup, GetThisPublisherCategories, SetThisPublisherCategories, PublishPublicDocument,
+PublishPrivateDocument, GetPublishStatus and GetDocument as SOAP over HTTP/1.1 with keep-alive, many ports
+in one asyncio event loop (optionally spread over --processes). Operation and the few fields it needs are
+picked out of requests without parsing the whole envelope, answers carry the fields DurableMediaTest reads.
+
+Publication model of every port:
+    time_to_init     --init_latency seconds before Publish* is answered
+    rejections       --reject STATUS=P,... answered to Publish* instead of PUBLISHING-INITIATED
+                     (e.g. PUBLISHING-SUBSYSTEM-LOW-DISK-SPACE)
+    over capacity    with more than --max_in_progress publications initiated, Publish* is answered --overload_status
+    latency          publication finishes --latency seconds (+-jitter) after it was initiated
+    ceiling          at most --max_rate publications finish per second, over it latency grows
+    failures         --fail STATUS=P,... final status of initiated publications instead of PUBLISHING-OK,
+                     STUCK keeps publication initiated forever (client times it out)
+
+Usage:
+    python3 DurableMediaTestMockPublisher.py --ports 31404-31407 --latency 2 --max_rate 50
+    ./DurableMediaTest.py --publishers "{'127.0.0.1': ['31404', '31405', '31406', '31407']}" run --transport raw
+"""
+import argparse
+import asyncio
+import base64
+import datetime
+import heapq
+import itertools
+import logging
+import multiprocessing
+import random
+import re
+import signal
+import sys
+import time
+from collections import Counter
+
+try:
+    from DurableMediaTestTransport import DEFAULT_NAMESPACE, namespaceFromWsdl
+except ImportError:
+    from colony_scripts.colony.tests.DurableMediaTestTransport import DEFAULT_NAMESPACE, namespaceFromWsdl
+
+logger = logging.getLogger("DurableMediaTestMockPublisher")
+
+OPERATION = re.compile(rb'<(?:[\w-]+:)?Body\b[^>]*>\s*<(?:[\w-]+:)?(\w+)')
+FIELDS = {name: re.compile(rb'<(?:[\w-]+:)?' + name.encode() + rb'>([^<]*)<')
+          for name in ('jobId', 'documentBlockchainAddress', 'previousDocumentBlockchainAddress', 'sourceDocument')}
+BASE58 = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+PLACEHOLDER_DOCUMENT = base64.b64encode(b'%PDF-1.4\n% stored by DurableMediaTestMockPublisher without --store_documents\n%%EOF\n')
+
+
+def parseMix(text):
+    """ 'STATUS=P,STATUS=P' -> [(STATUS, P)] """
+    mix = []
+    for item in filter(None, (text or '').split(',')):
+        status, _, probability = item.partition('=')
+        mix.append((status.strip(), float(probability)))
+    if sum(probability for _, probability in mix) > 1:
+        raise ValueError('probabilities of {} exceed 1'.format(text))
+    return mix
+
+
+def parsePorts(text):
+    """ '31404-31407,31500' -> [31404, 31405, 31406, 31407, 31500] """
+    ports = []
+    for item in text.split(','):
+        first, _, last = item.partition('-')
+        ports.extend(range(int(first), int(last or first) + 1))
+    return ports
+
+
+def base58Address(number, length=44):
+    digits = []
+    while number:
+        number, digit = divmod(number, 58)
+        digits.append(BASE58[digit])
+    return ''.join(reversed(digits)).rjust(length, BASE58[0])
+
+
+class MockProfile:
+    """ Behaviour shared by all ports of the mock. """
+    def __init__(self, latency=1.0, jitter=0.0, init_latency=0.0, reject='', fail='', max_rate=0, max_in_progress=0,
+                 overload_status='PUBLISHING-SUBSYSTEM-BUSY', store_documents=False, namespace=DEFAULT_NAMESPACE):
+        self.latency = latency
+        self.jitter = jitter
+        self.init_latency = init_latency
+        self.reject = parseMix(reject)
+        self.fail = parseMix(fail)
+        self.max_rate = max_rate
+        self.max_in_progress = max_in_progress
+        self.overload_status = overload_status
+        self.store_documents = store_documents
+        self.namespace = namespace
+
+
+class MockPublisher:
+    """ Publications of one port. """
+    def __init__(self, port, profile, rng):
+        self.port = port
+        self.profile = profile
+        self.rng = rng
+        self.publisherId = 'MOCK{}'.format(port)
+        # jobId -> [due, final status, address, previous address]
+        self.jobs = {}
+        self.dueTimes = []
+        self.documents = {}
+        self.counter = itertools.count(1)
+        self.nextCompletion = 0.0
+        self.stats = Counter()
+
+    @staticmethod
+    def pick(mix, rng):
+        draw = rng.random()
+        for status, probability in mix:
+            if draw < probability:
+                return status
+            draw -= probability
+        return None
+
+    def inProgress(self, now):
+        while self.dueTimes and self.dueTimes[0] <= now:
+            heapq.heappop(self.dueTimes)
+        return len(self.dueTimes)
+
+    def publish(self, body, now):
+        """ Returns (status, jobId). """
+        profile = self.profile
+        rejected = self.pick(profile.reject, self.rng)
+        if rejected is not None:
+            return rejected, None
+        if profile.max_in_progress and self.inProgress(now) >= profile.max_in_progress:
+            return profile.overload_status, None
+        number = next(self.counter)
+        jobId = 'job{}x{}'.format(self.port, number)
+        latency = profile.latency * (1 + profile.jitter * (2 * self.rng.random() - 1))
+        due = now + max(latency, 0)
+        if profile.max_rate:
+            due = self.nextCompletion = max(due, self.nextCompletion + 1 / profile.max_rate)
+        status = self.pick(profile.fail, self.rng) or 'PUBLISHING-OK'
+        if status == 'STUCK':
+            due = float('inf')
+        else:
+            heapq.heappush(self.dueTimes, due)
+        address = base58Address(self.port * 10 ** 12 + number)
+        previous = field(body, 'previousDocumentBlockchainAddress')
+        self.jobs[jobId] = [due, status, address, previous]
+        if profile.store_documents:
+            self.documents[address] = (field(body, 'sourceDocument') or b'', previous)
+        return 'PUBLISHING-INITIATED', jobId
+
+    def status(self, jobId, now):
+        """ Returns (status, job) where job is [due, final status, address, previous address] or None. """
+        job = self.jobs.get(jobId)
+        if job is None:
+            return 'PUBLISHING-JOB-NOT-FOUND', None
+        if job[0] > now:
+            return 'PUBLISHING-INITIATED', None
+        del self.jobs[jobId]
+        return job[1], job
+
+    def document(self, address):
+        if self.profile.store_documents:
+            return self.documents.get(address)
+        return PLACEHOLDER_DOCUMENT, None
+
+
+def field(body, name):
+    match = FIELDS[name].search(body)
+    return match.group(1) if match else None
+
+
+def envelope(namespace, operation, status, inner=''):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ckk="{}"><soapenv:Body>'
+            '<ckk:{}Response><outParams><status><status>{}</status><timestamp>{}</timestamp></status>{}</outParams>'
+            '</ckk:{}Response></soapenv:Body></soapenv:Envelope>').format(
+        namespace, operation, status, datetime.datetime.now().isoformat(), inner, operation).encode()
+
+
+def microseconds(timestamp):
+    return str(int(timestamp * 10 ** 6))
+
+
+async def answer(publisher, operation, body):
+    """ Returns (http status, body) of the answer to operation. """
+    profile = publisher.profile
+    namespace = profile.namespace
+    now = time.time()
+    if operation in ('PublishPublicDocument', 'PublishPrivateDocument'):
+        if profile.init_latency:
+            await asyncio.sleep(profile.init_latency)
+        status, jobId = publisher.publish(body, time.time())
+        publisher.stats['publish:' + status] += 1
+        return 200, envelope(namespace, operation, status, '<jobId>{}</jobId>'.format(jobId) if jobId else '')
+    if operation == 'GetPublishStatus':
+        jobId = (field(body, 'jobId') or b'').decode()
+        status, job = publisher.status(jobId, now)
+        publisher.stats['status:' + status] += 1
+        inner = '<jobId>{}</jobId>'.format(jobId)
+        if status == 'PUBLISHING-OK':
+            inner += ('<documentBlockchainAddress>{}</documentBlockchainAddress><BLOCKCHAINpublicationDate>{}'
+                      '</BLOCKCHAINpublicationDate><BLOCKCHAINestimMinPropagationTime>{}</BLOCKCHAINestimMinPropagationTime>').format(
+                job[2], microseconds(job[0]), microseconds(job[0]))
+        return 200, envelope(namespace, operation, status, inner)
+    if operation == 'GetDocument':
+        address = (field(body, 'documentBlockchainAddress') or b'').decode()
+        stored = publisher.document(address)
+        publisher.stats['read'] += 1
+        if stored is None:
+            return 200, envelope(namespace, operation, 'PUBLISHING-DOCUMENT-NOT-FOUND')
+        content, previous = stored
+        inner = '<documentInfo><documentData>{}<sourceDocument>{}</sourceDocument></documentData>' \
+                '<documentBlockchainData><publisherId>{}</publisherId></documentBlockchainData></documentInfo>'.format(
+                    '<previousDocumentBlockchainAddress>{}</previousDocumentBlockchainAddress>'.format(previous.decode()) if previous else '',
+                    content.decode(), publisher.publisherId)
+        return 200, envelope(namespace, operation, 'PUBLISHING-OK', inner)
+    publisher.stats[operation] += 1
+    if operation == 'Hello':
+        return 200, envelope(namespace, operation, 'PUBLISHING-OK', '<publisherId>{}</publisherId>'.format(publisher.publisherId))
+    if operation in ('Setup', 'SetThisPublisherCategories'):
+        return 200, envelope(namespace, operation, 'PUBLISHING-OK')
+    if operation == 'GetThisPublisherCategories':
+        return 200, envelope(namespace, operation, 'PUBLISHING-OK', '<categories><name>ROOT</name><active>true</active></categories>')
+    return 500, ('<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"><soapenv:Body><soapenv:Fault>'
+                 '<faultcode>soapenv:Client</faultcode><faultstring>Unknown operation {}</faultstring></soapenv:Fault>'
+                 '</soapenv:Body></soapenv:Envelope>').format(operation).encode()
+
+
+async def readRequest(reader):
+    """ Returns (headers, body) of next request on connection or None when it is closed. """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    headers = {}
+    for line in head.decode('latin-1').split('\r\n')[1:]:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        parts = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                await reader.readuntil(b'\r\n')
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return headers, b''.join(parts)
+    return headers, await reader.readexactly(int(headers.get('content-length', 0)))
+
+
+def connectionHandler(publisher):
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await readRequest(reader)
+                if request is None:
+                    break
+                headers, body = request
+                match = OPERATION.search(body)
+                # SOAP 1.1 clients name the operation in SOAPAction too
+                operation = match.group(1).decode() if match else headers.get('soapaction', '').strip('"').rsplit('/', 1)[-1]
+                code, data = await answer(publisher, operation, body)
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: text/xml; charset=utf-8\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                    code, 'OK' if code == 200 else 'Internal Server Error', len(data), 'close' if close else 'keep-alive').encode())
+                writer.write(data)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(host, ports, profile, stats_interval, seed):
+    rng = random.Random(seed)
+    publishers = [MockPublisher(port, profile, rng) for port in ports]
+    servers = [await asyncio.start_server(connectionHandler(publisher), host, publisher.port, backlog=1024) for publisher in publishers]
+    label = ','.join(str(port) for port in ports)
+    logger.info('serving ports %s', label)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    last = Counter()
+    while True:
+        try:
+            await asyncio.wait_for(stop.wait(), stats_interval)
+            break
+        except asyncio.TimeoutError:
+            pass
+        total = sum((publisher.stats for publisher in publishers), Counter())
+        delta = total - last
+        last = total
+        logger.info('ports %s: %s', label, ' '.join('{}={:.1f}/s'.format(key, count / stats_interval) for key, count in sorted(delta.items())))
+    for server in servers:
+        server.close()
+    logger.info('ports %s totals: %s', label, dict(sum((publisher.stats for publisher in publishers), Counter())))
+
+
+def runPorts(host, ports, profile, stats_interval, seed):
+    asyncio.run(serve(host, ports, profile, stats_interval, seed))
+
+
+def main(params):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--ports', help='Ports to serve, e.g. 31404-31407,31500', default='31404')
+    parser.add_argument('--processes', help='Processes serving the ports', type=int, default=1)
+    parser.add_argument('--latency', help='Seconds from PUBLISHING-INITIATED to final status', type=float, default=1.0)
+    parser.add_argument('--jitter', help='Relative spread of latency, uniform +-', type=float, default=0.0)
+    parser.add_argument('--init_latency', help='Seconds before Publish* is answered', type=float, default=0.0)
+    parser.add_argument('--reject', help='Statuses answered to Publish* with probabilities, e.g. PUBLISHING-SUBSYSTEM-LOW-DISK-SPACE=0.001', default='')
+    parser.add_argument('--fail', help='Final statuses of initiated publications with probabilities, STUCK never finishes', default='')
+    parser.add_argument('--max_rate', help='Publications finished per second per port, 0 - unlimited', type=float, default=0)
+    parser.add_argument('--max_in_progress', help='Initiated publications per port over which Publish* is rejected, 0 - unlimited', type=int, default=0)
+    parser.add_argument('--overload_status', help='Status answered to Publish* over --max_in_progress', default='PUBLISHING-SUBSYSTEM-BUSY')
+    parser.add_argument('--store_documents', help='Keep published documents for GetDocument', action='store_true', default=False)
+    parser.add_argument('--wsdl_dir', help='Directory with publisher wsdls, namespace of answers is taken from them', default='soap')
+    parser.add_argument('--stats_interval', help='Seconds between logged request rates', type=float, default=10)
+    parser.add_argument('--seed', help='Seed of random latencies and failures', type=int, default=None)
+    args = parser.parse_args(params)
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s][%(processName)s][%(levelname)s] %(message)s')
+
+    try:
+        profile = MockProfile(args.latency, args.jitter, args.init_latency, args.reject, args.fail, args.max_rate,
+                              args.max_in_progress, args.overload_status, args.store_documents, namespaceFromWsdl(args.wsdl_dir))
+    except ValueError as e:
+        parser.error(str(e))
+    ports = parsePorts(args.ports)
+    processes = max(min(args.processes, len(ports)), 1)
+    if processes == 1:
+        runPorts(args.host, ports, profile, args.stats_interval, args.seed)
+        return True
+    workers = []
+    for i in range(processes):
+        seed = None if args.seed is None else args.seed + i
+        worker = multiprocessing.Process(target=runPorts, args=(args.host, ports[i::processes], profile, args.stats_interval, seed),
+                                         name='Mock{}'.format(i))
+        worker.start()
+        workers.append(worker)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for worker in workers:
+        worker.join()
+    return all(worker.exitcode == 0 for worker in workers)
+
+
+if __name__ == "__main__":
+    ok = main(sys.argv[1:])
+    sys.exit(0 if ok else 1)
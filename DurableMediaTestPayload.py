@@ -0,0 +1,320 @@
+# 2023-10-12
+"""
+Document payloads of DurableMediaTest.
+
+Publications of one run share almost all of their content, only a short unique part differs.
+PayloadTemplate keeps the shared parts once per process together with their base64 encoding,
+Payload is a cheap (template, unique part) pair which is encoded or written out chunk by chunk,
+so no publication copies the shared body.
+PdfCache keeps source PDFs parsed and serialized once, PdfTemplate patches only WhoAmI of a serialized PDF.
+Corpus is a file with every payload of a run written out in advance (prepare-payloads action), run only
+slices its memory mapping.
+ContentHasher computes digests of publications reusing hash state of the shared parts.
+"""
+import base64
+import hashlib
+import json
+import mmap
+import struct
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+# bytes of unique part in WhoAmI of --pdf_file documents, fixed so that xref offsets stay valid
+WHOAMI_WIDTH = 128
+WHOAMI_MARKER = b'~' * WHOAMI_WIDTH
+
+
+class PayloadTemplate:
+    """
+    Shared prefix and tail of document content, unique part of each publication goes between them.
+    Base64 of the shared parts is computed once, encoding a publication only encodes its unique part
+    plus up to two bytes borrowed from each side to keep base64 blocks aligned.
+    """
+    def __init__(self, prefix, tail=b''):
+        self.prefix = memoryview(prefix)
+        self.tail = memoryview(tail)
+        aligned = len(self.prefix) - len(self.prefix) % 3
+        self.prefixB64 = base64.b64encode(self.prefix[:aligned])
+        self.prefixRest = bytes(self.prefix[aligned:])
+        self.tailB64 = {}
+        self.hashStates = {}
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def tailEncoding(self, skip):
+        """ Base64 of tail without its first skip bytes. """
+        encoded = self.tailB64.get(skip)
+        if encoded is None:
+            with self.lock:
+                encoded = self.tailB64.setdefault(skip, base64.b64encode(self.tail[skip:]))
+        return encoded
+
+    def hashState(self, hasher):
+        """ Hash of prefix, copied by every publication instead of hashing the shared block again. """
+        state = self.hashStates.get(hasher.name)
+        if state is None:
+            state = hasher.new()
+            state.update(self.prefix)
+            with self.lock:
+                state = self.hashStates.setdefault(hasher.name, state)
+        return state.copy()
+
+    def hexdigest(self, hasher, unique):
+        if unique:
+            state = self.hashState(hasher)
+            state.update(unique)
+            state.update(self.tail)
+            return state.hexdigest()
+        # whole document without unique part, e.g. a predefined pdf, is hashed once
+        digest = self.digests.get(hasher.name)
+        if digest is None:
+            state = self.hashState(hasher)
+            state.update(self.tail)
+            with self.lock:
+                digest = self.digests.setdefault(hasher.name, state.hexdigest())
+        return digest
+
+    def render(self, unique=b''):
+        return Payload(self, unique)
+
+
+class Payload:
+    """ Content of one publication: template shared with other publications and its unique part. """
+    __slots__ = ('template', 'unique')
+
+    def __init__(self, template, unique=b''):
+        self.template = template
+        self.unique = unique
+
+    def __len__(self):
+        return len(self.template.prefix) + len(self.unique) + len(self.template.tail)
+
+    def __bytes__(self):
+        return b''.join(self.parts())
+
+    def parts(self):
+        return self.template.prefix, self.unique, self.template.tail
+
+    def hexdigest(self, hasher):
+        return self.template.hexdigest(hasher, self.unique)
+
+    def b64chunks(self):
+        """ Base64 of the whole content as list of chunks, shared chunks are not copied. """
+        template = self.template
+        head = template.prefixRest + self.unique
+        skip = min(-len(head) % 3, len(template.tail))
+        if skip:
+            head += template.tail[:skip]
+        return [template.prefixB64, base64.b64encode(head), template.tailEncoding(skip)]
+
+
+class PdfTemplate(PayloadTemplate):
+    """
+    Serialized PDF with WhoAmI Info entry set to shared random block followed by WHOAMI_WIDTH bytes
+    of the publication's unique part. Unique part is escaped and padded to fixed width, rendering
+    a publication does not parse or write the PDF again.
+    """
+    def __init__(self, serialized):
+        pos = serialized.rfind(WHOAMI_MARKER + b')')
+        if pos < 0:
+            raise ValueError('WhoAmI placeholder not found in serialized pdf')
+        super().__init__(serialized[:pos], serialized[pos + WHOAMI_WIDTH:])
+
+    @staticmethod
+    def escape(unique):
+        return unique.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+    def render(self, unique=b''):
+        unique = unique[:WHOAMI_WIDTH]
+        escaped = self.escape(unique)
+        while len(escaped) > WHOAMI_WIDTH:
+            unique = unique[:-1]
+            escaped = self.escape(unique)
+        return Payload(self, escaped.ljust(WHOAMI_WIDTH))
+
+
+def serializePdf(path, whoAmI=None):
+    """ Parses pdf at path and writes it out again, optionally with WhoAmI Info entry set. """
+    from pdfrw import PdfReader, PdfWriter, PdfDict
+    trailer = PdfReader(path)
+    if whoAmI is not None:
+        if trailer.Info is None:
+            trailer.Info = PdfDict()
+        trailer.Info.WhoAmI = whoAmI
+    out = BytesIO()
+    PdfWriter(trailer=trailer).write(out)
+    return out.getvalue()
+
+
+class PdfCache:
+    """
+    Process wide cache of PayloadTemplates built from source PDFs, each PDF is parsed and serialized once.
+    Least recently used templates are dropped when their total size exceeds max_bytes.
+    Templates are built outside of the lock, concurrent publications never wait for each other's parsing.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.templates = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        # the newest template is kept even when it alone exceeds max_bytes
+        while self.size > self.max_bytes and len(self.templates) > 1:
+            _, template = self.templates.popitem(last=False)
+            self.size -= len(template.prefix) + len(template.tail)
+            self.evictions += 1
+
+    def get(self, key, build):
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None:
+                self.templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = build()
+        with self.lock:
+            if key not in self.templates:
+                self.templates[key] = template
+                self.size += len(template.prefix) + len(template.tail)
+                self._evict()
+        return template
+
+    def document(self, path):
+        """ Template of pdf at path as it is, render() gives its serialized content. """
+        return self.get(('document', path), lambda: PayloadTemplate(serializePdf(path)))
+
+    def whoAmI(self, path, binary):
+        """ PdfTemplate of pdf at path with WhoAmI made of binary and unique part of each publication. """
+        return self.get(('whoAmI', path, len(binary)), lambda: PdfTemplate(serializePdf(path, binary + WHOAMI_MARKER)))
+
+    def stats(self):
+        with self.lock:
+            return {'templates': len(self.templates), 'bytes': self.size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+# corpus file: header (magic, offset and length of json index), documents, index
+CORPUS_MAGIC = b'DMTCORPUS1\n'
+CORPUS_HEADER = struct.Struct('<{}sQQ'.format(len(CORPUS_MAGIC)))
+
+
+class CorpusDocument:
+    """ Document stored in a Corpus: slice of its mapping with md5 computed when the corpus was prepared. """
+    __slots__ = ('view', 'md5')
+
+    def __init__(self, view, md5):
+        self.view = view
+        self.md5 = md5
+
+    def __len__(self):
+        return len(self.view)
+
+    def __bytes__(self):
+        return bytes(self.view)
+
+    def parts(self):
+        return self.view,
+
+    def hexdigest(self, hasher):
+        if hasher.name == 'md5':
+            return self.md5
+        return hasher.hexdigest(self.view)
+
+    def b64chunks(self):
+        return [base64.b64encode(self.view)]
+
+
+class CorpusWriter:
+    """
+    Writes a corpus file. Publications are added per publisher url in order of publishing,
+    documents with the same key (source path) are stored once.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(CORPUS_HEADER.pack(CORPUS_MAGIC, 0, 0))
+        self.publishers = {}
+        self.stored = {}
+        self.bytes = 0
+
+    def addDocument(self, key, build):
+        entry = self.stored.get(key)
+        if entry is None:
+            content = build()
+            entry = [self.file.tell(), len(content), hashlib.md5(content).hexdigest()]
+            self.file.write(content)
+            self.bytes += len(content)
+            self.stored[key] = entry
+        return entry
+
+    def addPublication(self, url, docs, additional_details, category, title, cif, receiver_url):
+        self.publishers.setdefault(url, []).append({
+            'docs': docs, 'additional_details': additional_details, 'category': category,
+            'title': title, 'cif': cif, 'receiver_url': receiver_url})
+
+    def close(self):
+        index = json.dumps({'publishers': self.publishers}).encode()
+        offset = self.file.tell()
+        self.file.write(index)
+        self.file.seek(0)
+        self.file.write(CORPUS_HEADER.pack(CORPUS_MAGIC, offset, len(index)))
+        self.file.close()
+
+
+class Corpus:
+    """ Read only memory mapping of a corpus file written by CorpusWriter. """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, offset, length = CORPUS_HEADER.unpack_from(self.mapping)
+        if magic != CORPUS_MAGIC or offset == 0:
+            raise ValueError('{} is not a complete corpus file'.format(path))
+        self.view = memoryview(self.mapping)
+        self.publishers = json.loads(self.mapping[offset:offset + length])['publishers']
+
+    def publications(self, url):
+        """ Publications prepared for url, in order of publishing. """
+        return self.publishers.get(url, [])
+
+    def documents(self, publication):
+        return [CorpusDocument(self.view[offset:offset + length], md5) for offset, length, md5 in publication['docs']]
+
+
+class ContentHasher:
+    """
+    Digest of publication content written to the report: md5, blake2b, xxhash (needs xxhash package)
+    or none for runs where hashing should not cost anything.
+    Payloads and corpus documents are hashed by hexdigest(hasher), reusing their shared hash state.
+    """
+    NONE = 'NA'
+
+    def __init__(self, name='md5'):
+        self.name = name
+        if name == 'none':
+            self.new = None
+        elif name == 'xxhash':
+            import xxhash
+            self.new = getattr(xxhash, 'xxh3_64', xxhash.xxh64)
+        else:
+            self.new = getattr(hashlib, name)
+
+    def hexdigest(self, content):
+        if self.new is None:
+            return self.NONE
+        if hasattr(content, 'hexdigest'):
+            return content.hexdigest(self)
+        state = self.new()
+        state.update(content)
+        return state.hexdigest()
@@ -0,0 +1,229 @@
+# 2023-10-12
+"""
+Profiling of DurableMediaTest (--profile).
+
+Profiler runs in every publisher worker process around sendPublishDocument and in the main process around
+the pool, every thread started while profiling is covered (thread pool, event loop, SOAP layer).
+    cpu   - cProfile in every thread measuring CPU time of the thread [us], no time is counted while waiting for answers
+    wall  - stacks of all threads sampled every --profile_interval seconds, weighted by wall time [us], waiting included
+    alloc - tracemalloc, snapshot of live allocations taken when traced memory was at its maximum [B]
+Every process writes <report>_profile/<publisher>.collapsed (folded stacks "frame;frame;frame value", input of
+flamegraph.pl, inferno or speedscope; a --workers process running more publisher shards writes one profile named
+<shard>+<shard>...), cpu also <publisher>.prof (pstats) and alloc <publisher>.tracemalloc
+(tracemalloc.Snapshot.load). Main process merges profiles of all processes into <report>_profile.collapsed
+(and <report>_profile.prof).
+"""
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+MODES = ('cpu', 'wall', 'alloc')
+# frames kept by tracemalloc for every allocation (most recent ones), tracing of deeper stacks slows publishing down
+ALLOC_FRAMES = 16
+# seconds between checks of traced memory, snapshot is retaken when it grew by ALLOC_GROWTH
+ALLOC_INTERVAL = 1.0
+ALLOC_GROWTH = 1.1
+# stacks built from cProfile call graph under this share of total time are cut off
+CPU_THRESHOLD = 1e-4
+
+
+def profileDirectory(reportBase):
+    return reportBase + '_profile'
+
+
+def profileLabel(url):
+    """ File name of publisher profile, e.g. 10.0.0.1_31404 for http://10.0.0.1:31404. """
+    return url.split('://')[-1].strip('/').replace(':', '_').replace('/', '_')
+
+
+def functionName(func):
+    filename, _, name = func
+    if filename == '~':
+        return name
+    return '{}:{}'.format(os.path.basename(filename), name)
+
+
+def callGraphStacks(stats):
+    """
+    Collapsed stacks of pstats stats [us]. cProfile keeps only direct callers, so time of a function is divided
+    among stacks leading to it in proportion to time spent under each caller, contexts deeper than one caller are estimated.
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    total = sum(tt for _, _, tt, _, _ in stats.values())
+    threshold = total * CPU_THRESHOLD
+    stacks = Counter()
+
+    def walk(func, path, weight):
+        _, _, tt, ct, _ = stats[func]
+        scale = weight / ct if ct > 0 else 0.0
+        path = path + (func,)
+        stack = ';'.join(functionName(frame) for frame in path)
+        stacks[stack] += tt * scale * 1e6
+        for child, edgeTime in children.get(func, ()):
+            childWeight = edgeTime * scale
+            if childWeight < threshold or child in path:
+                # kept in its caller, so totals do not change
+                stacks[stack] += childWeight * 1e6
+            else:
+                walk(child, path, childWeight)
+
+    for func, (_, _, _, ct, callers) in stats.items():
+        if not callers:
+            walk(func, (), ct)
+    return stacks
+
+
+def writeCollapsed(path, stacks):
+    with open(path, 'w') as file:
+        for stack, value in sorted(stacks.items()):
+            value = int(round(value))
+            if value > 0:
+                file.write('{} {}\n'.format(stack, value))
+
+
+def readCollapsed(path, stacks):
+    with open(path) as file:
+        for line in file:
+            stack, _, value = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(value)
+
+
+def mergeCollapsed(directory):
+    """ Sums collapsed stacks (and pstats) of all processes in directory, returns path of merged collapsed stacks. """
+    stacks = Counter()
+    for path in sorted(glob.glob(os.path.join(directory, '*.collapsed'))):
+        readCollapsed(path, stacks)
+    profiles = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    if profiles:
+        pstats.Stats(*profiles).dump_stats(directory + '.prof')
+    path = directory + '.collapsed'
+    writeCollapsed(path, stacks)
+    return path
+
+
+class Profiler:
+    """ Profile of the calling process, see module docstring. Used as context manager or by start() and stop(). """
+    def __init__(self, mode, directory, label, interval=0.01):
+        if mode not in MODES:
+            raise ValueError('unknown profile mode {}'.format(mode))
+        self.mode = mode
+        self.directory = directory
+        self.label = label
+        self.interval = interval
+        # collapsed stack -> us of CPU or wall time, bytes for alloc
+        self.stacks = Counter()
+        self.names = {}
+        # cProfile of every thread, cpu mode
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.snapshotSize = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        if self.mode == 'cpu':
+            self.profileThread()
+            threading.setprofile(self.profileThread)
+            return self
+        if self.mode == 'alloc':
+            # traces inherited from the forked parent belong to its profile
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            tracemalloc.start(ALLOC_FRAMES)
+        self.thread = threading.Thread(target=self.run, name='Profiler', daemon=True)
+        self.thread.start()
+        return self
+
+    def profileThread(self, *event):
+        """ Enables cProfile of the calling thread, new threads call it on their first profile event. """
+        profile = cProfile.Profile(time.thread_time)
+        with self.lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def run(self):
+        interval = ALLOC_INTERVAL if self.mode == 'alloc' else self.interval
+        last = time.perf_counter()
+        while not self.stopped.wait(interval):
+            now = time.perf_counter()
+            if self.mode == 'alloc':
+                self.sampleAllocations()
+            else:
+                self.sampleStacks(now - last)
+            last = now
+
+    def frameName(self, code):
+        name = self.names.get(code)
+        if name is None:
+            name = self.names[code] = '{}:{}'.format(os.path.basename(code.co_filename), getattr(code, 'co_qualname', code.co_name))
+        return name
+
+    def sampleStacks(self, elapsed):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frameName(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[';'.join(stack)] += elapsed * 1e6
+
+    def sampleAllocations(self):
+        size = tracemalloc.get_traced_memory()[0]
+        if size > self.snapshotSize * ALLOC_GROWTH:
+            self.snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+            self.snapshotSize = size
+
+    def stop(self):
+        """ Stops profiling and writes profile files, returns path of collapsed stacks. """
+        if self.mode == 'cpu':
+            threading.setprofile(None)
+            return self.write()
+        self.stopped.set()
+        self.thread.join()
+        if self.mode == 'alloc':
+            self.sampleAllocations()
+            tracemalloc.stop()
+        return self.write()
+
+    def write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.label)
+        if self.profiles:
+            stats = pstats.Stats()
+            with self.lock:
+                for profile in self.profiles:
+                    # disables profile of the calling thread, threads of pool are finished by now
+                    profile.create_stats()
+                    if profile.stats:
+                        stats.add(profile)
+            if stats.stats:
+                stats.dump_stats(path + '.prof')
+                self.stacks.update(callGraphStacks(stats.stats))
+        if self.snapshot is not None:
+            self.snapshot.dump(path + '.tracemalloc')
+            for stat in self.snapshot.statistics('traceback'):
+                # frames of tracemalloc are ordered from the oldest, as in collapsed stacks
+                self.stacks[';'.join('{}:{}'.format(os.path.basename(frame.filename), frame.lineno) for frame in stat.traceback)] += stat.size
+        writeCollapsed(path + '.collapsed', self.stacks)
+        return path + '.collapsed'
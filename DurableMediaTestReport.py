@@ -0,0 +1,183 @@
+# 2023-10-12
+"""
+Report sink of DurableMediaTest.
+
+Publisher processes collect records in ReportColumns (numeric columns in arrays, strings interned) and ship
+them as batches over a queue to one writer process, which keeps a single buffered handle to the report for the whole run.
+Report is written as csv (the original format), gzip compressed csv or parquet (needs pyarrow).
+Writer measures its backlog (batches waiting in the queue) and sends its stats back when closed.
+"""
+import gzip
+import multiprocessing
+import signal
+import sys
+import time
+from array import array
+
+REPORT_COLUMNS = (
+    'doc_hash', 'md5', 'pub_task_id', 'pub_address', 'cif', 'dur_time', 'status', 'pub_end_time', 'threads',
+    'start_brg_time', 'create_brg_time', 'published_brg_time', 'dur_brg_time', 'time_to_init', 'dur_read_time',
+    'prev_doc', 'published_by', 'read_by', 'intended_start', 'start_time',
+)
+CSV_HEADER = "doc_hash,md5,pub_task_id,pub_address,cif,dur_time,status,pub_end_time,threads,start_brg_time,create_brg_time,published_brg_time,dur_brg_time,time_to_init,read_time,prev_doc_hash,published_by,read_by,intended_start,start_time\n"
+CSV_RECORD = "{0},{1},{2},{3},{4},{5:.3f},{6:<11},{7},{8},{9:.3f},{10:.3f},{11:.3f},{12:.3f},{13:.3f},{14},{15},{16},{17},{18:.3f},{19:.3f}\n"
+FLOAT_COLUMNS = {'dur_time', 'pub_end_time', 'start_brg_time', 'create_brg_time', 'published_brg_time', 'dur_brg_time', 'time_to_init', 'intended_start', 'start_time'}
+INT_COLUMNS = {'threads'}
+# string columns with few distinct values, their values are interned
+INTERNED_COLUMNS = {'pub_address', 'cif', 'status', 'prev_doc', 'published_by', 'read_by'}
+EXTENSIONS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet'}
+
+
+class ReportColumns:
+    """
+    Report records stored column-wise in REPORT_COLUMNS order: floats in array('d'), ints in array('q'),
+    other values as strings. Compact in memory and cheap to pickle to the report writer.
+    """
+    __slots__ = ('columns',)
+
+    def __init__(self):
+        self.columns = tuple(array('d') if column in FLOAT_COLUMNS else array('q') if column in INT_COLUMNS else []
+                             for column in REPORT_COLUMNS)
+
+    def append(self, *row):
+        for column, name, value in zip(self.columns, REPORT_COLUMNS, row):
+            if name in FLOAT_COLUMNS or name in INT_COLUMNS:
+                column.append(value)
+            elif name in INTERNED_COLUMNS:
+                column.append(sys.intern(str(value)))
+            else:
+                column.append(str(value))
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def column(self, name):
+        return self.columns[REPORT_COLUMNS.index(name)]
+
+    def extend(self, other):
+        for column, values in zip(self.columns, other.columns):
+            column.extend(values)
+
+    def rows(self):
+        return zip(*self.columns)
+
+    def clear(self):
+        for column in self.columns:
+            del column[:]
+
+
+class CsvReportFile:
+    def __init__(self, path, compressed=False):
+        if compressed:
+            self.file = gzip.open(path, 'wt', compresslevel=6)
+        else:
+            self.file = open(path, 'w', buffering=1024 * 1024)
+        self.file.write(CSV_HEADER)
+
+    def write(self, batch):
+        self.file.write(''.join([CSV_RECORD.format(*row) for row in batch.rows()]))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetReportFile:
+    """ One row group per batch, columns of ReportColumns are converted without going through rows. """
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+
+        def columnType(column):
+            if column in FLOAT_COLUMNS:
+                return pyarrow.float64()
+            if column in INT_COLUMNS:
+                return pyarrow.int64()
+            return pyarrow.string()
+        self.schema = pyarrow.schema([(column, columnType(column)) for column in REPORT_COLUMNS])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, batch):
+        arrays = [self.pa.array(values, type=self.schema.field(column).type) for column, values in zip(REPORT_COLUMNS, batch.columns)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def openReportFile(path, report_format):
+    if report_format == 'parquet':
+        return ParquetReportFile(path)
+    return CsvReportFile(path, compressed=report_format == 'csv.gz')
+
+
+def runReportWriter(queue, results, path, report_format):
+    """ Body of the writer process, writes batches until None arrives and sends back its stats. """
+    # interrupted run still flushes everything shipped so far
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    report = openReportFile(path, report_format)
+    stats = {'batches': 0, 'records': 0, 'max_backlog': 0, 'backlog_sum': 0, 'write_time': 0}
+    try:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            try:
+                backlog = queue.qsize()
+            except NotImplementedError:
+                backlog = 0
+            start = time.perf_counter()
+            report.write(batch)
+            stats['write_time'] += time.perf_counter() - start
+            stats['batches'] += 1
+            stats['records'] += len(batch)
+            stats['backlog_sum'] += backlog
+            stats['max_backlog'] = max(stats['max_backlog'], backlog)
+    finally:
+        report.close()
+        results.send(stats)
+
+
+class ReportSink:
+    """
+    Writer process with queue of ReportColumns batches. Created in the main process before publisher processes
+    are forked, they inherit it and only put batches to the queue.
+    """
+    def __init__(self, path, report_format='csv'):
+        self.path = path
+        self.report_format = report_format
+        self.queue = multiprocessing.Queue()
+        self.results, child = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=runReportWriter, args=(self.queue, child, path, report_format),
+                                               name='ReportWriter', daemon=True)
+        self.stats = None
+
+    def start(self):
+        self.process.start()
+
+    def put(self, batch):
+        if len(batch):
+            self.queue.put(batch)
+
+    def backlog(self):
+        """ Batches waiting for the writer. """
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return 0
+
+    def close(self):
+        """ Waits until all shipped batches are written, returns writer stats. """
+        if self.stats is None:
+            self.queue.put(None)
+            self.stats = self.results.recv()
+            self.process.join()
+        return self.stats
+
+    def openSummary(self):
+        """ Text file for summary lines: end of csv report, appended gzip member or file next to parquet. """
+        if self.report_format == 'csv.gz':
+            return gzip.open(self.path, 'at')
+        if self.report_format == 'parquet':
+            return open(self.path[:-len(EXTENSIONS['parquet'])] + '_summary.txt', 'a')
+        return open(self.path, 'a')
@@ -0,0 +1,157 @@
+# 2023-10-12
+"""
+Max sustainable throughput search of DurableMediaTest (search action).
+
+Offered load is the number of publications kept in progress by every publisher (-m = -q = level).
+Each level is held for rounds of --search_step seconds until throughput and failure rate of two consecutive
+rounds agree within --search_settle (at most --search_rounds rounds). Level is past the knee when
+failures (rejections answered instead of PUBLISHING-INITIATED, timeouts, communication problems) exceed
+--search_max_fail, latency (time_to_init + dur_brg_time) exceeds --search_max_latency or throughput is lower
+than on a lower level. Levels are doubled from -m until the knee or -q, then the knee is bisected until
+the step is under --search_precision of the level.
+"""
+import logging
+
+logger = logging.getLogger("DurableMediaTest")
+
+
+class LevelResult:
+    """ Outcome of one round at a level, counts are summed over publishers. """
+    def __init__(self, level, elapsed, publishedOk, failures, mean_duration, mean_time_to_init, publishers):
+        self.level = level
+        self.elapsed = elapsed
+        self.publishedOk = publishedOk
+        # failed publications by status
+        self.failures = failures
+        self.mean_duration = mean_duration
+        self.mean_time_to_init = mean_time_to_init
+        # url -> successful publications
+        self.publishers = publishers
+        self.rounds = 1
+        self.verdict = None
+
+    @property
+    def publishedFail(self):
+        return sum(self.failures.values())
+
+    @property
+    def throughput(self):
+        return self.publishedOk / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def failRate(self):
+        finished = self.publishedOk + self.publishedFail
+        return self.publishedFail / finished if finished else 0.0
+
+    @property
+    def latency(self):
+        return self.mean_duration + self.mean_time_to_init
+
+    def countFailures(self, kind):
+        if kind == 'timeouts':
+            return sum(count for status, count in self.failures.items() if status.endswith('TIMEOUT'))
+        if kind == 'communication':
+            return sum(count for status, count in self.failures.items() if status.startswith('COMMUNICATION'))
+        return self.publishedFail - self.countFailures('timeouts') - self.countFailures('communication')
+
+    def publisherThroughput(self):
+        return {url: ok / self.elapsed if self.elapsed > 0 else 0.0 for url, ok in self.publishers.items()}
+
+
+class ThroughputSearch:
+    """ Chooses levels and judges them, rounds are run by runLevel(level, roundNo) returning LevelResult or None when interrupted. """
+    def __init__(self, runLevel, start, limit, rounds=5, settle=0.1, max_fail=0.01, max_latency=None, precision=0.1):
+        self.runLevel = runLevel
+        self.start = max(start, 1)
+        self.limit = max(limit, self.start)
+        self.rounds = max(rounds, 1)
+        self.settle = settle
+        self.max_fail = max_fail
+        self.max_latency = max_latency
+        self.precision = precision
+        # measured levels in order of measuring
+        self.curve = []
+        self.best = None
+        self.interrupted = False
+
+    def settled(self, previous, current):
+        if previous is None:
+            return False
+        if abs(current.failRate - previous.failRate) > max(self.settle * previous.failRate, self.max_fail / 2):
+            return False
+        return abs(current.throughput - previous.throughput) <= self.settle * max(previous.throughput, current.throughput)
+
+    def measure(self, level):
+        """ Holds level until it settles, returns its last round. """
+        previous = None
+        for roundNo in range(1, self.rounds + 1):
+            current = self.runLevel(level, roundNo)
+            if current is None:
+                self.interrupted = True
+                return None
+            current.rounds = roundNo
+            logger.critical('search level %d round %d: %.3f publications/s, failed %.2f%%, latency %.3fs',
+                            level, roundNo, current.throughput, current.failRate * 100, current.latency)
+            if self.settled(previous, current):
+                break
+            previous = current
+        return current
+
+    def judge(self, result):
+        """ Reason why result is past the knee, None when it is sustainable. """
+        if result.publishedOk == 0:
+            return 'no publication finished'
+        if result.failRate > self.max_fail:
+            return 'failed {:.2f}% (rejected {}, timeouts {}, communication {})'.format(
+                result.failRate * 100, result.countFailures('rejected'), result.countFailures('timeouts'), result.countFailures('communication'))
+        max_latency = self.max_latency
+        if max_latency is None and self.curve:
+            # without explicit limit latency may grow to 3 times latency of the lowest level
+            max_latency = 3 * self.curve[0].latency
+        if max_latency is not None and result.latency > max_latency:
+            return 'latency {:.3f}s over {:.3f}s'.format(result.latency, max_latency)
+        if self.best is not None and result.level > self.best.level and result.throughput < self.best.throughput:
+            return 'throughput {:.3f} lower than {:.3f} at level {}'.format(result.throughput, self.best.throughput, self.best.level)
+        return None
+
+    def probe(self, level):
+        result = self.measure(level)
+        if result is None:
+            return None
+        result.verdict = self.judge(result)
+        self.curve.append(result)
+        if result.verdict is None:
+            if self.best is None or result.throughput > self.best.throughput:
+                self.best = result
+        else:
+            logger.critical('search level %d is past the knee: %s', level, result.verdict)
+        return result
+
+    def run(self):
+        """ Doubling until the knee, then bisection. Returns the best sustainable level or None. """
+        good, bad = None, None
+        level = self.start
+        while True:
+            result = self.probe(level)
+            if result is None:
+                return self.best
+            if result.verdict is not None:
+                bad = level
+                break
+            good = level
+            if level >= self.limit:
+                logger.critical('search reached -q %d without finding the knee', self.limit)
+                return self.best
+            level = min(level * 2, self.limit)
+        if good is None:
+            return self.best
+        while bad - good > max(1, int(good * self.precision)):
+            level = (good + bad) // 2
+            result = self.probe(level)
+            if result is None:
+                return self.best
+            if result.verdict is None:
+                good = level
+            else:
+                bad = level
+        return self.best
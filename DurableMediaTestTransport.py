@@ -0,0 +1,274 @@
+# 2023-10-12
+"""
+Raw transport for the hot path of DurableMediaTest (--transport raw).
+
+SOAP requests for PublishPublicDocument, PublishPrivateDocument, GetPublishStatus and GetDocument
+are rendered from byte templates compiled once per operation and shape of parameters, only values are
+escaped and filled in per call. Answers are parsed with a pull parser that keeps only the fields
+DurableMediaTest uses, returned as objects with the same attribute names as zeep answers.
+Everything else (Setup, categories, Hello) still goes through SoapAPI.
+"""
+import asyncio
+import base64
+import datetime
+import glob
+import os
+import threading
+from types import SimpleNamespace
+from xml.etree.ElementTree import XMLPullParser, iterparse
+from xml.sax.saxutils import escape
+
+import requests
+
+DEFAULT_NAMESPACE = 'https://CKKDocumentPublishingInterface.dm.billongroup.com/'
+HEADERS = {'content-type': 'application/soap+xml'}
+
+# fields pulled out of answers, everything else is skipped
+ANSWER_FIELDS = {
+    'status', 'timestamp', 'jobId', 'documentBlockchainAddress', 'BLOCKCHAINpublicationDate',
+    'BLOCKCHAINestimMinPropagationTime', 'publisherId', 'previousDocumentBlockchainAddress', 'sourceDocument',
+}
+
+
+def namespaceFromWsdl(wsdl_dir, operation='PublishPublicDocument'):
+    """ Returns targetNamespace of the first wsdl in wsdl_dir that defines operation. """
+    for path in sorted(glob.glob(os.path.join(wsdl_dir, '*.wsdl'))):
+        with open(path, 'rb') as wsdl:
+            if operation.encode() not in wsdl.read():
+                continue
+        for _, element in iterparse(path, events=('start',)):
+            return element.get('targetNamespace', DEFAULT_NAMESPACE)
+    return DEFAULT_NAMESPACE
+
+
+class EnvelopeTemplates:
+    """ Byte templates of SOAP requests, compiled once per (operation, shape of params). """
+    def __init__(self, namespace=DEFAULT_NAMESPACE):
+        self.namespace = namespace
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def shape(params):
+        if isinstance(params, dict):
+            return tuple((key, EnvelopeTemplates.shape(value)) for key, value in params.items())
+        return None
+
+    def compile(self, operation, params):
+        chunks = []
+        paths = []
+        current = ['<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ckk="{}">'
+                   '<soapenv:Header/><soapenv:Body><ckk:{}><inParams>'.format(self.namespace, operation)]
+
+        def walk(node, path):
+            for key, value in node.items():
+                if isinstance(value, dict):
+                    current.append('<{}>'.format(key))
+                    walk(value, path + (key,))
+                    current.append('</{}>'.format(key))
+                else:
+                    current.append('<{}>'.format(key))
+                    chunks.append(''.join(current).encode())
+                    paths.append((path + (key,), key))
+                    current[:] = ['</{}>'.format(key)]
+        walk(params, ())
+        current.append('</inParams></ckk:{}></soapenv:Body></soapenv:Envelope>'.format(operation))
+        chunks.append(''.join(current).encode())
+        return chunks, paths
+
+    def render(self, operation, params):
+        """ Returns request body as list of byte chunks. """
+        key = (operation, self.shape(params))
+        template = self.templates.get(key)
+        if template is None:
+            with self.lock:
+                template = self.templates.setdefault(key, self.compile(operation, params))
+        chunks, paths = template
+        out = [chunks[0]]
+        for i, (path, tag) in enumerate(paths):
+            value = params
+            for key in path:
+                value = value[key]
+            out.extend(self.encodeValue(tag, value))
+            out.append(chunks[i + 1])
+        return out
+
+    @staticmethod
+    def encodeValue(tag, value):
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple)):
+            # repeated element, first opening and last closing tag are in the template
+            inner = ('</{0}><{0}>'.format(tag)).encode()
+            parts = []
+            for i, item in enumerate(value):
+                if i:
+                    parts.append(inner)
+                parts.extend(EnvelopeTemplates.encodeValue(tag, item))
+            return parts
+        if hasattr(value, 'b64chunks'):
+            return value.b64chunks()
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return [base64.b64encode(value)]
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        return [escape(str(value)).encode()]
+
+
+class AnswerParser:
+    """ Pulls ANSWER_FIELDS out of SOAP answer without building the whole tree. """
+    @staticmethod
+    def localName(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    @classmethod
+    def parse(cls, data):
+        parser = XMLPullParser(events=('end',))
+        parser.feed(data)
+        values = {}
+        for _, element in parser.read_events():
+            name = cls.localName(element.tag)
+            if name in ANSWER_FIELDS and name not in values:
+                text = element.text
+                if text is not None and text.strip():
+                    values[name] = text.strip()
+            element.clear()
+        parser.close()
+        return cls.answer(values)
+
+    @staticmethod
+    def answer(values):
+        source = values.get('sourceDocument')
+        documentData = SimpleNamespace(
+            previousDocumentBlockchainAddress=values.get('previousDocumentBlockchainAddress'),
+            sourceDocument=base64.b64decode(source) if source is not None else None)
+        return SimpleNamespace(
+            status=SimpleNamespace(status=values.get('status'), timestamp=datetime.datetime.now()),
+            jobId=values.get('jobId'),
+            documentBlockchainAddress=values.get('documentBlockchainAddress'),
+            BLOCKCHAINpublicationDate=values.get('BLOCKCHAINpublicationDate'),
+            BLOCKCHAINestimMinPropagationTime=values.get('BLOCKCHAINestimMinPropagationTime'),
+            documentInfo=SimpleNamespace(
+                documentData=documentData,
+                documentBlockchainData=SimpleNamespace(publisherId=values.get('publisherId'))))
+
+
+class AsyncConnectionPool:
+    """ Minimal keep-alive HTTP/1.1 client on asyncio streams, one per event loop and publisher. """
+    def __init__(self, ip, port, size):
+        self.ip = ip
+        self.port = int(port)
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(size)
+
+    async def post(self, body_chunks):
+        async with self.semaphore:
+            writer = None
+            reused = False
+            try:
+                reader, writer = self.idle.pop() if self.idle else await asyncio.open_connection(self.ip, self.port)
+                length = sum(len(chunk) for chunk in body_chunks)
+                writer.write('POST / HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: keep-alive\r\n\r\n'.format(
+                    self.ip, self.port, HEADERS['content-type'], length).encode())
+                writer.writelines(body_chunks)
+                await writer.drain()
+                status, keepAlive, data = await self.readResponse(reader)
+                if keepAlive:
+                    self.idle.append((reader, writer))
+                    reused = True
+                return status, data
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError) as e:
+                # ValueError and IndexError come from malformed status line, headers or chunk sizes
+                raise requests.ConnectionError('{}:{} {}'.format(self.ip, self.port, e))
+            finally:
+                # also on cancellation, connection with half read answer can not be reused
+                if writer is not None and not reused:
+                    writer.close()
+
+    @staticmethod
+    async def readResponse(reader):
+        statusLine = await reader.readuntil(b'\r\n')
+        status = int(statusLine.split(b' ', 2)[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keepAlive = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    await reader.readuntil(b'\r\n')
+                    break
+                parts.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return status, keepAlive, b''.join(parts)
+        if 'content-length' in headers:
+            return status, keepAlive, await reader.readexactly(int(headers['content-length']))
+        return status, False, await reader.read()
+
+
+class RequestBody:
+    """
+    Request body streamed chunk by chunk. Having length, requests sends it with Content-Length
+    instead of joining the chunks, so shared base64 of a Payload is never copied.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.length = sum(len(chunk) for chunk in chunks)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class RawPublisherEndpoint:
+    """ Hot path operations of SoapAPI.PublisherEndpoint sent as precompiled envelopes. """
+    OPERATIONS = ('PublishPublicDocument', 'PublishPrivateDocument', 'GetPublishStatus', 'GetDocument')
+
+    def __init__(self, ip, port, templates, session):
+        self.ip = ip
+        self.port = port
+        self.url = 'http://{}:{}'.format(ip, port)
+        self.templates = templates
+        self.session = session
+        self.asyncPools = {}
+
+    def render(self, operation, params):
+        if operation not in self.OPERATIONS:
+            raise AttributeError(operation)
+        return self.templates.render(operation, params)
+
+    def call(self, operation, params):
+        res = self.session.post(self.url, data=RequestBody(self.render(operation, params)), headers=HEADERS)
+        res.raise_for_status()
+        return AnswerParser.parse(res.content)
+
+    async def callAsync(self, operation, params, concurrency):
+        """ Call on connection pool of the running loop, pool of a loop is sized by concurrency of its first call. """
+        loop = asyncio.get_running_loop()
+        pool = self.asyncPools.get(loop)
+        if pool is None:
+            pool = self.asyncPools[loop] = AsyncConnectionPool(self.ip, self.port, concurrency)
+        status, data = await pool.post(self.render(operation, params))
+        if status >= 400:
+            raise requests.HTTPError('{} answered {} to {}'.format(self.url, status, operation))
+        return AnswerParser.parse(data)
+
+    def PublishPublicDocument(self, params):
+        return self.call('PublishPublicDocument', params)
+
+    def PublishPrivateDocument(self, params):
+        return self.call('PublishPrivateDocument', params)
+
+    def GetPublishStatus(self, params):
+        return self.call('GetPublishStatus', params)
+
+    def GetDocument(self, params):
+        return self.call('GetDocument', params)
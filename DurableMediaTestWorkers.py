@@ -0,0 +1,110 @@
+# 2023-10-12
+"""
+Placement of publishers on worker processes of DurableMediaTest (--workers, --publisher_shards).
+
+Without --workers every publisher gets its own process. With --workers N publishers are cut into shards
+and the shards are bin-packed onto at most N processes:
+    - shard k of K publishes documents (and corpus, pdf or csv items) k, k+K, ... of its publisher and gets
+      1/K of its slots (-m, -q) and of its --rate, so K processes drive one publisher together,
+    - shards are placed biggest first on the least loaded process, shards of one publisher on different processes,
+    - a process with more shards runs each of them in its own thread with its own thread pool or event loop.
+--workers auto is the number of CPUs the test may run on. Shards of publishers are given by --publisher_shards
+(K for all publishers or ip:port=K), when there are still more workers than shards, spare workers
+shard the publishers with most documents.
+"""
+import copy
+import itertools
+import os
+
+
+def availableCpus():
+    """ CPUs the process may run on, affinity and cpusets included. """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def workersCount(workers):
+    """ Value of --workers: 'auto' or positive number. """
+    if workers == 'auto':
+        return availableCpus()
+    return int(workers)
+
+
+def splitCount(total, index, count):
+    """ Part index of count of total, parts differ by at most one. """
+    return total // count + (1 if index < total % count else 0)
+
+
+class ShardPlan:
+    """ Part of one publisher run by one worker process. """
+    __slots__ = ('url', 'index', 'count', 'documents')
+
+    def __init__(self, url, index, count, documents):
+        self.url = url
+        self.index = index
+        self.count = count
+        self.documents = documents
+
+    @property
+    def label(self):
+        """ Name of shard in logs, metrics and profiles: url of the publisher for the first shard, url#2, url#3 ... """
+        if self.index == 0:
+            return self.url
+        return '{}#{}'.format(self.url, self.index + 1)
+
+    def items(self, iterable):
+        """ Items of the publisher belonging to this shard. """
+        if self.count == 1:
+            return iter(iterable)
+        return itertools.islice(iterable, self.index, None, self.count)
+
+    def conf(self, conf):
+        """ Copy of conf with slots, asyncio calls and rate of the shard. """
+        if self.count == 1:
+            return conf
+        conf = copy.copy(conf)
+        conf.min_queue_size = self.slots(conf.min_queue_size)
+        conf.max_queue_size = self.slots(conf.max_queue_size)
+        if conf.async_calls:
+            conf.async_calls = self.slots(conf.async_calls)
+        if conf.rate:
+            conf.rate = conf.rate / self.count
+        return conf
+
+    def slots(self, size):
+        # negative -q keeps its meaning, every shard has at least one slot
+        part = max(splitCount(abs(size), self.index, self.count), 1)
+        return -part if size < 0 else part
+
+
+def planShards(publishers, workers, shards, maxSlots):
+    """
+    Shards of publishers (url -> documents to publish). shards maps ip:port (or '' for all publishers) to number
+    of shards, other publishers get spare workers, at most maxSlots shards per publisher.
+    """
+    counts = {}
+    for url in publishers:
+        address = url.split('://')[-1]
+        counts[url] = min(shards.get(address, shards.get('', 1)), maxSlots)
+    automatic = [url for url in publishers if url.split('://')[-1] not in shards and '' not in shards]
+    while automatic and sum(counts.values()) < workers:
+        url = max(automatic, key=lambda url: (publishers[url] / counts[url], url))
+        if counts[url] >= maxSlots:
+            automatic.remove(url)
+            continue
+        counts[url] += 1
+    return [ShardPlan(url, index, counts[url], splitCount(documents, index, counts[url]))
+            for url, documents in publishers.items() for index in range(counts[url])]
+
+
+def packShards(plans, workers):
+    """ Shards grouped by worker process, biggest first on the least loaded one, empty workers are left out. """
+    groups = [[] for _ in range(max(min(workers, len(plans)), 1))]
+    loads = [0] * len(groups)
+    for plan in sorted(plans, key=lambda plan: (-plan.documents, plan.url, plan.index)):
+        worker = min(range(len(groups)), key=lambda k: (any(other.url == plan.url for other in groups[k]), loads[k], k))
+        groups[worker].append(plan)
+        loads[worker] += max(plan.documents, 1)
+    return [group for group in groups if group]
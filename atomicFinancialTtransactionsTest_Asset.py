@@ -1,10 +1,15 @@
+import argparse
+import asyncio
 import random
 import time
 import math
 import concurrent.futures
+import heapq
+import itertools
 import os
 import multiprocessing
 import json
+import threading
 from datetime import datetime
 import csv
 import yaml
@@ -12,6 +17,11 @@ import cnode
 import shutil
 import sys
 
+try:
+    from DurableMediaTestCluster import AgentLink, Coordinator, agentInfo, parseAddress
+except ImportError:
+    from colony_scripts.colony.tests.DurableMediaTestCluster import AgentLink, Coordinator, agentInfo, parseAddress
+
 
 class Bcolors:
     """ Colors for self.logging """
@@ -34,13 +44,259 @@ class TestData:
         self.duration = None
         self.assets_requested = []
         self.finished = False
+        # last poll which found transaction in progress and polls after its expected end, see TaskStatusTracker
+        self.polled_at = None
+        self.straggler_polls = 0
+        # payer loop ended, tracker stops polling the transaction
+        self.abandoned = False
+
+
+# seconds between refreshes of asset inventory of a cnode, it is refreshed sooner when it runs low
+INVENTORY_REFRESH_INTERVAL = 30
+
+
+class BackgroundCalls:
+    """
+    Background cnode calls of one process, e.g. inventory refreshes. One thread keeps calls ordered by the time
+    they are due and hands them to the executor shared with the asyncio engine (--threads), so threads of a process
+    do not grow with the number of cnodes.
+    """
+    def __init__(self, threads):
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.condition = threading.Condition()
+        # (due, counter, function, args)
+        self.heap = []
+        self.counter = itertools.count()
+        threading.Thread(target=self.run, name='BackgroundCalls', daemon=True).start()
+
+    def schedule(self, due, function, *args):
+        with self.condition:
+            heapq.heappush(self.heap, (due, next(self.counter), function, args))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                now = time.time()
+                while not self.heap or self.heap[0][0] > now:
+                    self.condition.wait(self.heap[0][0] - now if self.heap else None)
+                    now = time.time()
+                _, _, function, args = heapq.heappop(self.heap)
+            try:
+                self.executor.submit(function, *args)
+            except RuntimeError:
+                # executor is shut down at exit of the process
+                return
+
+
+background = None
+
+
+def get_background(threads=32):
+    """ BackgroundCalls of this process, threads are taken from the first call. """
+    global background
+    with registry_lock:
+        if background is None:
+            background = BackgroundCalls(threads)
+        return background
+
+
+class AssetInventory:
+    """
+    WAITING assets of one cnode known to this process, shared by payer loops of the cnode.
+    Assets of transactions in flight are reserved and never picked again. Inventory is fetched in the background
+    (BackgroundCalls) every INVENTORY_REFRESH_INTERVAL seconds or when less than low_water assets are available, so taking
+    assets never waits for get_assets. Assets transferred by finished transactions are left out of fetched
+    inventories until cnode stops listing them.
+    """
+    def __init__(self, address, low_water):
+        self.address = address
+        self.low_water = low_water
+        self.lock = threading.Lock()
+        self.available = set()
+        self.reserved = set()
+        # asset -> time its transfer finished
+        self.spent = {}
+        self.fetched = False
+        # refresh is scheduled or running
+        self.refreshing = False
+        self.refreshed_at = 0
+
+    def request_refresh(self, due=None):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        get_background().schedule(due or time.time(), self.refresh)
+
+    def refresh(self):
+        started = time.time()
+        try:
+            assets = set(map(lambda a: a['assetId'], cnode.get_assets(self.address, status=['WAITING'])))
+        except Exception as err:
+            print('asset inventory of ' + self.address + ' not refreshed: ' + str(err))
+            assets = None
+        with self.lock:
+            if assets is not None:
+                self.spent = {asset: finished for asset, finished in self.spent.items() if asset in assets or finished >= started}
+                self.available = assets - self.reserved - self.spent.keys()
+                self.fetched = True
+                self.refreshed_at = started
+            self.refreshing = False
+        get_background().schedule(started + INVENTORY_REFRESH_INTERVAL, self.refresh_periodic)
+
+    def refresh_periodic(self):
+        # skipped when the inventory was refreshed on request meanwhile, that refresh scheduled its own
+        if time.time() - self.refreshed_at >= INVENTORY_REFRESH_INTERVAL:
+            self.request_refresh()
+
+    def take(self, count):
+        """ Reserves count assets, None when not enough are available. """
+        with self.lock:
+            refresh = len(self.available) - count < self.low_water
+        if refresh:
+            self.request_refresh()
+        with self.lock:
+            if len(self.available) < count:
+                if self.fetched:
+                    print('not enough assets on cnode ' + self.address)
+                return None
+            assets = [self.available.pop() for _ in range(count)]
+            self.reserved.update(assets)
+            return assets
+
+    def release(self, assets, spent):
+        """ Ends reservation of assets when their transaction finished or did not start. """
+        with self.lock:
+            self.reserved.difference_update(assets)
+            if spent:
+                now = time.time()
+                for asset in assets:
+                    self.spent[asset] = now
+
+
+inventories = {}
+trackers = {}
+registry_lock = threading.Lock()
+
+
+def get_inventory(node, low_water):
+    """ AssetInventory of cnode in this process. """
+    address = cnode_address(node)
+    with registry_lock:
+        if address not in inventories:
+            inventories[address] = AssetInventory(address, low_water)
+        return inventories[address]
+
+
+class TaskStatusTracker:
+    """
+    Status checks of transactions started from one cnode in this process, shared by payer loops of the cnode.
+    Tasks are polled when they are due by BackgroundCalls of the process, on threads shared with other cnodes.
+    Until WARMUP FINISHED_OK transactions are seen tasks are polled every poll_interval to learn how long transactions take
+    (middle between the last poll in progress and the final one). Later a task is first polled SPREAD standard
+    deviations before its expected end, then every standard deviation (MIN_POLL_INTERVAL to poll_interval) until
+    SPREAD deviations after it, stragglers with exponential backoff up to MAX_POLL_INTERVAL.
+    end_time of a transaction is taken when its final status arrives, payer loops collect finished transactions
+    without cnode calls.
+    """
+    MIN_POLL_INTERVAL = 0.1
+    MAX_POLL_INTERVAL = 10
+    WARMUP = 10
+    SPREAD = 2
+
+    def __init__(self, address, poll_interval):
+        self.address = address
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        # task_id -> row of finished transaction
+        self.finished = {}
+        self.count = 0
+        self.mean = 0
+        self.m2 = 0
+        self.polls = 0
+
+    def track(self, test_data):
+        self.schedule(test_data, self.nextPoll(test_data, time.time()))
+
+    def schedule(self, test_data, due):
+        # polls of all cnodes of the process are ordered and run by BackgroundCalls
+        get_background().schedule(due, self.poll, test_data)
+
+    def collect(self, current):
+        """ Finished transactions of current with their rows. """
+        with self.condition:
+            return [(test_data, self.finished.pop(test_data.task_id)) for test_data in current if test_data.task_id in self.finished]
+
+    def forget(self, current):
+        """ Payer loop of current ended, e.g. with STUCK transactions, they are not polled any more. """
+        with self.condition:
+            for test_data in current:
+                test_data.abandoned = True
+                self.finished.pop(test_data.task_id, None)
+
+    def observe(self, duration):
+        # Welford, as StatusPollPolicy of DurableMediaTest, polls of a cnode run on many threads
+        with self.condition:
+            self.count += 1
+            delta = duration - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (duration - self.mean)
+
+    def nextPoll(self, test_data, now):
+        with self.condition:
+            count, mean, m2 = self.count, self.mean, self.m2
+        if count < self.WARMUP:
+            return now + self.poll_interval
+        std = math.sqrt(m2 / (count - 1))
+        interval = min(max(std, self.MIN_POLL_INTERVAL), self.poll_interval)
+        start = test_data.start_time / 1000
+        window_start = mean - self.SPREAD * std
+        window_end = mean + self.SPREAD * std
+        elapsed = now - start
+        if elapsed + interval < window_start:
+            return start + window_start
+        if elapsed <= window_end:
+            return now + interval
+        test_data.straggler_polls += 1
+        return now + min(interval * 2 ** test_data.straggler_polls, self.MAX_POLL_INTERVAL)
+
+    def poll(self, test_data):
+        if test_data.abandoned:
+            return
+        try:
+            finished, task_row = check_transaction(test_data)
+        except Exception as err:
+            print('status of ' + str(test_data.task_id) + ' on ' + self.address + ' not checked: ' + str(err))
+            finished, task_row = False, []
+        with self.condition:
+            self.polls += 1
+        if not finished:
+            test_data.polled_at = time.time()
+            self.schedule(test_data, self.nextPoll(test_data, test_data.polled_at))
+            return
+        if task_row[0] == 'FINISHED_OK':
+            in_progress = (test_data.polled_at or test_data.start_time / 1000) - test_data.start_time / 1000
+            self.observe((in_progress + task_row[3] / 1000) / 2)
+        with self.condition:
+            if not test_data.abandoned:
+                self.finished[test_data.task_id] = task_row
+
+
+def get_tracker(node, poll_interval):
+    """ TaskStatusTracker of cnode in this process. """
+    address = cnode_address(node)
+    with registry_lock:
+        if address not in trackers:
+            trackers[address] = TaskStatusTracker(address, poll_interval)
+        return trackers[address]
 
 
 class TestP2PFast:
     def __init__(self, parallel_per_cnode=1,
                  min_delay=1, tr_per_cnode=1, max_concurrent_tr_per_cnode=10, short_description='tekst',
                  success_level_percent=100, sleep=1, test_duration=60 * 1,
-                 num_of_instances=1, instance=1, wait_after_new_transaction=0.5):
+                 num_of_instances=1, instance=1, wait_after_new_transaction=0.5, engine='process', workers=None, threads=32):
         self.cnodes = self.findCnodes()
         self.processes = 0  # this is set below
         self.parallel_per_cnode = parallel_per_cnode
@@ -59,6 +315,11 @@ class TestP2PFast:
         self.num_of_instances = num_of_instances
         self.instance = instance
         self.wait_after_new_transaction = wait_after_new_transaction
+        # process - one process per payer loop, asyncio - payer loops as tasks of event loops in workers processes
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        # threads of every asyncio worker making blocking cnode calls
+        self.threads = threads
         self.name = 'TestAsset'
         self.ignoreFails = False
         self.success = 0
@@ -66,6 +327,9 @@ class TestP2PFast:
         self.total = 0
         self.timeStart = None
         self.timeStop = None
+        # agent of distributed test: results of processes are streamed to coordinator, see runAgent
+        self.cluster = None
+        self.full_result = {}
 
     def findCnodes(self):
         nodes_file = os.path.join('nodes_cnodes.yaml')
@@ -137,6 +401,8 @@ class TestP2PFast:
         return data[shift:] + data[:shift]
 
     def merge_results(self, result):
+        if self.cluster is not None:
+            self.cluster.send('result', result)
         success_size, failed_size, min_start_time, max_end_time, sum_time = result
         self.success += success_size
         self.failed += failed_size
@@ -146,6 +412,35 @@ class TestP2PFast:
         # here we only add -> number of transactions will be known at the end
         self.average_time += sum_time
 
+    def run_process_engine(self, aux, r1):
+        """ One process per payer loop. """
+        with multiprocessing.Pool(self.all_tests) as pool:
+            for i in range(0, self.processes):
+                pool.apply_async(make_set_of_transactions, args=(
+                    aux, i % self.processes, self.max_concurrent_tr_per_cnode, self.min_delay,
+                    self.time_to_end, self.sleep, self.wait_after_new_transaction),
+                                 kwds={'test_id': str(i + r1)},
+                                 callback=self.merge_results)
+            pool.close()
+            pool.join()
+
+    def run_async_engine(self, aux, r1):
+        """
+        Payer loops of all processes of the process engine run as tasks of event loops in self.workers processes,
+        blocking cnode calls go to a thread pool of every process. Loops keep their test_id, so transactions_summary is the same.
+        """
+        workers = max(min(self.workers, self.processes), 1)
+        with multiprocessing.Pool(workers) as pool:
+            for worker in range(workers):
+                payers = list(range(worker, self.processes, workers))
+                pool.apply_async(make_sets_of_transactions_async, args=(
+                    aux, [i % self.processes for i in payers], self.max_concurrent_tr_per_cnode, self.min_delay,
+                    self.time_to_end, self.sleep, self.wait_after_new_transaction),
+                                 kwds={'test_ids': [str(i + r1) for i in payers], 'threads': self.threads},
+                                 callback=self.merge_results)
+            pool.close()
+            pool.join()
+
     def test_p2p(self):
         debug = False
         aux = list(self.cnodes)
@@ -158,11 +453,9 @@ class TestP2PFast:
         test_desc = 'len(aux) ' + str(len(aux)) + ', self.min_delay ' + str(self.min_delay) + ', self.tr_per_cnode ' + \
                     str(self.tr_per_cnode) + ', self.max_concurrent_tr_per_cnode ' + \
                     str(self.max_concurrent_tr_per_cnode) + ', self.processes ' + str(self.all_tests) + ', instance ' + \
-                    str(self.instance) + '/' + str(self.num_of_instances)
+                    str(self.instance) + '/' + str(self.num_of_instances) + ', engine ' + self.engine
         print(test_desc)
 
-        futures = []
-
         r1 = random.randint(0, 1000000)  # * 1000
 
         self.logP2P('Lista self.cnodes: ' + str(self.cnodes))
@@ -179,15 +472,10 @@ class TestP2PFast:
                                           status=['WAITING'])
                 assets_start += map(lambda a: a['assetId'], assets)
 
-        with multiprocessing.Pool(self.all_tests) as pool:
-            for i in range(0, self.processes):
-                futures.append(pool.apply_async(make_set_of_transactions, args=(
-                    aux, i % self.processes, self.max_concurrent_tr_per_cnode, self.min_delay,
-                    self.time_to_end, self.sleep, self.wait_after_new_transaction),
-                                                kwds={'test_id': str(i + r1)},
-                                                callback=self.merge_results))
-            pool.close()
-            pool.join()
+        if self.engine == 'asyncio':
+            self.run_async_engine(aux, r1)
+        else:
+            self.run_process_engine(aux, r1)
         sufix = ('Success: ' + str(self.success)).ljust(12) + (' Failed: ' + str(self.failed)).ljust(
             10) + ' Total: ' + str(self.total)
         self.print_progress(self.success, self.total, suffix=sufix, decimals=1, bar_length=100, failed=self.failed)
@@ -241,17 +529,9 @@ class TestP2PFast:
                                                 asset_requested]
             else:
                 continue
+        self.full_result = full_result
 
-        result_path = os.path.join(result_path, 'final_result.csv')
-        with open(result_path, 'w') as f:
-            w = csv.writer(f, delimiter=' ')
-            w.writerow(
-                ['task_id', 'status', 'start_time', 'end_time', 'duration', 'sender', 'receiver', 'asset_requested'])
-            for k, v in full_result.items():
-                w.writerow([k, *v])
-            w.writerow([time_dur_msg])
-            w.writerow([stats_msg])
-            w.writerow([avg_time_msg])
+        writeFinalResult(os.path.join(result_path, 'final_result.csv'), full_result, [time_dur_msg, stats_msg, avg_time_msg])
 
         self.logP2P('Results in file: final_result.csv')
         print('Results in file: final_result.csv')
@@ -270,13 +550,88 @@ def logIds(content, payer):
         log.write(time_ + ' ' + content + '\n')
 
 
+def cnode_address(node):
+    return node['host'] + ':' + str(node['rest-webservice-port'])
+
+
+"""
+Transactions are generators yielding blocking cnode calls as (function, args), function None means sleep
+for args[0] seconds. Result of the call is sent back by the driver: run_steps calls it in the calling process
+(process engine), run_steps_async hands it to a thread pool of the event loop (asyncio engine).
+"""
+
+
+def run_steps(steps):
+    result = None
+    error = None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        function, args = call
+        try:
+            result, error = time.sleep(*args) if function is None else function(*args), None
+        except Exception as e:
+            result, error = None, e
+
+
+async def run_steps_async(steps, executor):
+    loop = asyncio.get_running_loop()
+    result = None
+    error = None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        function, args = call
+        try:
+            if function is None:
+                result, error = await asyncio.sleep(*args), None
+            else:
+                result, error = await loop.run_in_executor(executor, function, *args), None
+        except Exception as e:
+            result, error = None, e
+
+
 def start_asset_transaction(payer, receiver, test_id, asset_ids):
+    return run_steps(start_asset_transaction_steps(payer, receiver, test_id, asset_ids))
+
+
+def check_transaction(test_data):
+    return run_steps(check_transaction_steps(test_data))
+
+
+def make_set_of_transactions(clients, payer_id, max_concurrent_tr, min_delay, time_to_end, sleep,
+                             wait_after_new_transaction=0.5, test_id='', asset_number=1):
+    return run_steps(transaction_steps(clients, payer_id, max_concurrent_tr, min_delay, time_to_end, sleep,
+                                       wait_after_new_transaction, test_id, asset_number))
+
+
+def make_sets_of_transactions_async(clients, payer_ids, max_concurrent_tr, min_delay, time_to_end, sleep,
+                                    wait_after_new_transaction=0.5, test_ids=(), asset_number=1, threads=32):
+    """ Worker process of asyncio engine, returns results of payer loops merged as one result. """
+    # cnode calls of payer loops and background calls share one thread pool
+    executor = get_background(threads).executor
+
+    async def run():
+        return await asyncio.gather(*(
+            run_steps_async(transaction_steps(clients, payer_id, max_concurrent_tr, min_delay, time_to_end, sleep,
+                                              wait_after_new_transaction, test_id, asset_number), executor)
+            for payer_id, test_id in zip(payer_ids, test_ids)))
+
+    results = asyncio.run(run())
+    return (sum(result[0] for result in results), sum(result[1] for result in results),
+            min([result[2] for result in results], default=time_to_end), max([result[3] for result in results], default=0),
+            sum(result[4] for result in results))
+
+
+def start_asset_transaction_steps(payer, receiver, test_id, asset_ids):
     start_time = int(1000 * time.time())
     test_data = TestData(payer, receiver, test_id)
     test_data.assets_requested = asset_ids
-    response = cnode.send_assets(
-        test_data.payer['host'] + ':' + str(test_data.payer['rest-webservice-port']), asset_ids,
-        test_data.receiver['user'])
+    response = yield cnode.send_assets, (cnode_address(test_data.payer), asset_ids, test_data.receiver['user'])
     test_data.start_time = start_time
     if 'taskId' not in response:
         test_data.end_time = int(time.time() * 1000)
@@ -291,10 +646,8 @@ def start_asset_transaction(payer, receiver, test_id, asset_ids):
     return True, test_data
 
 
-def check_transaction(test_data):
-    status_res = cnode.get_task_status(
-        test_data.payer['host'] + ':' + str(test_data.payer['rest-webservice-port']),
-        test_data.task_id)
+def check_transaction_steps(test_data):
+    status_res = yield cnode.get_task_status, (cnode_address(test_data.payer), test_data.task_id)
     status = status_res['status'] if 'status' in status_res else ''
     if status.startswith('FINISH'):
         end_time = int(1000 * time.time())
@@ -306,8 +659,8 @@ def check_transaction(test_data):
         return False, []
 
 
-def make_set_of_transactions(clients, payer_id, max_concurrent_tr, min_delay, time_to_end, sleep,
-                             wait_after_new_transaction=0.5, test_id='', asset_number=1):
+def transaction_steps(clients, payer_id, max_concurrent_tr, min_delay, time_to_end, sleep,
+                      wait_after_new_transaction=0.5, test_id='', asset_number=1):
     size = 0
     failed_size = 0
     current = []
@@ -316,24 +669,23 @@ def make_set_of_transactions(clients, payer_id, max_concurrent_tr, min_delay, ti
     time_sum = 0
     statuses = {}
     time_to_finish_first = int(time.time() + 60)
-    asset_lists = {}
-    last_asset_send = set()
+    inventory = get_inventory(clients[payer_id], asset_number * (max_concurrent_tr + 1))
+    tracker = get_tracker(clients[payer_id], sleep)
     try:
         while time.time() < time_to_end:
-            # check all
-            for curr in current:
-                finished, task_row = check_transaction(curr)
-                if finished:
-                    statuses[curr.task_id] = task_row
-                    if task_row[0] is not None and task_row[0] == 'FINISHED_OK':
-                        size += 1
-                        time_sum += task_row[3]
-                    else:
-                        print('asset transfer form ' + curr.payer['user'] + '(' + curr.payer['host'] + ':' + str(
-                            curr.payer['rest-webservice-port']) + ') of asset:' + str(
-                            curr.assets_requested) + ' with status:' + task_row[0])
-                        failed_size += 1
-                    curr.finished = True
+            # collect finished, their status is polled by tracker
+            for curr, task_row in tracker.collect(current):
+                inventory.release(curr.assets_requested, spent=task_row[0] == 'FINISHED_OK')
+                statuses[curr.task_id] = task_row
+                if task_row[0] is not None and task_row[0] == 'FINISHED_OK':
+                    size += 1
+                    time_sum += task_row[3]
+                else:
+                    print('asset transfer form ' + curr.payer['user'] + '(' + curr.payer['host'] + ':' + str(
+                        curr.payer['rest-webservice-port']) + ') of asset:' + str(
+                        curr.assets_requested) + ' with status:' + task_row[0])
+                    failed_size += 1
+                curr.finished = True
             current = list(filter(lambda cur: cur.finished is not True, current))
             # start one of possible
             now = int(time.time())
@@ -347,35 +699,24 @@ def make_set_of_transactions(clients, payer_id, max_concurrent_tr, min_delay, ti
                     r2 = random.randint(1, len(clients) - 1)
                     payer = clients[payer_id]
                     receiver = clients[(payer_id + r2) % (len(clients))]
-                    if payer['user'] not in asset_lists or len(asset_lists[payer['user']]) < asset_number:
-                        assets = set(map(lambda a: a['assetId'],
-                                          cnode.get_assets(payer['host'] + ':' + str(payer['rest-webservice-port']),
-                                                           status=['WAITING'])))
-                        if last_asset_send.intersection(assets):
-                            assets = set(filter(lambda a: a not in last_asset_send, assets))
-
-                        if len(assets) < asset_number:
-                            print('not enough assets on cnode ' + payer['host'] + ':' + str(payer['rest-webservice-port']))
-                            time.sleep(5)
-                            break
-                    else:
-                        assets = asset_lists[payer['user']]
-                    assets_to_send = set([assets.pop() for _ in range(asset_number)])
-                    if set(assets_to_send).intersection(last_asset_send):
-                        print('wtf we picked the same asset again! ' + str(assets_to_send))
-                    result, test_data = start_asset_transaction(payer, receiver, test_id, list(assets_to_send))
-                    asset_lists[payer['user']] = assets
+                    assets_to_send = inventory.take(asset_number)
+                    if assets_to_send is None:
+                        # inventory is being refreshed, next sweep tries again
+                        break
+                    result, test_data = yield from start_asset_transaction_steps(payer, receiver, test_id, assets_to_send)
                     if not result:
                         # failed_size += 1
-                        pass
+                        inventory.release(assets_to_send, spent=False)
                     else:
-                        last_asset_send = assets_to_send
                         current.append(test_data)
-                    time.sleep(wait_after_new_transaction)
-            time.sleep(sleep)
+                        tracker.track(test_data)
+                    yield None, (wait_after_new_transaction,)
+            yield None, (sleep,)
         dumpStatuses(statuses, test_id)
     except Exception as err:
         print(str(err))
+    finally:
+        tracker.forget(current)
     return size, failed_size, min_start_time, max_end_time, time_sum
 
 
@@ -389,6 +730,96 @@ def dumpStatuses(stat_dict, test_id):
             w.writerow([task_id, *values])
 
 
+def writeFinalResult(path, full_result, messages):
+    with open(path, 'w') as f:
+        w = csv.writer(f, delimiter=' ')
+        w.writerow(
+            ['task_id', 'status', 'start_time', 'end_time', 'duration', 'sender', 'receiver', 'asset_requested'])
+        for k, v in full_result.items():
+            w.writerow([k, *v])
+        for message in messages:
+            w.writerow([message])
+
+
+def clearSummary():
+    dir_path = os.path.dirname(os.path.realpath(__file__))
+    dir_path = os.path.join(dir_path, 'transactions_summary')
+    if os.path.exists(dir_path):
+        shutil.rmtree(dir_path)
+
+
+def runCoordinator(args):
+    """
+    Distributed test: agents on other hosts (agent action) run instances of the test, coordinator splits
+    CNODEs between them (num_of_instances/instance), starts them at the same instant and merges their results
+    into final_result.csv. See DurableMediaTestCluster.
+    """
+    host, port = parseAddress(args.cluster)
+    coordinator = Coordinator(host, port, args.cluster_key, args.agents)
+    print('Coordinator listening on port ' + str(port) + ', waiting for ' + str(args.agents) + ' agents')
+    params = {'max_concurrent_tr_per_cnode': args.max_concurrent, 'test_duration': args.test_duration}
+    test_ = TestP2PFast(**params)
+    lock = threading.Lock()
+    full_result = {}
+    done = {}
+
+    def handle(agent, kind, payload):
+        with lock:
+            if kind == 'result':
+                test_.merge_results(payload)
+            elif kind == 'done':
+                full_result.update(payload['rows'])
+                done[agent.name] = payload['ok']
+            elif kind == 'lost':
+                print(agent.name + ' lost, its transactions are missing in results')
+                done[agent.name] = False
+
+    try:
+        agents = coordinator.register(threading.Event())
+        coordinator.listen(handle)
+        start_at = time.time() + args.start_delay
+        for instance, agent in enumerate(agents, 1):
+            agent.send('start', {'instance': instance, 'num_of_instances': len(agents), 'start_at': start_at, 'params': params})
+        coordinator.wait()
+    finally:
+        coordinator.close()
+
+    duration = max(int(time.time() - start_at), 1)
+    time_dur_msg = 'Duration of the test: ' + str(duration) + ' seconds'
+    stats_msg = 'statistic p2p test: avg ' + format(test_.success / duration, '.2f') + ' transactions per second.'
+    avg_time_msg = 'statistic p2p test: avg time tr: ' + format(test_.average_time / test_.success, '.2f') if test_.success else 0
+    sufix = ('Success: ' + str(test_.success)).ljust(12) + (' Failed: ' + str(test_.failed)).ljust(10) + ' Total: ' + str(test_.total)
+    test_.print_progress(test_.success, test_.total, suffix=sufix, decimals=1, bar_length=100, failed=test_.failed)
+    print(time_dur_msg)
+    print(stats_msg)
+    print(avg_time_msg)
+    writeFinalResult(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'final_result.csv'), full_result,
+                     [time_dur_msg, stats_msg, avg_time_msg, 'agents: ' + ', '.join(agent.name for agent in agents)])
+    print('Results in file: final_result.csv')
+    agents_ok = len(done) == len(agents) and all(done.values())
+    return agents_ok and test_.failed <= test_.success * (100 - test_.success_level_percent) / 100
+
+
+def runAgent(args):
+    """ Runs the instance of the test given by coordinator (coordinator action) at the instant it sets. """
+    link = AgentLink.connect(parseAddress(args.cluster), args.cluster_key, agentInfo())
+    try:
+        order = link.waitOrder()
+        if order is None:
+            print('Coordinator sent no work')
+            return False
+        link.waitUntil(order['start_at'])
+        # engine options are the options of this agent
+        test_ = TestP2PFast(num_of_instances=order['num_of_instances'], instance=order['instance'], engine=args.engine,
+                            workers=args.workers, threads=args.threads, **order['params'])
+        test_.cluster = link
+        ok = test_.runBool()
+        link.send('done', {'ok': ok, 'rows': test_.full_result})
+        return ok
+    finally:
+        link.close()
+
+
 def chunk(l, num_of_chunks, chunk_num):
     len_of_chunk, rest = divmod(len(l), num_of_chunks)
     if len_of_chunk % 2 == 1:
@@ -401,9 +832,31 @@ def chunk(l, num_of_chunks, chunk_num):
 
 
 if __name__ == "__main__":
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    dir_path = os.path.join(dir_path, 'transactions_summary')
-    if os.path.exists(dir_path):
-        shutil.rmtree(dir_path)
-    test_ = TestP2PFast(max_concurrent_tr_per_cnode=2, test_duration=60)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', help='run - single instance, coordinator and agent - test distributed over hosts',
+                        choices=['run', 'coordinator', 'agent'], nargs='?', default='run')
+    parser.add_argument('--cluster', help='host:port of coordinator, coordinator listens on it, agents connect to it')
+    parser.add_argument('--agents', help='Number of agents coordinator waits for', type=int, default=1)
+    parser.add_argument('--cluster_key', help='Shared secret key authenticating agents and coordinator, required by coordinator and agent')
+    parser.add_argument('--start_delay', help='Seconds between sending work to agents and their synchronized start', type=float, default=5.0)
+    parser.add_argument('--test_duration', help='Test duration in seconds', type=int, default=60)
+    parser.add_argument('--max_concurrent', help='Max concurrent transactions per CNODE', type=int, default=2)
+    parser.add_argument('--engine', help='process - process per payer loop, asyncio - payer loops as tasks in --workers processes',
+                        choices=['process', 'asyncio'], default='process')
+    parser.add_argument('--workers', help='Processes of asyncio engine, default number of CPUs', type=int)
+    parser.add_argument('--threads', help='Threads making cnode calls in every process of asyncio engine', type=int, default=32)
+    args = parser.parse_args()
+    if args.action != 'run' and args.cluster is None:
+        parser.error(args.action + ' action needs --cluster host:port')
+    if args.action != 'run' and not args.cluster_key:
+        parser.error(args.action + ' action needs --cluster_key')
+    if (args.workers is not None and args.workers < 1) or args.threads < 1:
+        parser.error('--workers and --threads must be at least 1')
+    clearSummary()
+    if args.action == 'coordinator':
+        sys.exit(0 if runCoordinator(args) else 1)
+    elif args.action == 'agent':
+        sys.exit(0 if runAgent(args) else 1)
+    test_ = TestP2PFast(max_concurrent_tr_per_cnode=args.max_concurrent, test_duration=args.test_duration,
+                        engine=args.engine, workers=args.workers, threads=args.threads)
     test_.runBool()